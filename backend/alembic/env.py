@@ -10,7 +10,7 @@ import os
 sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
 from app.core.config import Settings
 from app.db.base import SQLModel
-from app.models import user, role, user_role, pdf_document
+from app.models import user, address, pdf_document, pdf_chunk
 
 settings = Settings()
 
@@ -0,0 +1,41 @@
+"""pdfdocument content_hash and duplicate_of_id
+
+Revision ID: 0001_pdfdocument_dedup
+Revises:
+Create Date: 2026-10-17 22:00:00.000000
+
+Databases created by SQLModel.metadata.create_all before upload dedup lack these
+columns; create_all never alters an existing table. Statements are idempotent so
+the revision also applies cleanly to a database create_all has already brought
+up to date.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001_pdfdocument_dedup'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not op.get_context().as_sql and not sa.inspect(op.get_bind()).has_table("pdfdocument"):
+        return  # create_all builds the table with these columns on first start
+    op.execute("ALTER TABLE pdfdocument ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_pdfdocument_content_hash ON pdfdocument (content_hash)")
+    op.execute(
+        "ALTER TABLE pdfdocument ADD COLUMN IF NOT EXISTS duplicate_of_id UUID "
+        "REFERENCES pdfdocument (id)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE pdfdocument DROP COLUMN IF EXISTS duplicate_of_id")
+    op.execute("DROP INDEX IF EXISTS ix_pdfdocument_content_hash")
+    op.execute("ALTER TABLE pdfdocument DROP COLUMN IF EXISTS content_hash")
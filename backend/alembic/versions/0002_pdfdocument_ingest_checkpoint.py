@@ -0,0 +1,32 @@
+"""pdfdocument ingested_chunk_num
+
+Revision ID: 0002_ingest_checkpoint
+Revises: 0001_pdfdocument_dedup
+Create Date: 2026-10-17 22:10:00.000000
+
+Checkpoint of the last chunk the ingestion pipeline committed, so a redelivered
+document job resumes after it.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002_ingest_checkpoint'
+down_revision: Union[str, None] = '0001_pdfdocument_dedup'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not op.get_context().as_sql and not sa.inspect(op.get_bind()).has_table("pdfdocument"):
+        return  # create_all builds the table with this column on first start
+    op.execute("ALTER TABLE pdfdocument ADD COLUMN IF NOT EXISTS ingested_chunk_num INTEGER")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE pdfdocument DROP COLUMN IF EXISTS ingested_chunk_num")
@@ -0,0 +1,44 @@
+"""pdfchunk content_tsv and its GIN index
+
+Revision ID: 0003_pdfchunk_content_tsv
+Revises: 0002_ingest_checkpoint
+Create Date: 2026-10-17 22:20:00.000000
+
+Stored tsvector behind Postgres full-text search over chunks. Adding a stored
+generated column rewrites pdfchunk; the index is then built CONCURRENTLY so
+chunk writes are not blocked while it builds.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003_pdfchunk_content_tsv'
+down_revision: Union[str, None] = '0002_ingest_checkpoint'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not op.get_context().as_sql and not sa.inspect(op.get_bind()).has_table("pdfchunk"):
+        return  # create_all builds the table with this column on first start
+    op.execute(
+        "ALTER TABLE pdfchunk ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english', content)) STORED"
+    )
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pdfchunk_content_tsv "
+            "ON pdfchunk USING gin (content_tsv)"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_pdfchunk_content_tsv")
+    op.execute("ALTER TABLE pdfchunk DROP COLUMN IF EXISTS content_tsv")
@@ -0,0 +1,32 @@
+"""pdfdocument index_version
+
+Revision ID: 0004_index_version
+Revises: 0003_pdfchunk_content_tsv
+Create Date: 2026-10-17 22:30:00.000000
+
+Version bumped whenever a document's chunks are written; cached RAG answers are
+keyed on it. The constant default fills existing rows without a table rewrite.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004_index_version'
+down_revision: Union[str, None] = '0003_pdfchunk_content_tsv'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not op.get_context().as_sql and not sa.inspect(op.get_bind()).has_table("pdfdocument"):
+        return  # create_all builds the table with this column on first start
+    op.execute("ALTER TABLE pdfdocument ADD COLUMN IF NOT EXISTS index_version INTEGER NOT NULL DEFAULT 0")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE pdfdocument DROP COLUMN IF EXISTS index_version")
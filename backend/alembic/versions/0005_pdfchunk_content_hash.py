@@ -0,0 +1,37 @@
+"""pdfchunk content_hash
+
+Revision ID: 0005_pdfchunk_content_hash
+Revises: 0004_index_version
+Create Date: 2026-10-17 22:40:00.000000
+
+Hash of each chunk's normalized text, looked up by cross-document chunk dedup.
+Chunks stored before this revision keep a NULL hash and are simply never reused.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005_pdfchunk_content_hash'
+down_revision: Union[str, None] = '0004_index_version'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not op.get_context().as_sql and not sa.inspect(op.get_bind()).has_table("pdfchunk"):
+        return  # create_all builds the table with this column on first start
+    op.execute("ALTER TABLE pdfchunk ADD COLUMN IF NOT EXISTS content_hash VARCHAR")
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_pdfchunk_content_hash ON pdfchunk (content_hash)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_pdfchunk_content_hash")
+    op.execute("ALTER TABLE pdfchunk DROP COLUMN IF EXISTS content_hash")
@@ -4,7 +4,11 @@ from app.api.deps.db import get_session
 from app.models import PDFChunk
 from sqlalchemy import func
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+import uuid
+from app.models import PDFDocument
+from app.services.dedup import resolve_canonical
+from app.services.fts import search_chunks_fts
 
 router = APIRouter()
 
@@ -25,4 +29,36 @@ async def list_pdfs(
             .limit(limit)
         ).all()
     stats = [PDFChunkStats(filename=row[0], chunk_count=row[1]) for row in result]
-    return stats
\ No newline at end of file
+    return stats
+
+@router.get("/search")
+def search_chunks_keyword(
+    q: str = Query(..., min_length=1, description='Keywords, "quoted phrases", OR, -excluded'),
+    pdf_id: Optional[uuid.UUID] = None,
+    doc_type: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    session: Session = Depends(get_session)
+):
+    """Ranked Postgres full-text search over chunk content with highlighted snippets."""
+    filters = []
+    if pdf_id:
+        pdf = session.get(PDFDocument, pdf_id)
+        # Deduplicated uploads search the chunks of the document they link to
+        filters.append(("pdf_id", resolve_canonical(session, pdf).id if pdf else pdf_id))
+    if doc_type:
+        filters.append(("doc_type", doc_type))
+
+    hits = search_chunks_fts(session, q, filters=filters, limit=limit, offset=offset)
+    return {
+        "query": q,
+        "results": [{
+            "pdf_id": hit["pdf_id"],
+            "filename": hit["filename"],
+            "doc_type": hit["doc_type"],
+            "chunk_num": hit["chunk_num"],
+            "page": hit["page_no"],
+            "rank": hit["score"],
+            "snippet": hit["snippet"]
+        } for hit in hits]
+    }
\ No newline at end of file
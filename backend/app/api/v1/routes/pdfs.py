@@ -1,30 +1,36 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query
 from sqlmodel import Session, select, desc
 from pathlib import Path
-from typing import Optional, List, Dict
-import uuid
+from typing import Optional, List, Dict, Tuple
+from contextlib import aclosing
 import asyncio
+import uuid
 from app.api.deps.db import get_session
 from app.core.config import get_settings
 from app.models import PDFDocument, PDFDetailResponse, PDFChunk
-from app.services.pdf_reader import extract_full_text
-from app.services.chunking import smart_chunk_text, truncate_for_upload
+from app.services.chunking import truncate_for_upload
 #from app.services.doc_type import auto_detect_doc_type
 from app.services.doc_type_detector import detect_doc_type
-from app.services.weaviate_store import init_schema, store_pdf_in_weaviate, search_chunks, get_weaviate_client
-from app.services.llm_extractor import process_chunk_with_llm, generate_llm_response
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy import update
+from app.services.weaviate_store import ensure_schema, get_weaviate_client
+from app.services.vector_store import get_vector_store, search_chunks
+from app.services.llm_extractor import agenerate_llm_response, astream_llm_response
+from app.utils.streaming import stream_events
+from app.services.ingestion import upsert_pdf_chunks, process_batch_parallel
+from app.services.queue_producer import enqueue_document
+from app.services.pipeline import read_document_head
+from app.services.upload_storage import promote_upload, storage_key, stream_upload_to_tempfile, upload_root
+from app.services.dedup import find_duplicate, register_duplicate_upload, resolve_canonical
+from app.services.answer_cache import get_answer_cache
+from app.services.context_builder import build_context, format_context
+from app.services.multi_rag import answer_across_documents, resolve_fanout_documents
+from app.services.structured_extraction import aextract_structured_data
 import re, json
 import logging
-from datetime import datetime
-from contextlib import contextmanager
 
 settings = get_settings()
 router = APIRouter()
 
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
+UPLOAD_DIR = upload_root()
 
 @router.get("/")
 async def list_pdfs(session: Session = Depends(get_session)):
@@ -32,7 +38,6 @@ async def list_pdfs(session: Session = Depends(get_session)):
     client = get_weaviate_client()
     #client.collections.delete("PDFChunks")
     schema = client.collections.list_all(simple=False)
-    client.close()
     #print("schema")
     #print(schema)
 
@@ -66,13 +71,16 @@ async def get_pdf_detail(id: uuid.UUID, session: Session = Depends(get_session),
     }
     return PDFDetailResponse(**cleaned_data)
     
-@router.post("/rag/query")
-async def rag_query(
-    question: str,
-    pdf_id: str = None,
-    session: Session = Depends(get_session)
-):
+NO_HITS_RESULT = {
+    "answer": "No relevant information found in the knowledge base.",
+    "source": None,
+    "confidence": 0.0
+}
+
+def resolve_rag_scope(session: Session, pdf_id: Optional[str]) -> Tuple[Optional[PDFDocument], List[Tuple[str, str]]]:
+    """The document a question is scoped to (after dedup links) and the matching search filters."""
     filters = []
+    pdf_doc = None
 
     if pdf_id:
         try:
@@ -80,32 +88,20 @@ async def rag_query(
                 select(PDFDocument).where(PDFDocument.id == pdf_id)
             ).first()
             if pdf_doc:
+                # Deduplicated uploads search the chunks of the document they link to
+                pdf_doc = resolve_canonical(session, pdf_doc)
                 filters.append(("doc_type", pdf_doc.doc_type))
                 filters.append(("pdf_id", str(pdf_doc.id)))
         except Exception as e:
             logging.error(f"Error fetching PDF document: {e}")
             # Continue without filters if there's an error
+            pdf_doc = None
+    return pdf_doc, filters
 
-    try:
-        hits = search_chunks(question, filters=filters, limit=6)
-    except Exception as search_error:
-        logging.error(f"Search failed: {search_error}")
-        hits = []
-
-    if not hits:
-        return {
-            "result": {
-                "answer": "No relevant information found in the knowledge base.",
-                "source": None,
-                "confidence": 0.0
-            },
-            "retrieved_chunks": []
-        }
-
-    try:
-        contexts = [f"[Source: {h['filename']}, page {h.get('page_no', 'N/A')}] {h['content']}" for h in hits]
+def build_rag_prompt(question: str, passages: List[Dict]) -> str:
+    contexts = [format_context(p) for p in passages]
 
-        structured_prompt = f"""
+    return f"""
 Answer the question strictly using the provided context. 
 Return JSON with: answer, source, confidence (0 to 1).
 
@@ -115,12 +111,48 @@ Context:
 Question: {question}
 JSON:
 """
-        llm_output = generate_llm_response(structured_prompt)
-        
+
+@router.post("/rag/query")
+async def rag_query(
+    question: str,
+    pdf_id: str = None,
+    session: Session = Depends(get_session)
+):
+    pdf_doc, filters = resolve_rag_scope(session, pdf_id)
+
+    # Answers are cached per document version, so only document-scoped questions qualify
+    answer_cache = get_answer_cache() if pdf_doc else None
+    if answer_cache:
+        cached = await asyncio.to_thread(answer_cache.get, question, str(pdf_doc.id), pdf_doc.index_version)
+        if cached is not None:
+            return {**cached, "cached": True}
+
+    # Embedding and LLM calls wait on the shared limiter, so they stay off the event loop
+    try:
+        hits = await asyncio.to_thread(search_chunks, question, filters, settings.rag_candidate_hits)
+    except Exception as search_error:
+        logging.error(f"Search failed: {search_error}")
+        hits = []
+    # The prompt gets a token-budgeted, de-duplicated subset of the hits
+    hits = await asyncio.to_thread(build_context, question, hits)
+
+    if not hits:
         return {
+            "result": dict(NO_HITS_RESULT),
+            "retrieved_chunks": []
+        }
+
+    try:
+        structured_prompt = build_rag_prompt(question, hits)
+        llm_output = await agenerate_llm_response(structured_prompt)
+        response = {
             "result": llm_output,
             "retrieved_chunks": hits
         }
+        if answer_cache and llm_output.get("status"):
+            await asyncio.to_thread(answer_cache.set, question, str(pdf_doc.id), pdf_doc.index_version, response)
+        
+        return response
         
     except Exception as e:
         logging.error(f"LLM processing failed: {e}")
@@ -133,6 +165,112 @@ JSON:
             "retrieved_chunks": hits
         }
 
+@router.post("/rag/query/stream")
+async def rag_query_stream(
+    question: str,
+    pdf_id: str = None,
+    format: str = Query("sse", pattern="^(sse|ndjson)$"),
+    session: Session = Depends(get_session)
+):
+    """
+    rag_query as a stream: a "chunks" event with the retrieved chunks, then "token"
+    events as the answer is generated, then "done" (or "error") with the full result.
+    Disconnecting cancels the LLM request.
+    """
+    pdf_doc, filters = resolve_rag_scope(session, pdf_id)
+    answer_cache = get_answer_cache() if pdf_doc else None
+    cache_args = (question, str(pdf_doc.id), pdf_doc.index_version) if pdf_doc else None
+
+    async def events():
+        if answer_cache:
+            cached = await asyncio.to_thread(answer_cache.get, *cache_args)
+            if cached is not None:
+                yield {"type": "chunks", "retrieved_chunks": cached["retrieved_chunks"], "cached": True}
+                yield {"type": "done", "result": cached["result"], "cached": True}
+                return
+
+        candidates = await asyncio.to_thread(search_chunks, question, filters, settings.rag_candidate_hits)
+        hits = await asyncio.to_thread(build_context, question, candidates)
+        yield {"type": "chunks", "retrieved_chunks": hits}
+        if not hits:
+            yield {"type": "done", "result": dict(NO_HITS_RESULT)}
+            return
+
+        async with aclosing(astream_llm_response(build_rag_prompt(question, hits))) as tokens:
+            async for event in tokens:
+                if event["type"] == "done" and answer_cache:
+                    await asyncio.to_thread(answer_cache.set, *cache_args, {"result": event["result"], "retrieved_chunks": hits})
+                yield event
+
+    return stream_events(events(), format)
+
+@router.post("/rag/query/multi")
+async def rag_query_multi(
+    question: str,
+    pdf_ids: Optional[List[uuid.UUID]] = Query(None),
+    doc_type: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    """
+    Answer one question across several documents: the listed pdf_ids, every document of
+    doc_type, or both combined. Each document is searched and asked concurrently, then
+    the per-document findings are reduced into one answer.
+    """
+    if not pdf_ids and not doc_type:
+        raise HTTPException(status_code=400, detail="Provide pdf_ids or doc_type")
+
+    documents = resolve_fanout_documents(session, [str(i) for i in pdf_ids or []], doc_type)
+    if not documents:
+        return {"result": dict(NO_HITS_RESULT), "documents": [], "retrieved_chunks": []}
+
+    response = await answer_across_documents(question, documents)
+    if response["result"] is None:
+        response["result"] = dict(NO_HITS_RESULT)
+    return response
+
+@router.get("/rag/cache/stats")
+def rag_cache_stats():
+    cache = get_answer_cache()
+    return cache.stats() if cache else {"backend": "none"}
+
+@router.post("/{pdf_id}/extract")
+async def extract_pdf_structured_data(
+    pdf_id: uuid.UUID,
+    goal: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    """
+    Structured data for the whole document (map-reduce over all its chunks), saved
+    under extracted_data["structured_data"]. A document still being ingested is
+    extracted from the chunks stored so far.
+    """
+    pdf_doc = session.get(PDFDocument, pdf_id)
+    if not pdf_doc:
+        raise HTTPException(status_code=404, detail="PDF not found")
+    source = resolve_canonical(session, pdf_doc)
+
+    chunks = session.exec(
+        select(PDFChunk.content)
+        .where(PDFChunk.pdf_id == source.id)
+        .order_by(PDFChunk.chunk_num)
+    ).all()
+    if not chunks:
+        raise HTTPException(status_code=409, detail="PDF has no chunks yet")
+
+    result = await aextract_structured_data([{"content": c} for c in chunks], goal, pdf_doc.doc_type)
+    result["complete"] = source.status == "processed"
+
+    extracted_data = dict(pdf_doc.extracted_data or {})
+    extracted_data["structured_data"] = result["structured_data"]
+    pdf_doc.extracted_data = extracted_data
+    try:
+        session.add(pdf_doc)
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    return result
+
 @router.get("/{pdf_id}/chunks", response_model=List[Dict])
 def get_pdf_chunks(
     pdf_id: uuid.UUID,
@@ -140,6 +278,10 @@ def get_pdf_chunks(
     limit: int = 100,
     db: Session = Depends(get_session)
 ):
+    pdf = db.get(PDFDocument, pdf_id)
+    if pdf:
+        pdf_id = resolve_canonical(db, pdf).id
+
     chunks = db.query(PDFChunk)\
         .filter(PDFChunk.pdf_id == pdf_id)\
         .order_by(PDFChunk.chunk_num)\
@@ -161,51 +303,91 @@ def get_pdf_chunks(
 async def upload_and_index_pdf(
     file: UploadFile = File(...),
     doc_type: str | None = Form(None),
-    session: Session = Depends(get_session),
-    background_tasks: BackgroundTasks = None
+    session: Session = Depends(get_session)
 ):
     if not file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
-    content = await file.read()
+    # Stream to disk instead of holding the whole upload in memory
+    pdf_path, content_hash = await stream_upload_to_tempfile(file, UPLOAD_DIR)
+    try:
+        return await index_uploaded_pdf(pdf_path, content_hash, file.filename, doc_type, session)
+    finally:
+        # Renamed to UPLOAD_DIR/{id}.pdf on success; anything left is an aborted upload
+        pdf_path.unlink(missing_ok=True)
+
+
+async def index_uploaded_pdf(
+    pdf_path: Path,
+    content_hash: str,
+    filename: str,
+    doc_type: Optional[str],
+    session: Session
+):
+    # Same bytes already ingested: reuse that document's chunks and analyses
+    if settings.upload_dedup_mode != "off":
+        original = find_duplicate(session, content_hash, doc_type)
+        if original:
+            try:
+                pdf_doc = register_duplicate_upload(session, original, filename, content_hash, doc_type)
+            except Exception as e:
+                session.rollback()
+                raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+            total_chunks = (original.extracted_data or {}).get("total_chunks", 0)
+            return {
+                "message": "PDF already uploaded; reused existing chunks",
+                "filename": str(filename),
+                "pdf_id": str(pdf_doc.id),
+                "duplicate_of": str(original.id),
+                "processed_chunks": total_chunks if pdf_doc.status == "processed" else 0,
+                "total_chunks": total_chunks,
+                "doc_type": pdf_doc.doc_type,
+                "detection": "duplicate",
+                "status": pdf_doc.status
+            }
+
+    # Only the head of the document is parsed in the request; the rest streams through the worker pipeline
+    head_chars = max(settings.max_text_chars_upload, settings.doc_type_detect_max_chars)
     try:
-        full_text = extract_full_text(content)
-        chunks = smart_chunk_text(full_text)
+        page_texts, chunks, complete, boilerplate = await read_document_head(str(pdf_path), min_chunks=3, min_chars=head_chars)
     except Exception as e:
         raise HTTPException(500, f"Error processing PDF: {e}")
+    head_text = "\n".join(page_texts)
 
     detection_reason = "provided"
     if not doc_type:
-        doc_type, detection_reason = detect_doc_type(full_text)
+        doc_type, detection_reason = await asyncio.to_thread(detect_doc_type, head_text)
     
-    init_schema()
+    # No-op once the lifespan hook has created the schema
+    ensure_schema()
 
-    # # Process first 3 chunks in parallel for quick response
-    enhanced_chunks = []
-    processing_errors = []
-    # Process chunks in batches (first batch synchronously for quick response)
+    # Process first 3 chunks in parallel for quick response
     first_batch = chunks[:3]
-    for chunk in first_batch:
-        try:
-            processed = await process_chunk_with_llm(chunk, doc_type)
-            enhanced_chunks.append(processed)
-        except Exception as e:
-           processing_errors.append(f"Chunk {chunk['chunk_num']}: {str(e)}")
-           enhanced_chunks.append({**chunk, "processed": False})
+    enhanced_chunks = await process_batch_parallel(first_batch, doc_type)
+    processing_errors = [
+        f"Chunk {chunk['chunk_num']}: {chunk['llm_error']}"
+        for chunk in enhanced_chunks if chunk.get("llm_error")
+    ]
+    # Known up front only when the whole document fit in the head
+    total_chunks = len(chunks) if complete else None
+    done = complete and len(chunks) <= len(first_batch)
 
     
     # DB record
     pdf_doc = PDFDocument(
-        filename=file.filename,
-        extracted_text=truncate_for_upload(full_text),
+        filename=filename,
+        extracted_text=truncate_for_upload(page_texts),
         extracted_data={
             "initial_chunks": enhanced_chunks[:3],
-            "total_chunks": len(chunks),
-            "processing_errors": processing_errors
+            "total_chunks": total_chunks,
+            "processing_errors": processing_errors,
+            # Running headers/footers stripped before chunking, kept once here
+            "boilerplate": boilerplate
         },
         doc_type=doc_type,
-        status= "processing" if len(chunks) > 3 else "processed",
-        is_public=True
+        status="processed" if done else "processing",
+        is_public=True,
+        content_hash=content_hash
     )
 
     try:
@@ -216,17 +398,16 @@ async def upload_and_index_pdf(
         session.rollback()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     
-    # Persist the file
-    file_path = UPLOAD_DIR / f"{pdf_doc.id}.pdf"
-    with open(file_path, "wb") as f:
-        f.write(content)
+    # Persist the file where the workers can read it
+    stored_key = storage_key(pdf_doc.id)
+    promote_upload(pdf_path, UPLOAD_DIR / stored_key)
 
     try:
         # Create initial chunks with metadata
         initial_chunks = [{
             **chunk,
             "pdf_id": str(pdf_doc.id),
-            "filename": file.filename,
+            "filename": filename,
             "doc_type": doc_type
         } for chunk in enhanced_chunks]
 
@@ -234,7 +415,7 @@ async def upload_and_index_pdf(
 
         #Store in Weaviate
         try:
-            store_pdf_in_weaviate(str(pdf_doc.id), file.filename, enhanced_chunks, doc_type)
+            await asyncio.to_thread(get_vector_store().upsert, str(pdf_doc.id), filename, enhanced_chunks, doc_type)
             logging.info("Successfully stored in Weaviate")
         except Exception as weaviate_error:
             logging.error(f"Weaviate storage failed: {weaviate_error}")
@@ -245,6 +426,7 @@ async def upload_and_index_pdf(
         print("Chunk stored in PostgreSQL")
         try:
             upsert_pdf_chunks(session, initial_chunks)
+            session.commit()
             logging.info("Successfully stored in PostgreSQL")
         except Exception as postgres_error:
             print(f"PostgreSQL storage failed: {postgres_error}")
@@ -253,21 +435,20 @@ async def upload_and_index_pdf(
             raise HTTPException(500, f"Error processing PDF: {postgres_error}")
             # Continue with background tasks
 
-        # Schedule background processing for remaining chunks
-        remaining_count = len(chunks) - 3
-        if remaining_count > 0:
+        # Stream the rest of the document through the ingestion pipeline on a worker
+        if not done:
             try:
-                background_tasks.add_task(
-                    process_remaining_chunks,
+                job_id = enqueue_document(
                     pdf_id=str(pdf_doc.id),
-                    chunks=chunks[3:],
+                    storage_key=stored_key,
+                    filename=filename,
                     doc_type=doc_type,
-                    filename=file.filename
+                    skip_chunks=len(first_batch)
                 )
-                logging.info(f"Scheduled {remaining_count} chunks for background processing")
-            except Exception as bg_error:
-                print(f"Background task scheduling failed: {bg_error}")
-                logging.error(f"Background task scheduling failed: {bg_error}")
+                logging.info(f"Queued document job {job_id} for {pdf_doc.id}")
+            except Exception as queue_error:
+                print(f"Enqueueing document job failed: {queue_error}")
+                logging.error(f"Enqueueing document job failed: {queue_error}")
 
     except Exception as main_error:
         print(f"Critical error in chunk storage: {main_error}")
@@ -276,167 +457,12 @@ async def upload_and_index_pdf(
 
     return {
         "message": "PDF upload started",
-        "filename": str(file.filename),
+        "filename": str(filename),
         "pdf_id": str(pdf_doc.id),
         "processed_chunks": len(enhanced_chunks),
-        "total_chunks": len(chunks),
+        "total_chunks": total_chunks,
         "doc_type": doc_type,
         "detection": detection_reason,
-        "status": "processing" if len(chunks) > 3 else "processed"
+        "status": pdf_doc.status
     }
 
-
-@contextmanager
-def get_db_session():
-    """Get database session with context manager"""
-    db = next(get_session())
-    try:
-        yield db
-    except Exception:
-        db.rollback()
-        raise
-    finally:
-        db.close()
-
-async def process_remaining_chunks(
-    pdf_id: str, 
-    chunks: List[Dict], 
-    doc_type: str, 
-    filename: str,
-):
-    with get_db_session() as db:
-        try:
-            all_processed_chunks = []
-            
-            for i in range(0, len(chunks), 5):  # Process in batches of 5
-                batch = chunks[i:i+5]
-                # Process entire batch in parallel
-                try:
-                    processed_batch = await process_batch_parallel(batch, doc_type)
-                    all_processed_chunks.extend(processed_batch)
-                except Exception as batch_error:
-                    logging.error(f"Batch processing failed: {batch_error}")
-                    # Fallback: process failed chunks individually
-                    for chunk in batch:
-                        try:
-                            processed = await process_chunk_with_llm(chunk, doc_type)
-                            all_processed_chunks.append(processed)
-                        except Exception as e:
-                            all_processed_chunks.append({
-                                **chunk,
-                                "processed": False,
-                                "llm_error": str(e)
-                            })
-                
-                await asyncio.sleep(0.5) 
-                # Store in both databases
-
-                store_pdf_in_weaviate(pdf_id, filename, processed_batch, doc_type)
-                try:
-                    upsert_pdf_chunks(db, [{
-                        **chunk,
-                        "pdf_id": pdf_id,
-                        "filename": filename,
-                        "doc_type": doc_type
-                    } for chunk in all_processed_chunks])
-                    
-                    # Update main document status
-                    db.execute(
-                        update(PDFDocument)
-                        .where(PDFDocument.id == pdf_id)
-                        .values(status="processed")
-                    )
-                    db.commit()
-                    
-                except Exception as e:
-                    db.rollback()
-                    logging.error(f"Failed to store processed chunks: {e}")
-                    raise
-            # Update main document status
-            db.execute(
-                update(PDFDocument)
-                .where(PDFDocument.id == pdf_id)
-                .values(status="processed")
-            )
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            db.execute(
-                update(PDFDocument)
-                .where(PDFDocument.id == pdf_id)
-                .values(status="failed", error=str(e))
-            )
-            db.commit()
-            logging.error(f"Background task failed: {e}")
-
-def upsert_pdf_chunks(db: Session, chunks: List[Dict]):
-    """Bulk upsert chunks with conflict handling - optimized"""
-    if not chunks:
-        return
-    
-    # Prepare data for bulk insert
-    values_list = []
-    for chunk in chunks:
-        values_list.append({
-            "pdf_id": chunk["pdf_id"],
-            "filename": chunk["filename"],
-            "doc_type": chunk["doc_type"],
-            "chunk_num": chunk["chunk_num"],
-            "approx_page": chunk["approx_page"],
-            "char_count": chunk["char_count"],
-            "word_count": chunk["word_count"],
-            "token_estimate": chunk["token_estimate"],
-            "has_tables": chunk["has_tables"],
-            "has_figures": chunk["has_figures"],
-            "content": chunk["content"],
-            "llm_analysis": chunk.get("llm_analysis"),
-            "chunk_meta": {
-                "processed": chunk.get("processed", False),
-                "error": chunk.get("llm_error")
-            },
-            "created_at": datetime.utcnow()
-        })
-    
-    stmt = insert(PDFChunk).values(values_list)
-    
-    stmt = stmt.on_conflict_do_update(
-        index_elements=['pdf_id', 'chunk_num'],
-        set_={
-            'content': stmt.excluded.content,
-            'llm_analysis': stmt.excluded.llm_analysis,
-            'chunk_meta': stmt.excluded.chunk_meta
-        }
-    )
-    
-    db.execute(stmt)
-
-
-async def process_batch_parallel(batch: List[Dict], doc_type: str) -> List[Dict]:
-    """
-    Process a batch of chunks in parallel using OpenAI API
-    """
-    tasks = []
-    for chunk in batch:
-        # Create a task for each chunk
-        task = process_chunk_with_llm(chunk, doc_type)
-        tasks.append(task)
-    
-    # Process all chunks in parallel
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    # Process results and handle exceptions
-    processed_batch = []
-    for i, result in enumerate(results):
-        if isinstance(result, Exception):
-            # Handle error for this chunk
-            logging.error(f"Error processing chunk {i}: {result}")
-            processed_batch.append({
-                **batch[i],
-                "processed": False,
-                "llm_error": str(result)
-            })
-        else:
-            # Successful processing
-            processed_batch.append(result)
-    
-    return processed_batch
\ No newline at end of file
@@ -1,7 +1,11 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
 from pydantic import BaseModel
 from typing import Optional
-from app.services.llm_extractor import build_prompt, generate_llm_response
+from contextlib import aclosing
+from app.services.llm_extractor import build_prompt, generate_llm_response, astream_llm_response
+from app.utils.streaming import stream_events
+from app.services.llm_cache import get_llm_cache
+from app.services.structured_extraction import aextract_structured_data_from_text
 
 router = APIRouter()
 
@@ -18,3 +22,26 @@ def engineer_prompt(req: PromptRequest):
         "prompt": prompt,
         "response": response
     }
+
+@router.post("/engineer/stream")
+def engineer_prompt_stream(req: PromptRequest, format: str = Query("sse", pattern="^(sse|ndjson)$")):
+    """engineer_prompt as SSE/NDJSON: a "prompt" event, then "token" events, then "done" or "error"."""
+    prompt = build_prompt(req.text, req.goal, req.doc_type)
+
+    async def events():
+        yield {"type": "prompt", "prompt": prompt}
+        async with aclosing(astream_llm_response(prompt)) as tokens:
+            async for event in tokens:
+                yield event
+
+    return stream_events(events(), format)
+
+@router.post("/extract")
+async def extract_structured(req: PromptRequest):
+    """Structured data from the whole text: per-part extractions merged, then the goal applied."""
+    return await aextract_structured_data_from_text(req.text, req.goal, req.doc_type)
+
+@router.get("/cache/stats")
+def llm_cache_stats():
+    cache = get_llm_cache()
+    return cache.stats() if cache else {"backend": "none"}
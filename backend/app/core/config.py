@@ -17,16 +17,92 @@ class Settings(BaseSettings):
     jwt_algorithm: str = Field("HS256", alias="JWT_ALGORITHM")
     openai_api_key: str = Field(..., alias="OPENAI_API_KEY")
     access_token_expire_minutes: str = Field(..., alias="ACCESS_TOKEN_EXPIRE_MINUTES")
-    weaviate_url: str = "http://localhost:8080"
     weaviate_api_key: str | None = None
+    weaviate_host: str = "weaviate"
+    weaviate_port: int = 8080
+    weaviate_grpc_port: int = 50051
+    weaviate_health_check_seconds: float = 30.0
+    weaviate_batch_mode: str = "dynamic"  # dynamic | fixed | rate
+    weaviate_batch_size: int = 100
+    weaviate_batch_concurrency: int = 2
+    weaviate_batch_rpm: int = 600
+    weaviate_batch_retries: int = 3
     embedding_model: str = "text-embedding-3-small"
+    embedding_backend: str = "api"  # api (OpenAI, or Ollama when USE_OLLAMA) | hash | weaviate (text2vec module)
+    embedding_dimensions: int = 1536
+    embedding_batch_size: int = 128
+    embedding_cache_backend: str = "disk"  # memory | disk | redis | none
+    embedding_cache_path: str = "cache/embeddings.sqlite3"
+    embedding_cache_max_entries: int = 200000
+    vector_store_backend: str = "weaviate"  # weaviate | local
+    vector_store_fallback: bool = True  # mirror chunks locally and search there when Weaviate fails; app-side embeddings only
+    local_vector_store_path: str = "cache/vector_store"
+    search_rrf_fts: bool = False  # fuse Postgres full-text hits into search_chunks
+    search_rrf_k: int = 60
+    answer_cache_backend: str = "memory"  # memory | disk | redis | none
+    answer_cache_path: str = "cache/answers.sqlite3"
+    answer_cache_max_entries: int = 5000
+    answer_cache_ttl_seconds: int = 24 * 3600
+    answer_cache_semantic: bool = False
+    answer_cache_similarity_threshold: float = 0.92
+    rag_candidate_hits: int = 12  # search hits considered before MMR and the token budget
+    rag_context_token_budget: int = 3000
+    rag_mmr_lambda: float = 0.7  # 1.0 = relevance only, 0.0 = diversity only
+    rag_fanout_max_documents: int = 50
+    rag_fanout_concurrency: int = 8  # documents searched and asked at once
+    rag_fanout_doc_token_budget: int = 1000  # context tokens per document in the map step
+    rag_fanout_map_completion_tokens: int = 256
     chat_model: str = "gpt-4o-mini"
     max_chunk_chars: int = Field(..., alias="MAX_CHUNK_CHARS")
     max_overlaps: int = Field(..., alias="MAX_OVERLAPS")
+    chunk_size_unit: str = "chars"  # chars (MAX_CHUNK_CHARS) | tokens (MAX_CHUNK_TOKENS)
+    max_chunk_tokens: int = 512
+    chunk_overlap_tokens: int = 64
+    table_block_max_tokens: int = 512  # table rows grouped per chunk, header repeated in each
+    strip_boilerplate: bool = True  # drop running headers/footers/disclaimers before chunking
+    boilerplate_sample_pages: int = 10  # pages the repeated lines are learned from
+    boilerplate_min_page_ratio: float = 0.5  # share of sampled pages a line must repeat on
+    boilerplate_edge_lines: int = 3  # lines at the top and bottom of a page checked by position
     max_text_chars_upload: int = Field(..., alias="MAX_TEXT_CHARS_UPLOAD")
     doc_type_detect_use_llm: bool = True
     doc_type_detect_model: str = "gpt-4o-mini" 
-    doc_type_detect_max_chars: int = Field(..., alias="DOC_TYPE_DETECT_MAX_CHARS") 
+    doc_type_detect_max_chars: int = Field(..., alias="DOC_TYPE_DETECT_MAX_CHARS")
+    llm_max_concurrency: int = 8
+    llm_rpm_limit: int = 500
+    llm_tpm_limit: int = 200000
+    llm_completion_token_reserve: int = 512
+    llm_target_latency_seconds: float = 20.0
+    llm_retry_attempts: int = 6
+    llm_retry_max_wait_seconds: float = 60.0
+    llm_pack_chunks: bool = True
+    llm_pack_token_budget: int = 2000
+    llm_pack_max_chunks: int = 10
+    extraction_map_token_budget: int = 3000  # document text per map-step extraction call
+    extraction_map_concurrency: int = 8
+    llm_cache_backend: str = "memory"  # memory | disk | redis | none
+    llm_cache_path: str = "cache/llm_responses.sqlite3"
+    llm_cache_max_entries: int = 10000
+    llm_cache_ttl_seconds: int = 7 * 24 * 3600
+    pdf_extract_workers: int = 4
+    pdf_pages_per_task: int = 50
+    pdf_detect_tables: bool = True  # PyMuPDF find_tables on every page (slower parsing)
+    pipeline_lookahead_ranges: int = 2  # page ranges parsed ahead of the chunker
+    pipeline_buffer_batches: int = 2  # chunk batches buffered between pipeline stages
+    upload_block_size: int = 1024 * 1024
+    upload_dir: str = "uploads"  # stored PDFs; the API and every worker must see the same directory
+    upload_dedup_mode: str = "link"  # link | clone | off
+    chunk_dedup: bool = True  # reuse llm_analysis and vectors of chunks already analysed
+    chunk_dedup_near: bool = False  # near-duplicates (MinHash/LSH, in-process) skip the LLM and point at the match
+    chunk_dedup_near_threshold: float = 0.9  # estimated Jaccard similarity of word shingles
+    chunk_dedup_minhash_perms: int = 64
+    chunk_dedup_lsh_bands: int = 16  # must divide chunk_dedup_minhash_perms
+    chunk_dedup_lsh_max_entries: int = 100000
+    redis_url: str = "redis://localhost:6379/0"
+    queue_backend: str = "redis"  # redis | memory
+    queue_name: str = "chunk_jobs"
+    queue_batch_size: int = 20
+    queue_lease_seconds: int = 300
+    queue_max_deliveries: int = 5
 
     @property
     def database_url(self) -> str:
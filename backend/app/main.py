@@ -2,22 +2,48 @@
 from fastapi import FastAPI
 from app.api.api_router import api_router
 from app.db.session import init_llm_db
+from app.core.config import get_settings
+from app.services.pdf_reader import shutdown_extraction_pool
+from app.services.weaviate_store import aclose_weaviate_client, ensure_schema
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import contextlib
 import requests
-
-app = FastAPI(title="LLM PDF Extractor")
+import asyncio
+import logging
 
 #import sys
 #import os
 #sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..')))
 
-app = FastAPI(title="LLM PDF Extractor")
-
-# Run DB initialization on startup
-@app.on_event("startup")
-def on_startup():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Run DB initialization on startup
     init_llm_db()
 
+    # Open the shared Weaviate client and create the schema once, not per request
+    try:
+        await asyncio.to_thread(ensure_schema)
+    except Exception as e:
+        logging.error(f"Weaviate unavailable at startup, will connect on first use: {e}")
+
+    # Without Redis there is no separate worker process, so consume jobs in-process
+    worker_task = None
+    if get_settings().queue_backend == "memory":
+        from app.worker import run_worker
+        worker_task = asyncio.create_task(run_worker())
+
+    yield
+
+    if worker_task:
+        worker_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await worker_task
+    shutdown_extraction_pool()
+    await aclose_weaviate_client()
+
+app = FastAPI(title="LLM PDF Extractor", lifespan=lifespan)
+
 origins = [
     "http://localhost:5173",
     "http://127.0.0.1:5173",
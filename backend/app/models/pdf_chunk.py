@@ -5,6 +5,8 @@ from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from sqlmodel import SQLModel, Field
 from sqlalchemy import UniqueConstraint  # Add this import
+from sqlalchemy import Column, Computed, Index
+from sqlalchemy.dialects.postgresql import TSVECTOR
 
 class PDFChunk(SQLModel, table=True):
     __table_args__ = (
@@ -32,6 +34,7 @@ class PDFChunk(SQLModel, table=True):
     has_tables: bool = Field(default=False, nullable=False)
     has_figures: bool = Field(default=False, nullable=False)
     content: str = Field(nullable=False)
+    content_hash: Optional[str] = Field(default=None, index=True, nullable=True)
     chunk_meta: Dict[str, Any] = Field(
         default_factory=dict,
         nullable=False,
@@ -47,4 +50,16 @@ class PDFChunk(SQLModel, table=True):
         default_factory=datetime.utcnow,
         nullable=False,
         sa_column_kwargs={"server_default": func.now()}
-    )
\ No newline at end of file
+    )
+
+
+# Full-text search vector, maintained by Postgres. It lives on the table only (not as an
+# ORM attribute) so loading chunks never drags it along; query it via CONTENT_TSV.
+FTS_CONFIG = "english"
+CONTENT_TSV = Column(
+    "content_tsv",
+    TSVECTOR,
+    Computed(f"to_tsvector('{FTS_CONFIG}', content)", persisted=True),
+)
+PDFChunk.__table__.append_column(CONTENT_TSV)
+Index("ix_pdfchunk_content_tsv", CONTENT_TSV, postgresql_using="gin")
\ No newline at end of file
@@ -45,6 +45,14 @@ class PDFDocumentBase(SQLModel):
     is_public: bool = Field(default=False, sa_column=sa.Column(sa.Boolean, nullable=False))
     # Uploaded by (User)
     uploaded_by_id: uuid.UUID | None = Field(foreign_key="user.id")    
+    # SHA-256 of the uploaded bytes, used to skip re-processing identical files
+    content_hash: Optional[str] = Field(default=None, sa_column=sa.Column(sa.String(64), nullable=True, index=True))
+    # Set when this upload reuses another document's chunks instead of owning a copy
+    duplicate_of_id: Optional[uuid.UUID] = Field(default=None, foreign_key="pdfdocument.id", nullable=True)
+    # Highest chunk_num the ingestion pipeline has committed; a redelivered job resumes after it
+    ingested_chunk_num: Optional[int] = Field(default=None, sa_column=sa.Column(sa.Integer, nullable=True))
+    # Bumped whenever the document's chunks are written; cached RAG answers are keyed on it
+    index_version: int = Field(default=0, sa_column=sa.Column(sa.Integer, nullable=False, server_default="0"))
 
 class PDFDocument(PDFDocumentBase, table=True):    
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True, index=True)
@@ -0,0 +1,150 @@
+"""
+Answer cache for /pdfs/rag/query.
+
+Answers are keyed by (normalized question, pdf_id, index version). The version is
+PDFDocument.index_version, bumped whenever the document's chunks are written, so an
+answer can never outlive the chunks it was built from. With ANSWER_CACHE_SEMANTIC on,
+a question that misses exactly is compared (cosine on question embeddings) against
+questions already answered for the same document version.
+"""
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import get_settings
+from app.services.embeddings import get_embedding_service
+from app.services.llm_cache import CacheBackend, make_cache_backend
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """Case, punctuation and whitespace do not change the answer."""
+    return " ".join(re.findall(r"\w+", question.lower()))
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        backend: CacheBackend,
+        semantic: bool = False,
+        threshold: float = 0.92,
+        max_questions_per_doc: int = 256,
+        max_docs: int = 1024,
+    ):
+        self.backend = backend
+        self.semantic = semantic
+        self.threshold = threshold
+        self.max_questions_per_doc = max_questions_per_doc
+        self.max_docs = max_docs
+        # (pdf_id, version) -> [(unit question vector, exact key)], least recently used first
+        self._questions: "OrderedDict[Tuple[str, int], List[Tuple[np.ndarray, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _key(self, normalized: str, pdf_id: str, version: int) -> str:
+        return hashlib.sha256(f"{pdf_id}\0{version}\0{normalized}".encode()).hexdigest()
+
+    def _embed(self, normalized: str) -> np.ndarray:
+        vector = np.asarray(get_embedding_service().embed_query(normalized), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _read(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Answer cache read failed: {e}")
+            return None
+        return json.loads(value) if value is not None else None
+
+    def get(self, question: str, pdf_id: str, version: int) -> Optional[Dict[str, Any]]:
+        normalized = normalize_question(question)
+        answer = self._read(self._key(normalized, pdf_id, version))
+        if answer is not None:
+            self.hits += 1
+            return answer
+
+        if self.semantic:
+            with self._lock:
+                entries = list(self._questions.get((pdf_id, version), []))
+            if entries:
+                try:
+                    query = self._embed(normalized)
+                except Exception as e:
+                    logger.warning(f"Answer cache embedding failed: {e}")
+                    entries = []
+                if entries:
+                    similarities = np.stack([vector for vector, _ in entries]) @ query
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.threshold:
+                        answer = self._read(entries[best][1])
+                        if answer is not None:
+                            self.semantic_hits += 1
+                            return answer
+        self.misses += 1
+        return None
+
+    def set(self, question: str, pdf_id: str, version: int, answer: Dict[str, Any]) -> None:
+        normalized = normalize_question(question)
+        key = self._key(normalized, pdf_id, version)
+        try:
+            self.backend.set(key, json.dumps(answer, default=str))
+        except Exception as e:
+            logger.warning(f"Answer cache write failed: {e}")
+            return
+
+        if self.semantic:
+            try:
+                vector = self._embed(normalized)
+            except Exception as e:
+                logger.warning(f"Answer cache embedding failed: {e}")
+                return
+            with self._lock:
+                # A newer version makes this document's older questions unreachable; drop them
+                for stale in [k for k in self._questions if k[0] == pdf_id and k[1] != version]:
+                    del self._questions[stale]
+                entries = self._questions.setdefault((pdf_id, version), [])
+                self._questions.move_to_end((pdf_id, version))
+                entries.append((vector, key))
+                del entries[:-self.max_questions_per_doc]
+                while len(self._questions) > self.max_docs:
+                    self._questions.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "backend": settings.answer_cache_backend,
+            "semantic": self.semantic,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+        }
+
+
+@lru_cache
+def get_answer_cache() -> Optional[AnswerCache]:
+    backend = make_cache_backend(
+        settings.answer_cache_backend,
+        namespace="answers",
+        path=settings.answer_cache_path,
+        max_entries=settings.answer_cache_max_entries,
+        ttl=settings.answer_cache_ttl_seconds,
+    )
+    if backend is None:
+        return None
+    return AnswerCache(
+        backend,
+        semantic=settings.answer_cache_semantic,
+        threshold=settings.answer_cache_similarity_threshold,
+    )
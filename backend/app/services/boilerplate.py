@@ -0,0 +1,149 @@
+"""
+Running header/footer and boilerplate removal before chunking.
+
+Lines are fingerprinted after normalization (case and whitespace) together with their
+position: the first and last few lines of a page are counted as top/bottom lines, with
+digits masked so "Page 3 of 10" matches on every page, and long lines anywhere on the
+page (legal disclaimers) are counted without position and must match digits included,
+so a recurring row with a different date or amount on each page is kept. Lines inside
+tables (PDF layout or ASCII) are never fingerprinted. Fingerprints seen on enough of
+the first BOILERPLATE_SAMPLE_PAGES pages are stripped from every page and kept once
+as document metadata.
+
+The decision is made once from the sample, so pages still stream through in a
+single pass and every run over the same document strips the same lines.
+"""
+import hashlib
+import math
+import re
+from collections import Counter
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from app.core.config import get_settings
+from app.services.chunking import table_spans
+
+settings = get_settings()
+
+# Lines at least this long count as boilerplate wherever they sit on the page
+MIN_FREE_LINE_CHARS = 40
+
+
+def normalize_line(line: str, mask_digits: bool = True) -> str:
+    normalized = " ".join(line.lower().split())
+    return re.sub(r"\d+", "#", normalized) if mask_digits else normalized
+
+
+def _fingerprint(position: str, normalized: str) -> str:
+    return hashlib.blake2b(f"{position}\0{normalized}".encode(), digest_size=8).hexdigest()
+
+
+def _in_tables(start: int, end: int, tables: List[Dict]) -> bool:
+    return any(start < t["end"] and end > t["start"] for t in tables)
+
+
+class BoilerplateFilter:
+    def __init__(
+        self,
+        sample_pages: Optional[int] = None,
+        min_page_ratio: Optional[float] = None,
+        edge_lines: Optional[int] = None,
+    ):
+        self.sample_pages = sample_pages or settings.boilerplate_sample_pages
+        self.min_page_ratio = min_page_ratio or settings.boilerplate_min_page_ratio
+        self.edge_lines = edge_lines or settings.boilerplate_edge_lines
+        self._fingerprints: Set[str] = set()
+        self._entries: Dict[str, Dict] = {}
+
+    def _lines(self, page: Dict) -> List[Tuple[int, int, str, List[str]]]:
+        """(start, end, line, fingerprints) for each non-empty line outside tables."""
+        text = page["text"]
+        tables = table_spans(text, page.get("tables"))
+        spans = [
+            (m.start(), m.end(), m.group(0)) for m in re.finditer(r"[^\n]*\n|[^\n]+$", text)
+            if m.group(0).strip() and not _in_tables(m.start(), m.end(), tables)
+        ]
+        lines = []
+        for i, (start, end, line) in enumerate(spans):
+            masked = normalize_line(line)
+            exact = normalize_line(line, mask_digits=False)
+            fingerprints = []
+            if i < self.edge_lines:
+                fingerprints.append(_fingerprint(f"top:{i}", masked))
+            if len(spans) - 1 - i < self.edge_lines:
+                fingerprints.append(_fingerprint(f"bottom:{len(spans) - 1 - i}", masked))
+            if len(exact) >= MIN_FREE_LINE_CHARS:
+                fingerprints.append(_fingerprint("any", exact))
+            lines.append((start, end, line, fingerprints))
+        return lines
+
+    def learn(self, sample: List[Dict]):
+        """Decide which fingerprints are boilerplate from the sample pages."""
+        counts: Counter = Counter()
+        first_seen: Dict[str, str] = {}
+        for page in sample:
+            seen = set()
+            for _, _, line, fingerprints in self._lines(page):
+                for fp in fingerprints:
+                    seen.add(fp)
+                    first_seen.setdefault(fp, line.strip())
+            counts.update(seen)
+
+        threshold = max(2, math.ceil(self.min_page_ratio * len(sample)))
+        self._fingerprints = {fp for fp, n in counts.items() if n >= threshold}
+        # One metadata entry per distinct line, however many positions it matched
+        for fp in self._fingerprints:
+            text = first_seen[fp]
+            entry = self._entries.setdefault(normalize_line(text), {"text": text, "pages": 0})
+            entry["pages"] = max(entry["pages"], counts[fp])
+
+    def strip(self, page: Dict) -> Dict:
+        """The page without its boilerplate lines; table spans are shifted to match."""
+        if not self._fingerprints:
+            return page
+        text = page["text"]
+        removed = [(start, end) for start, end, _, fps in self._lines(page) if self._fingerprints.intersection(fps)]
+        if not removed:
+            return page
+
+        parts = []
+        last = 0
+        for start, end in removed:
+            parts.append(text[last:start])
+            last = end
+        parts.append(text[last:])
+
+        def shift(offset: int) -> int:
+            return offset - sum(end - start for start, end in removed if end <= offset)
+
+        stripped = {**page, "text": "".join(parts)}
+        if page.get("tables"):
+            stripped["tables"] = [
+                {**t, "start": shift(t["start"]), "end": shift(t["end"])} for t in page["tables"]
+            ]
+        return stripped
+
+    def metadata(self) -> List[Dict]:
+        """The boilerplate lines, once each, with the number of sampled pages they were on."""
+        return sorted(self._entries.values(), key=lambda e: -e["pages"])
+
+
+async def astrip_boilerplate(pages: AsyncIterator[Dict], boilerplate: BoilerplateFilter) -> AsyncIterator[Dict]:
+    """Stream pages without boilerplate, holding back only the sample pages."""
+    sample: Optional[List[Dict]] = []
+    try:
+        async for page in pages:
+            if sample is None:
+                yield boilerplate.strip(page)
+                continue
+            sample.append(page)
+            if len(sample) >= boilerplate.sample_pages:
+                boilerplate.learn(sample)
+                for held in sample:
+                    yield boilerplate.strip(held)
+                sample = None
+        if sample:
+            boilerplate.learn(sample)
+            for held in sample:
+                yield boilerplate.strip(held)
+    finally:
+        await pages.aclose()
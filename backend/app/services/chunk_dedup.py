@@ -0,0 +1,228 @@
+"""
+Cross-document chunk dedup for the analysis stage.
+
+Every chunk gets a content hash (sha256 of its whitespace-normalized text), stored on
+PDFChunk.content_hash. Before a batch goes to the LLM, its hashes are looked up among
+chunks of the same doc_type that were already analysed; a match copies that chunk's
+llm_analysis instead of asking again, and identical chunks within the batch are asked
+once. Exact matches carry the matched chunk's text as "embedding_text", so the vector
+stores embed the text whose vector is already in the embedding cache.
+
+With CHUNK_DEDUP_NEAR on, chunks that miss exactly are compared to chunks analysed
+earlier in this process through MinHash signatures over word shingles and LSH bands.
+A near duplicate may differ in exactly the values an analysis reports (amounts, dates),
+so it is not given the other chunk's analysis: it skips the LLM with llm_analysis left
+empty and a "dedup_source" pointer (content_hash and estimated similarity) to the
+chunk whose analysis covers it, and it is embedded from its own text.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session, select
+
+from app.core.config import get_settings
+from app.db.session import engine
+from app.models import PDFChunk
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Largest prime below 2**32: signatures fit in uint32 and a * x + b never overflows uint64
+PRIME_BELOW_2_32 = 4294967291
+SHINGLE_WORDS = 5
+
+
+def normalize_content(text: str) -> str:
+    return " ".join(text.split())
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(normalize_content(text).encode()).hexdigest()
+
+
+def find_analysed(doc_type: str, hashes: Iterable[str]) -> Dict[str, Dict]:
+    """content_hash -> {content, llm_analysis} of one successfully analysed chunk per hash."""
+    hashes = list(set(hashes))
+    if not hashes:
+        return {}
+    try:
+        with Session(engine) as session:
+            rows = session.exec(
+                select(PDFChunk.content_hash, PDFChunk.content, PDFChunk.llm_analysis)
+                .where(
+                    PDFChunk.content_hash.in_(hashes),
+                    PDFChunk.doc_type == doc_type,
+                    PDFChunk.chunk_meta["processed"].astext == "true",
+                    # Near duplicates only point at an analysis; they have none of their own
+                    PDFChunk.chunk_meta["dedup"].astext.is_distinct_from("near"),
+                )
+                .distinct(PDFChunk.content_hash)
+            ).all()
+    except SQLAlchemyError as e:
+        # Dedup only saves work; a failed lookup means every chunk is analysed
+        logger.warning(f"Chunk dedup lookup failed: {e}")
+        return {}
+    return {h: {"content": content, "llm_analysis": analysis} for h, content, analysis in rows}
+
+
+class MinHashLSH:
+    """In-process MinHash/LSH index of analysed chunks, bounded to max_entries (oldest evicted)."""
+
+    def __init__(self, num_perm: int, bands: int, max_entries: int, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("CHUNK_DEDUP_MINHASH_PERMS must be a multiple of CHUNK_DEDUP_LSH_BANDS")
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2**32, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, 2**32, size=(num_perm, 1), dtype=np.uint64)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self._signatures: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, bytes], set] = {}
+        self._lock = threading.Lock()
+
+    def signature(self, text: str) -> np.ndarray:
+        words = normalize_content(text).lower().split()
+        shingles = {
+            " ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))
+        }
+        x = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") for s in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        return ((self._a * x + self._b) % PRIME_BELOW_2_32).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, doc_type: str, signature: np.ndarray) -> List[Tuple[str, int, bytes]]:
+        return [
+            (doc_type, band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+            for band in range(self.bands)
+        ]
+
+    def add(self, doc_type: str, key: str, signature: np.ndarray):
+        with self._lock:
+            if (doc_type, key) in self._signatures:
+                self._signatures.move_to_end((doc_type, key))
+                return
+            self._signatures[(doc_type, key)] = signature
+            for band_key in self._band_keys(doc_type, signature):
+                self._buckets.setdefault(band_key, set()).add(key)
+            while len(self._signatures) > self.max_entries:
+                (old_type, old_key), old_signature = self._signatures.popitem(last=False)
+                for band_key in self._band_keys(old_type, old_signature):
+                    bucket = self._buckets.get(band_key)
+                    if bucket is not None:
+                        bucket.discard(old_key)
+                        if not bucket:
+                            del self._buckets[band_key]
+
+    def query(self, doc_type: str, signature: np.ndarray, threshold: float) -> List[Tuple[str, float]]:
+        """(key, estimated Jaccard similarity) reaching threshold, most similar first."""
+        with self._lock:
+            candidates = set()
+            for band_key in self._band_keys(doc_type, signature):
+                candidates.update(self._buckets.get(band_key, ()))
+            scored = [
+                (float(np.mean(self._signatures[(doc_type, key)] == signature)), key) for key in candidates
+            ]
+        return [(key, score) for score, key in sorted(scored, reverse=True) if score >= threshold]
+
+
+@lru_cache()
+def get_lsh_index() -> MinHashLSH:
+    return MinHashLSH(
+        settings.chunk_dedup_minhash_perms,
+        settings.chunk_dedup_lsh_bands,
+        settings.chunk_dedup_lsh_max_entries,
+    )
+
+
+def _reuse(chunk: Dict, source: Dict) -> Dict:
+    return {
+        **chunk,
+        "llm_analysis": source["llm_analysis"],
+        "processed": True,
+        "dedup": "exact",
+        "embedding_text": source["content"],
+    }
+
+
+def _point_to(chunk: Dict, dedup_source: Dict) -> Dict:
+    return {**chunk, "llm_analysis": None, "processed": True, "dedup": "near", "dedup_source": dedup_source}
+
+
+async def analyze_with_dedup(
+    batch: List[Dict],
+    doc_type: str,
+    analyze: Callable[[List[Dict], str], Awaitable[List[Dict]]],
+) -> List[Dict]:
+    """
+    Analyse a batch, sending only chunks never analysed before to ``analyze``.
+    Results keep the batch order and every chunk carries its content_hash.
+    """
+    chunks = [{**chunk, "content_hash": content_hash(chunk["content"])} for chunk in batch]
+    known = await asyncio.to_thread(find_analysed, doc_type, [c["content_hash"] for c in chunks])
+
+    results: List[Optional[Dict]] = [None] * len(chunks)
+    first_of: Dict[str, int] = {}
+    pending: List[int] = []
+    for i, chunk in enumerate(chunks):
+        if chunk["content_hash"] in known:
+            results[i] = _reuse(chunk, known[chunk["content_hash"]])
+        elif chunk["content_hash"] not in first_of:
+            first_of[chunk["content_hash"]] = i
+            pending.append(i)
+
+    signatures: Dict[int, np.ndarray] = {}
+    if settings.chunk_dedup_near and pending:
+        lsh = get_lsh_index()
+        candidates: Dict[int, List[Tuple[str, float]]] = {}
+        for i in pending:
+            signatures[i] = lsh.signature(chunks[i]["content"])
+            candidates[i] = lsh.query(doc_type, signatures[i], settings.chunk_dedup_near_threshold)
+        near = await asyncio.to_thread(
+            find_analysed, doc_type, [key for matches in candidates.values() for key, _ in matches]
+        )
+        for i, matches in candidates.items():
+            match = next(((key, score) for key, score in matches if key in near), None)
+            if match:
+                results[i] = _point_to(chunks[i], {"content_hash": match[0], "similarity": round(match[1], 3)})
+        pending = [i for i in pending if results[i] is None]
+
+    if pending:
+        analysed = await analyze([chunks[i] for i in pending], doc_type)
+        for i, result in zip(pending, analysed):
+            results[i] = {**result, "content_hash": chunks[i]["content_hash"]}
+
+    # Copies within the batch take whatever their first occurrence got
+    for i, chunk in enumerate(chunks):
+        if results[i] is not None:
+            continue
+        first = results[first_of[chunk["content_hash"]]]
+        if first.get("dedup") == "near":
+            results[i] = _point_to(chunk, first["dedup_source"])
+        elif first.get("processed"):
+            source = {"content": first.get("embedding_text", first["content"]), "llm_analysis": first.get("llm_analysis")}
+            results[i] = _reuse(chunk, source)
+        else:
+            results[i] = {**chunk, "processed": False, "llm_error": first.get("llm_error")}
+
+    if settings.chunk_dedup_near:
+        lsh = get_lsh_index()
+        for i, result in enumerate(results):
+            # Only chunks with an analysis of their own can be pointed at
+            if result.get("processed") and result.get("dedup") != "near":
+                signature = signatures.get(i)
+                lsh.add(doc_type, result["content_hash"], signature if signature is not None else lsh.signature(result["content"]))
+
+    reused = sum(1 for r in results if r.get("dedup"))
+    if reused:
+        logger.info(f"Chunk dedup: reused analysis for {reused} of {len(results)} chunks")
+    return results
@@ -1,10 +1,27 @@
 import re
-from typing import List, Dict
+from bisect import bisect_right
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from app.core.config import get_settings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from app.utils.tokens import count_tokens_batch, get_encoder
 
 settings = get_settings()
 
+# Token mode: at most this many characters per token are read ahead when sizing a chunk
+MAX_CHARS_PER_TOKEN = 8
+# Token mode: characters past the size limit that must be known before cutting, since
+# the last word of a window can still tokenize differently once more text arrives
+TOKEN_BOUNDARY_MARGIN = 32
+
+def token_sized_chunks() -> bool:
+    """CHUNK_SIZE_UNIT=tokens and a tiktoken encoder is available for the chat model."""
+    return settings.chunk_size_unit == "tokens" and get_encoder() is not None
+
+def max_overlap_chars() -> int:
+    """Upper bound on the text two consecutive chunks share."""
+    if token_sized_chunks():
+        return settings.chunk_overlap_tokens * MAX_CHARS_PER_TOKEN
+    return settings.max_overlaps
+
 def split_text_into_chunks(pages: List[Dict]) -> List[Dict]:
     """Simple fixed-size character chunking with page attribution."""
     CHUNK = settings.max_chunk_chars
@@ -20,102 +37,316 @@ def split_text_into_chunks(pages: List[Dict]) -> List[Dict]:
             i += max(CHUNK - OVER, 1)
     return chunks
 
-def smart_chunk_text(text: str, page_start: int = 1) -> List[Dict]:
-    """Enhanced chunking that preserves tables and maintains context"""
-    
-    # First identify and protect table structures
-    table_pattern = re.compile(
-        r'(\+[-]+\+[^\n]*\n)([^\n]*\|[^\n]*\n)+(\+[-]+\+)',
-        re.MULTILINE
-    )
-    
-    # Split text into tables and non-table segments
+# ASCII tables: +---+ border, | rows | (with optional +---+ separators), +---+ border
+TABLE_PATTERN = re.compile(
+    r'\+[-+]+\+[^\n]*\n(?:[^\n]*\|[^\n]*\n|\+[-+]+\+[^\n]*\n)*\+[-+]+\+',
+    re.MULTILINE
+)
+TABLE_BORDER = re.compile(r'^\s*\+[-+=]+\+\s*$')
+
+def _ascii_header_lines(table: str) -> int:
+    """Lines of an ASCII table that form its header: the top border and first row, plus the separator under it."""
+    lines = table.split('\n')
+    return 3 if len(lines) > 3 and TABLE_BORDER.match(lines[2]) else 2
+
+def table_spans(text: str, layout_tables: Optional[List[Dict]] = None) -> List[Dict]:
+    """Table spans from the PDF layout and the ASCII pattern, in order and without overlaps."""
+    spans = list(layout_tables or [])
+    for match in TABLE_PATTERN.finditer(text):
+        spans.append({"start": match.start(), "end": match.end(), "header_lines": _ascii_header_lines(match.group(0))})
+    kept = []
+    for span in sorted(spans, key=lambda s: s["start"]):
+        if not kept or span["start"] >= kept[-1]["end"]:
+            kept.append(span)
+    return kept
+
+def _split_segments(text: str, page: int, layout_tables: Optional[List[Dict]] = None) -> List[Dict]:
+    """Split text into tables and non-table segments, with their offsets in the page text"""
     segments = []
     last_end = 0
-    for match in table_pattern.finditer(text):
+    for span in table_spans(text, layout_tables):
         # Add text before table
-        if match.start() > last_end:
+        if span["start"] > last_end:
             segments.append({
                 'type': 'text',
-                'content': text[last_end:match.start()],
-                'page': page_start
+                'content': text[last_end:span["start"]],
+                'page': page,
+                'offset': last_end
             })
         
         # Add table
         segments.append({
             'type': 'table',
-            'content': match.group(0),
-            'page': page_start
+            'content': text[span["start"]:span["end"]],
+            'page': page,
+            'offset': span["start"],
+            'header_lines': span["header_lines"]
         })
-        last_end = match.end()
+        last_end = span["end"]
     
     # Add remaining text after last table
     if last_end < len(text):
         segments.append({
             'type': 'text',
             'content': text[last_end:],
-            'page': page_start
+            'page': page,
+            'offset': last_end
         })
+    return segments
 
-    # Process each segment appropriately
-    chunks = []
-    chunk_counter = 1
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=settings.max_chunk_chars,
-        chunk_overlap=settings.max_overlaps,
-        length_function=len,
-        separators=["\n\n", "\n", " ", ""]
-    )
-
-    for segment in segments:
-        if segment['type'] == 'table':
-            # Handle tables - keep each row as a chunk
-            table_rows = segment['content'].split('\n')
-            for row in table_rows:
-                if row.strip():  # Skip empty rows
-                    chunks.append({
-                        "content": row,
-                        "chunk_num": chunk_counter,
-                        "approx_page": segment['page'],
-                        "char_count": len(row),
-                        "word_count": len(row.split()),
-                        "token_estimate": len(row) // 4,
-                        "has_tables": True,
-                        "has_figures": False,
-                        "is_table_row": True
-                    })
-                    chunk_counter += 1
-        else:
-            # Process regular text with semantic splitting
-            for chunk in splitter.split_text(segment['content']):
-                chunks.append({
-                    "content": chunk,
-                    "chunk_num": chunk_counter,
-                    "approx_page": segment['page'],
-                    "char_count": len(chunk),
-                    "word_count": len(chunk.split()),
-                    "token_estimate": len(chunk) // 4,
-                    "has_tables": False,
-                    "has_figures": "Figure" in chunk[:100],
-                    "is_table_row": False
-                })
-                chunk_counter += 1
-
-    # Calculate accurate page numbers based on content density
-    total_chars = sum(len(chunk['content']) for chunk in chunks)
-    chars_per_page = total_chars / (page_start + len(chunks)/10)  # Adjust as needed
-    
-    current_page = page_start
-    current_page_chars = 0
-    for chunk in chunks:
-        current_page_chars += len(chunk['content'])
-        if current_page_chars > chars_per_page:
-            current_page += 1
-            current_page_chars = 0
-        chunk['approx_page'] = current_page
+def _make_chunk(
+    content: str,
+    chunk_num: int,
+    start_page: int,
+    end_page: int,
+    char_start: int,
+    char_end: Optional[int] = None,
+    table_rows: int = 0
+) -> Dict:
+    return {
+        "content": content,
+        "chunk_num": chunk_num,
+        "approx_page": start_page,
+        "start_page": start_page,
+        "end_page": end_page,
+        "char_start": char_start,
+        "char_end": char_start + len(content) if char_end is None else char_end,
+        "char_count": len(content),
+        "word_count": len(content.split()),
+        "token_estimate": len(content) // 4,
+        "has_tables": table_rows > 0,
+        "has_figures": not table_rows and "Figure" in content[:100],
+        "table_rows": table_rows
+    }
+
+def table_blocks(table: str, header_lines: int, max_tokens: int) -> List[Tuple[str, int, int, int]]:
+    """
+    Group a table's rows into blocks of at most max_tokens, each starting with the header.
+
+    Returns (content, start, end, rows) per block, where start/end are the offsets
+    within the table text of the rows the block covers (the header included for the
+    first block). Border lines between rows carry nothing and are dropped.
+    """
+    lines = [(m.group(0), m.start(), m.end()) for m in re.finditer(r"[^\n]+", table) if m.group(0).strip()]
+    header = lines[:header_lines]
+    rows = [line for line in lines[header_lines:] if not TABLE_BORDER.match(line[0])]
+    if not rows:
+        header, rows = [], lines
+    counts = count_tokens_batch([line[0] for line in header + rows])
+    header_tokens = sum(counts[:len(header)]) + len(header)
+    row_tokens = counts[len(header):]
+
+    blocks = []
+    current: List[Tuple[str, int, int]] = []
+    used = header_tokens
+    for row, tokens in zip(rows, row_tokens):
+        if current and used + tokens + 1 > max_tokens:
+            blocks.append(current)
+            current, used = [], header_tokens
+        current.append(row)
+        used += tokens + 1
+    if current:
+        blocks.append(current)
+
+    header_text = [line[0] for line in header]
+    return [(
+        "\n".join(header_text + [row[0] for row in block]),
+        header[0][1] if i == 0 and header else block[0][1],
+        block[-1][2],
+        len(block)
+    ) for i, block in enumerate(blocks)]
 
+def _count_tokens(chunks: List[Dict]) -> List[Dict]:
+    """Replace the len // 4 estimate with real token counts, one batch for all chunks."""
+    for chunk, tokens in zip(chunks, count_tokens_batch([chunk["content"] for chunk in chunks])):
+        chunk["token_estimate"] = tokens
     return chunks
 
+class PageChunker:
+    """
+    Chunk a document page by page in one linear pass.
+
+    Tables (found by the PDF reader's layout analysis or by the ASCII pattern) are
+    chunked apart from the running text, as token-bounded row blocks that each repeat
+    the table header.
+
+    Text is carried over page breaks, so a paragraph split across pages stays in one
+    chunk and the overlap between chunks spans the break. Every chunk records the
+    pages it starts and ends on and its character offsets in the document text (the
+    page texts, each followed by a newline). A chunk is emitted only once the text
+    after it can no longer change it, so the chunks returned after any page are a
+    prefix of the chunks of the whole document.
+
+    With CHUNK_SIZE_UNIT=tokens, size and overlap are counted in tokens of the chat
+    model (MAX_CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS) instead of characters. Either way
+    token_estimate holds the exact token count, computed in one batch per page.
+    """
+
+    SEPARATORS = ("\n\n", "\n", " ")
+
+    def __init__(self, start_num: int = 1, chunk_size: Optional[int] = None, overlap: Optional[int] = None):
+        self.next_num = start_num
+        # Token mode: chunk_size and overlap are in tokens
+        self.encoder = get_encoder() if token_sized_chunks() else None
+        if self.encoder:
+            self.chunk_size = chunk_size or settings.max_chunk_tokens
+            self.overlap = settings.chunk_overlap_tokens if overlap is None else overlap
+        else:
+            self.chunk_size = chunk_size or settings.max_chunk_chars
+            self.overlap = settings.max_overlaps if overlap is None else overlap
+        self._buf = ""          # pending text; _buf[0] is at document offset _buf_offset
+        self._buf_offset = 0
+        self._pos = 0           # start of the next chunk within _buf
+        self._page_starts: List[Tuple[int, int]] = []  # (document offset, page_no) of pages in _buf
+        self._doc_len = 0
+
+    def _page_at(self, offset: int) -> int:
+        starts = [start for start, _ in self._page_starts]
+        return self._page_starts[max(bisect_right(starts, offset) - 1, 0)][1]
+
+    def _append(self, text: str, offset: int, page_no: int):
+        if self._buf_offset + len(self._buf) != offset:
+            # A table sat in between: what was pending has been flushed already
+            self._buf, self._buf_offset, self._pos = "", offset, 0
+        else:
+            self._buf = self._buf[self._pos:]
+            self._buf_offset += self._pos
+            self._pos = 0
+        # Keep only the page the buffer starts on and the ones after it
+        while len(self._page_starts) > 1 and self._page_starts[1][0] <= self._buf_offset:
+            self._page_starts.pop(0)
+        self._page_starts.append((offset, page_no))
+        self._buf += text
+
+    def _limit(self, final: bool) -> Optional[int]:
+        """Most characters the next chunk may take, or None until more text arrives."""
+        available = len(self._buf) - self._pos
+        if self.encoder is None:
+            if available > self.chunk_size:
+                return self.chunk_size
+            return available if final else None
+
+        # Read ahead ~4 characters per token first and widen only for dense text
+        size = self.chunk_size * 4
+        while True:
+            window = self._buf[self._pos:self._pos + size]
+            tokens = self.encoder.encode_ordinary(window)
+            if len(tokens) > self.chunk_size or len(window) == available or size >= self.chunk_size * MAX_CHARS_PER_TOKEN:
+                break
+            size = min(size * 2, self.chunk_size * MAX_CHARS_PER_TOKEN)
+        if len(tokens) > self.chunk_size:
+            limit = self._char_offset(window, tokens, self.chunk_size)
+            return limit if final or limit + TOKEN_BOUNDARY_MARGIN < available else None
+        if len(window) < available:
+            return len(window)
+        return available if final else None
+
+    def _cut(self, limit: int) -> int:
+        """End of the next chunk: the last separator in the second half of the limit, else the limit."""
+        if self._pos + limit == len(self._buf):
+            return len(self._buf)
+        window = self._buf[self._pos:self._pos + limit]
+        for separator in self.SEPARATORS:
+            i = window.rfind(separator)
+            if i >= limit // 2:
+                return self._pos + i + len(separator)
+        return self._pos + limit
+
+    def _char_offset(self, text: str, tokens: List[int], index: int) -> int:
+        """Characters of text covered by tokens[:index]; a character split across tokens is left out."""
+        byte_len = len(self.encoder.decode_bytes(tokens[:index]))
+        return len(text.encode("utf-8")[:byte_len].decode("utf-8", errors="ignore"))
+
+    def _overlap_chars(self, cut: int) -> int:
+        if self.encoder is None:
+            return self.overlap
+        text = self._buf[self._pos:cut]
+        tokens = self.encoder.encode_ordinary(text)
+        if len(tokens) <= self.overlap:
+            return len(text)
+        return len(text) - self._char_offset(text, tokens, len(tokens) - self.overlap)
+
+    def _next_start(self, cut: int) -> int:
+        start = max(cut - self._overlap_chars(cut), self._pos + 1)
+        if start >= cut:
+            return cut
+        # Begin the overlap on a word boundary
+        space = re.search(r"\s", self._buf[start:cut])
+        return start + space.end() if space else start
+
+    def _emit(self, final: bool) -> List[Dict]:
+        chunks = []
+        while self._pos < len(self._buf):
+            limit = self._limit(final)
+            if limit is None:
+                break
+            cut = self._cut(limit)
+            raw = self._buf[self._pos:cut]
+            content = raw.strip()
+            if content:
+                char_start = self._buf_offset + self._pos + (len(raw) - len(raw.lstrip()))
+                chunks.append(_make_chunk(
+                    content,
+                    self.next_num,
+                    self._page_at(char_start),
+                    self._page_at(char_start + len(content) - 1),
+                    char_start
+                ))
+                self.next_num += 1
+            self._pos = cut if cut == len(self._buf) else self._next_start(cut)
+        return chunks
+
+    def add_page(self, page: Dict) -> List[Dict]:
+        """Feed the next {page_no, text} page; returns the chunks completed so far."""
+        text = page["text"] + "\n"
+        page_offset = self._doc_len
+        self._doc_len += len(text)
+
+        chunks = []
+        for segment in _split_segments(text, page["page_no"], page.get("tables")):
+            offset = page_offset + segment["offset"]
+            if segment["type"] == "text":
+                self._append(segment["content"], offset, segment["page"])
+                chunks.extend(self._emit(final=False))
+                continue
+
+            # Tables end the running text; their rows are chunked in blocks under the header
+            chunks.extend(self._emit(final=True))
+            blocks = table_blocks(segment["content"], segment["header_lines"], settings.table_block_max_tokens)
+            for content, start, end, rows in blocks:
+                chunks.append(_make_chunk(
+                    content, self.next_num, segment["page"], segment["page"],
+                    offset + start, offset + end, table_rows=rows
+                ))
+                self.next_num += 1
+        return _count_tokens(chunks)
+
+    def finish(self) -> List[Dict]:
+        """The chunks still pending at the end of the document."""
+        return _count_tokens(self._emit(final=True))
+
+def smart_chunk_text(text: str, page_start: int = 1) -> List[Dict]:
+    """Chunk plain text; form feeds (\\f) mark page breaks, numbered from page_start"""
+    chunker = PageChunker()
+    chunks = []
+    for page_no, page_text in enumerate(text.split("\f"), start=page_start):
+        chunks.extend(chunker.add_page({"page_no": page_no, "text": page_text}))
+    return chunks + chunker.finish()
+
+def chunk_page(page: Dict, start_num: int = 1) -> List[Dict]:
+    """Chunk a single {page_no, text} page on its own, numbering chunks from start_num."""
+    chunker = PageChunker(start_num)
+    return chunker.add_page(page) + chunker.finish()
+
+async def aiter_chunks(pages: AsyncIterator[Dict], start_num: int = 1) -> AsyncIterator[Dict]:
+    """Stream chunks as pages arrive, numbering them across the whole document."""
+    chunker = PageChunker(start_num)
+    async for page in pages:
+        for chunk in chunker.add_page(page):
+            yield chunk
+    for chunk in chunker.finish():
+        yield chunk
+
 
 def truncate_for_upload(pages: list[dict]) -> str:
 
@@ -0,0 +1,164 @@
+"""
+Context assembly for RAG prompts.
+
+Search returns more candidates than the prompt needs. They are ordered by maximal
+marginal relevance so overlapping or repeated chunks (splitter overlap, table rows
+that recur on every page) do not crowd out distinct evidence, packed greedily into a
+token budget counted with tiktoken, and chunks that sit next to each other in the
+document are merged back into one passage with the overlap removed.
+"""
+import logging
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import get_settings
+from app.services.chunking import max_overlap_chars
+from app.services.embeddings import get_embedding_service
+from app.utils.tokens import count_tokens_batch, truncate_to_tokens
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Shortest suffix/prefix match treated as splitter overlap rather than coincidence
+MIN_OVERLAP_CHARS = 16
+
+
+def format_context(hit: Dict) -> str:
+    page, end_page = hit.get("page_no", "N/A"), hit.get("end_page")
+    pages = f"pages {page}-{end_page}" if end_page and end_page != page else f"page {page}"
+    return f"[Source: {hit['filename']}, {pages}] {hit['content']}"
+
+
+def _unit_rows(vectors: List[List[float]]) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def _similarities(query: str, hits: List[Dict]):
+    """(relevance to the query, pairwise similarity) for the hits."""
+    try:
+        vectors = _unit_rows(get_embedding_service().embed_texts([query] + [h["content"] for h in hits]))
+        return vectors[1:] @ vectors[0], vectors[1:] @ vectors[1:].T
+    except Exception as e:
+        # Without embeddings: search order for relevance, word overlap for redundancy
+        logger.warning(f"Context embeddings failed, using search order: {e}")
+        words = [set(re.findall(r"\w+", h["content"].lower())) for h in hits]
+        pairwise = np.array([
+            [len(a & b) / (len(a | b) or 1) for b in words] for a in words
+        ], dtype=np.float32)
+        relevance = 1.0 - np.arange(len(hits), dtype=np.float32) / len(hits)
+        return relevance, pairwise
+
+
+def mmr_order(relevance: np.ndarray, pairwise: np.ndarray, lambda_mult: float) -> List[int]:
+    """Indices in maximal-marginal-relevance order."""
+    remaining = list(range(len(relevance)))
+    order: List[int] = []
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    while remaining:
+        scores = [lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy[i] for i in remaining]
+        best = remaining.pop(int(np.argmax(scores)))
+        order.append(best)
+        redundancy = np.maximum(redundancy, pairwise[best])
+    return order
+
+
+def _join_overlapping(left: str, right: str) -> str:
+    """left + right without the text the splitter repeated at the chunk boundary."""
+    longest = min(len(left), len(right), max(max_overlap_chars(), MIN_OVERLAP_CHARS))
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return f"{left}\n{right}"
+
+
+def merge_adjacent(hits: List[Dict]) -> List[Dict]:
+    """
+    Merge hits that are consecutive chunks of the same document into one passage.
+
+    The merged passage takes the position of its earliest (most relevant) member.
+    """
+    # Chunks now carry over page breaks, so consecutive chunk_nums are adjacent text
+    def adjacency_key(hit: Dict):
+        return hit.get("pdf_id")
+
+    groups: List[List[Dict]] = []
+    by_chunk = {}
+    for hit in sorted(
+        (h for h in hits if h.get("chunk_num") is not None),
+        key=lambda h: (str(adjacency_key(h)), h["chunk_num"]),
+    ):
+        previous = by_chunk.get((adjacency_key(hit), hit["chunk_num"] - 1))
+        group = previous if previous is not None else []
+        if previous is None:
+            groups.append(group)
+        group.append(hit)
+        by_chunk[(adjacency_key(hit), hit["chunk_num"])] = group
+
+    rank = {id(h): i for i, h in enumerate(hits)}
+    passages = []
+    for group in groups:
+        content = group[0]["content"]
+        for hit in group[1:]:
+            content = _join_overlapping(content, hit["content"])
+        first = min(group, key=lambda h: rank[id(h)])
+        passages.append((rank[id(first)], {
+            **first,
+            "content": content,
+            "page_no": group[0].get("page_no"),
+            "end_page": group[-1].get("end_page") or group[-1].get("page_no"),
+            "chunk_nums": [h["chunk_num"] for h in group],
+        }))
+    passages.extend((rank[id(h)], {**h, "chunk_nums": []}) for h in hits if h.get("chunk_num") is None)
+    return [passage for _, passage in sorted(passages, key=lambda p: p[0])]
+
+
+def build_context(
+    question: str,
+    hits: List[Dict],
+    token_budget: Optional[int] = None,
+    lambda_mult: Optional[float] = None,
+) -> List[Dict]:
+    """
+    The passages to put in a RAG prompt: MMR-ordered, within token_budget, adjacent
+    chunks merged. Each passage is a hit dict with the merged content, the chunk_nums
+    it covers and its token count.
+    """
+    if not hits:
+        return []
+    token_budget = token_budget or settings.rag_context_token_budget
+    lambda_mult = settings.rag_mmr_lambda if lambda_mult is None else lambda_mult
+
+    # Identical chunk text (duplicate uploads, fused result lists) is kept once
+    unique: Dict[str, Dict] = {}
+    for hit in hits:
+        unique.setdefault(hit["content"], hit)
+    candidates = list(unique.values())
+
+    relevance, pairwise = _similarities(question, candidates)
+    token_counts = count_tokens_batch([format_context(h) for h in candidates])
+
+    selected: List[Dict] = []
+    remaining = token_budget
+    for i in mmr_order(relevance, pairwise, lambda_mult):
+        if token_counts[i] <= remaining:
+            selected.append(candidates[i])
+            remaining -= token_counts[i]
+        elif not selected:
+            # The best passage alone overflows the budget: keep as much of it as fits
+            header_tokens = token_counts[i] - count_tokens_batch([candidates[i]["content"]])[0]
+            content = truncate_to_tokens(candidates[i]["content"], token_budget - header_tokens)
+            selected.append({**candidates[i], "content": content})
+            break
+
+    passages = merge_adjacent(selected)
+    for passage, tokens in zip(passages, count_tokens_batch([format_context(p) for p in passages])):
+        passage["tokens"] = tokens
+    logger.debug(
+        f"RAG context: {len(passages)} passages from {len(hits)} hits, "
+        f"{sum(p['tokens'] for p in passages)}/{token_budget} tokens"
+    )
+    return passages
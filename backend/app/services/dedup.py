@@ -0,0 +1,123 @@
+"""
+Whole-file dedup for uploads.
+
+Uploads are hashed with SHA-256 while they stream to disk; when the same bytes were
+already ingested the new document either links to the original's chunks (``link``)
+or gets a bulk copy of them (``clone``). Neither path touches PyMuPDF, the LLM or the vectorizer.
+"""
+import logging
+import uuid
+from typing import Optional
+
+from sqlalchemy import func, literal, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, select, desc
+
+from app.core.config import get_settings
+from app.models import PDFChunk, PDFDocument
+from app.services.vector_store import get_vector_store
+
+settings = get_settings()
+
+
+def find_duplicate(session: Session, content_hash: str, doc_type: Optional[str] = None) -> Optional[PDFDocument]:
+    """
+    Most recent non-failed document that owns its chunks and has the same content hash.
+    With ``doc_type`` only documents of that type match: chunks analysed as another
+    type cannot be reused for it.
+    """
+    query = select(PDFDocument).where(
+        PDFDocument.content_hash == content_hash,
+        PDFDocument.duplicate_of_id.is_(None),
+        PDFDocument.status != "failed",
+    )
+    if doc_type:
+        query = query.where(PDFDocument.doc_type == doc_type)
+    return session.exec(query.order_by(desc(PDFDocument.upload_time))).first()
+
+
+def resolve_canonical(session: Session, pdf_doc: PDFDocument) -> PDFDocument:
+    """The document whose chunks a (possibly linked) document reads from."""
+    if pdf_doc.duplicate_of_id:
+        original = session.get(PDFDocument, pdf_doc.duplicate_of_id)
+        if original:
+            return original
+    return pdf_doc
+
+
+def with_linked_duplicates(pdf_id):
+    """Filter matching a document and every upload linked to it, which share its status."""
+    return or_(PDFDocument.id == pdf_id, PDFDocument.duplicate_of_id == pdf_id)
+
+
+def clone_pdf_chunks(session: Session, src_pdf_id: uuid.UUID, dst_pdf_id: uuid.UUID, filename: str):
+    """INSERT ... SELECT copy of every chunk row, analyses included, in one statement."""
+    columns = [
+        "id", "pdf_id", "filename", "doc_type", "chunk_num", "approx_page", "char_count",
+        "word_count", "token_estimate", "has_tables", "has_figures", "content",
+        "content_hash", "chunk_meta", "llm_analysis",
+    ]
+    rows = select(
+        func.gen_random_uuid(),
+        literal(dst_pdf_id),
+        literal(filename),
+        PDFChunk.doc_type,
+        PDFChunk.chunk_num,
+        PDFChunk.approx_page,
+        PDFChunk.char_count,
+        PDFChunk.word_count,
+        PDFChunk.token_estimate,
+        PDFChunk.has_tables,
+        PDFChunk.has_figures,
+        PDFChunk.content,
+        PDFChunk.content_hash,
+        PDFChunk.chunk_meta,
+        PDFChunk.llm_analysis,
+    ).where(PDFChunk.pdf_id == src_pdf_id)
+    session.execute(insert(PDFChunk).from_select(columns, rows))
+
+
+def register_duplicate_upload(
+    session: Session,
+    original: PDFDocument,
+    filename: str,
+    content_hash: str,
+    doc_type: Optional[str] = None,
+) -> PDFDocument:
+    """Create the document row for a re-upload of ``original``'s bytes, as ``doc_type`` if given."""
+    # A clone needs the original's chunks to be complete; until then a link is all we can offer
+    mode = settings.upload_dedup_mode
+    if mode == "clone" and original.status != "processed":
+        mode = "link"
+
+    pdf_doc = PDFDocument(
+        filename=filename,
+        extracted_text=original.extracted_text,
+        extracted_data=original.extracted_data,
+        doc_type=doc_type or original.doc_type,
+        llm_used=original.llm_used,
+        prompt_used=original.prompt_used,
+        status=original.status,
+        is_public=original.is_public,
+        content_hash=content_hash,
+        duplicate_of_id=original.id if mode == "link" else None,
+    )
+    session.add(pdf_doc)
+    session.flush()
+
+    if mode == "clone":
+        clone_pdf_chunks(session, original.id, pdf_doc.id, filename)
+        get_vector_store().clone(str(original.id), str(pdf_doc.id), filename)
+
+    session.commit()
+    session.refresh(pdf_doc)
+    if mode == "link":
+        # The original may have finished between our read and commit, before the link was visible
+        session.refresh(original)
+        if pdf_doc.status != original.status:
+            pdf_doc.status = original.status
+            session.add(pdf_doc)
+            session.commit()
+            session.refresh(pdf_doc)
+    logging.info(f"Upload {pdf_doc.id} deduplicated against {original.id} ({mode})")
+    return pdf_doc
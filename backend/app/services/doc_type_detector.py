@@ -4,6 +4,7 @@ import os
 import re
 from openai import OpenAI, APIConnectionError, RateLimitError
 from app.core.config import get_settings
+from app.utils.retry_logic import call_with_retry, estimate_tokens
 
 settings = get_settings()
 
@@ -13,10 +14,11 @@ CANONICAL_TYPES = {"medical", "invoice", "resume", "default"}
 if settings.use_ollama:
     client = OpenAI(
         base_url=f"{settings.ollama_api_endpoint}/v1/",
-        api_key="ollama"
+        api_key="ollama",
+        max_retries=0
     )
 else:
-    client = OpenAI(api_key=settings.openai_api_key) if settings.openai_api_key else None
+    client = OpenAI(api_key=settings.openai_api_key, max_retries=0) if settings.openai_api_key else None
 
 # --- quick rules (cheap & fast) ---
 def rule_based_doc_type(text: str) -> Tuple[str, str]:
@@ -78,15 +80,19 @@ Document:
 Answer with only one of: medical | invoice | resume | default
 """.strip()
 
+    messages = [
+        {"role": "system", "content": "Return only one label."},
+        {"role": "user", "content": prompt}
+    ]
     try:
-        # Chat Completions (recommended)
-        resp = client.chat.completions.create(
-            model=model,
-            temperature=0.0,
-            messages=[
-                {"role": "system", "content": "Return only one label."},
-                {"role": "user", "content": prompt}
-            ],
+        # Chat Completions (recommended), throttled and retried with the other LLM callers
+        resp = call_with_retry(
+            lambda: client.chat.completions.create(
+                model=model,
+                temperature=0.0,
+                messages=messages,
+            ),
+            tokens=estimate_tokens(messages, max_tokens=8)
         )
         label = resp.choices[0].message.content.strip().lower()
         # normalize
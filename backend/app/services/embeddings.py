@@ -0,0 +1,172 @@
+"""
+App-side embeddings (bring-your-own-vector for Weaviate).
+
+Chunk and query texts are embedded here instead of by Weaviate's text2vec module, so
+requests can be batched and vectors cached by content hash: boilerplate that repeats
+across documents (headers, table rows, legal footers) is embedded once.
+Backends: the OpenAI embeddings API (or Ollama's OpenAI-compatible endpoint) and a
+deterministic local hash embedder for offline use.
+"""
+import base64
+import hashlib
+import logging
+import math
+import re
+from array import array
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from openai import OpenAI
+
+from app.core.config import get_settings
+from app.services.llm_cache import CacheBackend, make_cache_backend
+from app.utils.retry_logic import call_with_retry
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Named vector the chunks are stored under in the PDFChunks collection
+VECTOR_NAME = "chunk_vector"
+
+
+class EmbeddingBackend:
+    """Turns a batch of texts into vectors, in input order."""
+
+    name: str
+    dimensions: int
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+
+class OpenAIEmbedder(EmbeddingBackend):
+    def __init__(self, client: OpenAI, model: str, dimensions: Optional[int] = None):
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+        self.name = f"openai:{model}:{dimensions}"
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        kwargs = {"dimensions": self.dimensions} if self.dimensions else {}
+        response = call_with_retry(
+            lambda: self.client.embeddings.create(model=self.model, input=texts, **kwargs),
+            tokens=sum(len(t) for t in texts) // 4 + 1,
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+
+class HashEmbedder(EmbeddingBackend):
+    """
+    Feature-hashing embedder: signed token and bigram counts folded into ``dimensions``
+    buckets, L2-normalized. Deterministic and dependency-free, for tests and offline runs.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+        self.name = f"hash:{dimensions}"
+
+    def _embed_one(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        tokens = re.findall(r"\w+", text.lower())
+        for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed_one(text) for text in texts]
+
+
+def _encode_vector(vector: List[float]) -> str:
+    return base64.b64encode(array("f", vector).tobytes()).decode()
+
+
+def _decode_vector(value: str) -> List[float]:
+    return array("f", base64.b64decode(value)).tolist()
+
+
+class EmbeddingService:
+    """Batched, content-hash cached embeddings for chunks and queries."""
+
+    def __init__(self, backend: EmbeddingBackend, cache: Optional[CacheBackend], batch_size: int):
+        self.backend = backend
+        self.cache = cache
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        # The backend name is part of the key so switching models never returns stale vectors
+        return hashlib.sha256(f"{self.backend.name}\0{text}".encode()).hexdigest()
+
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Vectors for texts, in order. Only distinct, uncached texts reach the backend."""
+        keys = [self._key(text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            cached = self.cache.get(key) if self.cache else None
+            if cached is not None:
+                found[key] = _decode_vector(cached)
+            else:
+                missing[key] = text
+        self.hits += len(found)
+        self.misses += len(missing)
+
+        pending = list(missing.items())
+        for i in range(0, len(pending), self.batch_size):
+            batch = pending[i:i + self.batch_size]
+            vectors = self.backend.embed([text for _, text in batch])
+            for (key, _), vector in zip(batch, vectors):
+                found[key] = vector
+                if self.cache:
+                    self.cache.set(key, _encode_vector(vector))
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_texts([text])[0]
+
+    def stats(self) -> Dict[str, int]:
+        return {"backend": self.backend.name, "hits": self.hits, "misses": self.misses}
+
+
+def make_embedding_backend(kind: str) -> EmbeddingBackend:
+    if kind == "hash":
+        return HashEmbedder(settings.embedding_dimensions)
+    if kind == "api":
+        if settings.use_ollama:
+            client = OpenAI(base_url=f"{settings.ollama_api_endpoint}/v1/", api_key="ollama", max_retries=0)
+            return OpenAIEmbedder(client, settings.ollama_model)
+        return OpenAIEmbedder(
+            OpenAI(api_key=settings.openai_api_key, max_retries=0),
+            settings.embedding_model,
+            settings.embedding_dimensions,
+        )
+    raise ValueError(f"Unknown embedding backend: {kind}")
+
+
+def app_side_embeddings() -> bool:
+    """False when Weaviate's own text2vec module is left to vectorize chunks and queries."""
+    return settings.embedding_backend != "weaviate"
+
+
+@lru_cache
+def get_embedding_service() -> EmbeddingService:
+    cache = make_cache_backend(
+        settings.embedding_cache_backend,
+        namespace="embeddings",
+        path=settings.embedding_cache_path,
+        max_entries=settings.embedding_cache_max_entries,
+        ttl=None,
+    )
+    # With module-side vectorization only VECTOR_STORE_BACKEND=local still embeds in the app
+    kind = settings.embedding_backend if app_side_embeddings() else "api"
+    return EmbeddingService(
+        make_embedding_backend(kind),
+        cache,
+        settings.embedding_batch_size,
+    )
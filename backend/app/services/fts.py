@@ -0,0 +1,68 @@
+"""
+Lexical search over PDFChunk.content with Postgres full-text search.
+
+Matches use the generated ``content_tsv`` column and its GIN index, so exact-term
+lookups (invoice numbers, names, codes) never touch the embedder or Weaviate.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlmodel import Session
+
+from app.models import PDFChunk
+from app.models.pdf_chunk import CONTENT_TSV, FTS_CONFIG
+
+# ts_headline options: mark matches and return up to two short fragments
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=30, MinWords=10, FragmentDelimiter= … "
+
+
+def search_chunks_fts(
+    session: Session,
+    query: str,
+    filters: Optional[List[Tuple[str, str]]] = None,
+    limit: int = 10,
+    offset: int = 0,
+) -> List[Dict]:
+    """Chunks matching a web-style query (quotes, OR, -term), best ts_rank_cd first, with highlighted snippets."""
+    ts_query = func.websearch_to_tsquery(FTS_CONFIG, query)
+    rank = func.ts_rank_cd(CONTENT_TSV, ts_query).label("rank")
+
+    ranked = (
+        select(PDFChunk.id, rank)
+        .where(CONTENT_TSV.op("@@")(ts_query))
+        .order_by(rank.desc(), PDFChunk.id)
+        .limit(limit)
+        .offset(offset)
+    )
+    for key, value in filters or []:
+        ranked = ranked.where(getattr(PDFChunk, key) == value)
+    ranked = ranked.subquery()
+
+    # Headlines are expensive, so only the page of winners gets one
+    rows = session.execute(
+        select(
+            PDFChunk.pdf_id,
+            PDFChunk.filename,
+            PDFChunk.doc_type,
+            PDFChunk.chunk_num,
+            PDFChunk.approx_page,
+            PDFChunk.chunk_meta["end_page"].as_integer().label("end_page"),
+            PDFChunk.content,
+            ranked.c.rank,
+            func.ts_headline(FTS_CONFIG, PDFChunk.content, ts_query, HEADLINE_OPTIONS).label("snippet"),
+        )
+        .join(ranked, ranked.c.id == PDFChunk.id)
+        .order_by(ranked.c.rank.desc(), PDFChunk.id)
+    ).all()
+
+    return [{
+        "content": row.content,
+        "pdf_id": str(row.pdf_id),
+        "doc_type": row.doc_type,
+        "filename": row.filename,
+        "page_no": row.approx_page,
+        "end_page": row.end_page or row.approx_page,
+        "chunk_num": row.chunk_num,
+        "score": float(row.rank),
+        "snippet": row.snippet
+    } for row in rows]
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session
+
+from app.api.deps.db import get_session
+from app.models import PDFChunk, PDFDocument
+from app.core.config import get_settings
+from app.services.chunk_dedup import analyze_with_dedup, content_hash
+from app.services.dedup import with_linked_duplicates
+from app.services.llm_extractor import process_chunk_with_llm, process_chunks_packed
+from app.services.vector_store import get_vector_store
+
+settings = get_settings()
+
+
+@contextmanager
+def get_db_session():
+    """Get database session with context manager"""
+    db = next(get_session())
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def store_chunk_batch(
+    db: Session,
+    pdf_id: str,
+    filename: str,
+    doc_type: str,
+    batch: List[Dict],
+    checkpoint: bool = False,
+):
+    """
+    Write one analysed batch to the vector store and PostgreSQL and commit it.
+
+    With checkpoint, the document's ingested_chunk_num advances to the batch's last
+    chunk in the same transaction as the rows, so it never runs ahead of them.
+    """
+    if not batch:
+        return
+    get_vector_store().upsert(pdf_id, filename, batch, doc_type)
+    try:
+        upsert_pdf_chunks(db, [{
+            **chunk,
+            "pdf_id": pdf_id,
+            "filename": filename,
+            "doc_type": doc_type
+        } for chunk in batch])
+        if checkpoint:
+            last = max(chunk["chunk_num"] for chunk in batch)
+            db.execute(
+                update(PDFDocument)
+                .where(PDFDocument.id == pdf_id)
+                .values(ingested_chunk_num=func.greatest(func.coalesce(PDFDocument.ingested_chunk_num, 0), last))
+            )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Failed to store processed chunks: {e}")
+        raise
+
+
+def get_ingest_checkpoint(db: Session, pdf_id: str) -> int:
+    """Last chunk_num committed by the pipeline for this document (0 if none)."""
+    pdf_doc = db.get(PDFDocument, pdf_id)
+    return (pdf_doc.ingested_chunk_num or 0) if pdf_doc else 0
+
+
+def mark_document_failed(pdf_id: str):
+    with get_db_session() as db:
+        db.execute(
+            update(PDFDocument)
+            .where(with_linked_duplicates(pdf_id))
+            .values(status="failed")
+        )
+        db.commit()
+
+
+def upsert_pdf_chunks(db: Session, chunks: List[Dict]):
+    """Bulk upsert chunks with conflict handling - optimized"""
+    if not chunks:
+        return
+
+    # Prepare data for bulk insert
+    values_list = []
+    for chunk in chunks:
+        values_list.append({
+            "pdf_id": chunk["pdf_id"],
+            "filename": chunk["filename"],
+            "doc_type": chunk["doc_type"],
+            "chunk_num": chunk["chunk_num"],
+            "approx_page": chunk["approx_page"],
+            "char_count": chunk["char_count"],
+            "word_count": chunk["word_count"],
+            "token_estimate": chunk["token_estimate"],
+            "has_tables": chunk["has_tables"],
+            "has_figures": chunk["has_figures"],
+            "content": chunk["content"],
+            "content_hash": chunk.get("content_hash") or content_hash(chunk["content"]),
+            "llm_analysis": chunk.get("llm_analysis"),
+            "chunk_meta": {
+                "processed": chunk.get("processed", False),
+                "error": chunk.get("llm_error"),
+                "start_page": chunk.get("start_page", chunk["approx_page"]),
+                "end_page": chunk.get("end_page", chunk["approx_page"]),
+                "char_start": chunk.get("char_start"),
+                "char_end": chunk.get("char_end"),
+                "dedup": chunk.get("dedup"),
+                "dedup_source": chunk.get("dedup_source")
+            },
+            "created_at": datetime.utcnow()
+        })
+
+    stmt = insert(PDFChunk).values(values_list)
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['pdf_id', 'chunk_num'],
+        set_={
+            'content': stmt.excluded.content,
+            'content_hash': stmt.excluded.content_hash,
+            'llm_analysis': stmt.excluded.llm_analysis,
+            'chunk_meta': stmt.excluded.chunk_meta
+        }
+    )
+
+    db.execute(stmt)
+    # Same transaction as the rows, so cached answers are invalidated exactly when they change
+    db.execute(
+        update(PDFDocument)
+        .where(PDFDocument.id.in_({chunk["pdf_id"] for chunk in chunks}))
+        .values(index_version=PDFDocument.index_version + 1)
+    )
+
+
+async def process_batch_parallel(batch: List[Dict], doc_type: str) -> List[Dict]:
+    """
+    Process a batch of chunks in parallel using OpenAI API.
+
+    With CHUNK_DEDUP, chunks already analysed elsewhere reuse that analysis instead.
+    """
+    if settings.chunk_dedup:
+        return await analyze_with_dedup(batch, doc_type, _analyze_batch)
+    return await _analyze_batch(batch, doc_type)
+
+
+async def _analyze_batch(batch: List[Dict], doc_type: str) -> List[Dict]:
+    if settings.llm_pack_chunks:
+        # Several chunks per request; malformed replies already fall back per chunk
+        return await process_chunks_packed(batch, doc_type)
+
+    tasks = []
+    for chunk in batch:
+        # Create a task for each chunk
+        task = process_chunk_with_llm(chunk, doc_type)
+        tasks.append(task)
+
+    # Process all chunks in parallel
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Process results and handle exceptions
+    processed_batch = []
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            # Handle error for this chunk
+            logging.error(f"Error processing chunk {i}: {result}")
+            processed_batch.append({
+                **batch[i],
+                "processed": False,
+                "llm_error": str(result)
+            })
+        else:
+            # Successful processing
+            processed_batch.append(result)
+
+    return processed_batch
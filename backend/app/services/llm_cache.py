@@ -0,0 +1,242 @@
+"""
+Content-addressed cache for LLM responses.
+
+Entries are keyed by a SHA-256 of (model, messages, temperature), so re-uploading a
+PDF or re-running /prompt/engineer on the same text returns the stored completion
+instead of paying for another call. Backends: in-process LRU, SQLite on disk and Redis;
+the persistent ones sit behind a small in-process LRU.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis
+
+from app.core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """String key/value store with optional per-entry TTL."""
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryLRUCache(CacheBackend):
+    def __init__(self, max_entries: int = 1024, ttl: Optional[int] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[str, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        ttl = ttl if ttl is not None else self.ttl
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache(CacheBackend):
+    """SQLite file; evicts least recently used rows beyond ``max_entries``."""
+
+    def __init__(self, path: str, max_entries: int = 100_000, ttl: Optional[int] = None):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        ttl = ttl if ttl is not None else self.ttl
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + ttl if ttl else None, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+
+class RedisCache(CacheBackend):
+    """Size-based eviction is left to Redis (``maxmemory-policy allkeys-lru``)."""
+
+    def __init__(self, client: redis.Redis, prefix: str, ttl: Optional[int] = None):
+        self.redis = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key: str) -> Optional[str]:
+        return self.redis.get(self.prefix + key)
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        ttl = ttl if ttl is not None else self.ttl
+        self.redis.set(self.prefix + key, value, ex=ttl or None)
+
+    def delete(self, key: str) -> None:
+        self.redis.delete(self.prefix + key)
+
+
+class TieredCache(CacheBackend):
+    """In-process LRU in front of a shared/persistent backend."""
+
+    def __init__(self, front: CacheBackend, back: CacheBackend):
+        self.front = front
+        self.back = back
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.front.get(key)
+        if value is None:
+            value = self.back.get(key)
+            if value is not None:
+                self.front.set(key, value)
+        return value
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        self.front.set(key, value, ttl)
+        self.back.set(key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        self.front.delete(key)
+        self.back.delete(key)
+
+
+def make_cache_backend(kind: str, namespace: str, path: str, max_entries: int, ttl: Optional[int]) -> Optional[CacheBackend]:
+    """Build the backend named by a ``*_cache_backend`` setting (memory | disk | redis | none)."""
+    if kind == "none":
+        return None
+    if kind == "memory":
+        return MemoryLRUCache(max_entries=max_entries, ttl=ttl)
+    front = MemoryLRUCache(max_entries=min(max_entries, 4096), ttl=ttl)
+    if kind == "disk":
+        return TieredCache(front, DiskCache(path, max_entries=max_entries, ttl=ttl))
+    if kind == "redis":
+        client = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+        return TieredCache(front, RedisCache(client, prefix=f"{namespace}:", ttl=ttl))
+    raise ValueError(f"Unknown cache backend: {kind}")
+
+
+def make_cache_key(model: str, messages: List[Dict[str, str]], temperature: float) -> str:
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            # A broken cache must never fail the LLM call itself
+            self.errors += 1
+            logger.warning(f"LLM cache read failed: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, content: str) -> None:
+        try:
+            self.backend.set(key, content)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"LLM cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": settings.llm_cache_backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+@lru_cache
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    backend = make_cache_backend(
+        settings.llm_cache_backend,
+        namespace="llm",
+        path=settings.llm_cache_path,
+        max_entries=settings.llm_cache_max_entries,
+        ttl=settings.llm_cache_ttl_seconds,
+    )
+    return LLMResponseCache(backend) if backend is not None else None
@@ -1,11 +1,16 @@
 import sys
-from typing import Optional, Dict, Any, List
+import asyncio
+import re
+from contextlib import aclosing
+from typing import AsyncIterator, Optional, Dict, Any, List
 from pydantic import BaseModel
 from openai import OpenAI
 import logging
-from openai import OpenAI, APIConnectionError, RateLimitError, APIStatusError
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, RateLimitError, APIStatusError
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from app.core.config import get_settings
+from app.utils.retry_logic import call_with_retry, acall_with_retry, astream_with_retry, estimate_tokens
+from app.services.llm_cache import get_llm_cache, make_cache_key
 import json
 
 logging.basicConfig(
@@ -15,27 +20,36 @@ logging.basicConfig(
 )
 
 settings = get_settings()
+# Retries are done by app.utils.retry_logic so they share one rate limiter
 if settings.use_ollama:
     client = OpenAI(
         base_url=f"{settings.ollama_api_endpoint}/v1/",
-        api_key="ollama"
+        api_key="ollama",
+        max_retries=0
+    )
+    async_client = AsyncOpenAI(
+        base_url=f"{settings.ollama_api_endpoint}/v1/",
+        api_key="ollama",
+        max_retries=0
     )
 else:
-    client = OpenAI(api_key=settings.openai_api_key) if settings.openai_api_key else None
+    client = OpenAI(api_key=settings.openai_api_key, max_retries=0) if settings.openai_api_key else None
+    async_client = AsyncOpenAI(api_key=settings.openai_api_key, max_retries=0) if settings.openai_api_key else None
 
 class PromptRequest(BaseModel):
     text: str
     goal: Optional[str] = None
     doc_type: Optional[str] = "default"
 
+EXTRACTION_INSTRUCTIONS = {
+    "medical": "Extract patient info (name, id), dates, diagnoses, treatments, meds. Return clean JSON.",
+    "invoice": "Extract invoice_number, date, vendor, line_items[], subtotal, tax, total. Return clean JSON.",
+    "resume":  "Extract name, contacts, education[], experience[], skills[]. Return clean JSON.",
+    "default": "Extract key fields and return clean JSON."
+}
+
 def build_prompt(text: str, goal: Optional[str], doc_type: str) -> str:
-    instructions = {
-        "medical": "Extract patient info (name, id), dates, diagnoses, treatments, meds. Return clean JSON.",
-        "invoice": "Extract invoice_number, date, vendor, line_items[], subtotal, tax, total. Return clean JSON.",
-        "resume":  "Extract name, contacts, education[], experience[], skills[]. Return clean JSON.",
-        "default": "Extract key fields and return clean JSON."
-    }
-    head = instructions.get(doc_type or "default", instructions["default"])
+    head = EXTRACTION_INSTRUCTIONS.get(doc_type or "default", EXTRACTION_INSTRUCTIONS["default"])
     return f"""{head}
 Goal: {goal or "Extract structured data"}
 Text:
@@ -46,7 +60,42 @@ Rules:
 - Use snake_case keys.
 """
 
-def generate_llm_response(prompt: str) -> str:
+def _chat_model() -> str:
+    return settings.ollama_model if settings.use_ollama else settings.chat_model
+
+def _extraction_messages(prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": "You are a careful information extraction assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+EXTRACTION_TEMPERATURE = 0.2
+
+CLIENT_NOT_INITIALIZED = {"status": False, "error": "LLM client not initialized", "note": "Provide OPENAI_API_KEY or enable Ollama"}
+
+def _llm_error_response(e: Exception) -> Dict[str, Any]:
+    """Map an OpenAI client exception to the error payload returned to callers."""
+    if isinstance(e, APIConnectionError):
+        logging.error(f"Connection error: {str(e)}")
+        return {"status": False, "error": "Connection failed", "details": "Check your network or LLM service"}
+
+    if isinstance(e, RateLimitError):
+        logging.warning(f"Rate limit exceeded: {str(e)}")
+        return {"status": False, "error": "Rate limit exceeded", "solution": "Wait or check quota"}
+
+    if isinstance(e, APIStatusError):
+        logging.error(f"API error (HTTP {e.status_code}): {e.message}")
+        if e.status_code == 401:
+            return {"status": False, "error": "Authentication failed", "action": "Check API keys"}
+        elif e.status_code == 404:
+            return {"status": False, "error": "Model not found", "action": "Verify model name"}
+        else:
+            return {"status": False, "error": f"API error {e.status_code}", "details": e.message}
+
+    logging.exception(f"Unexpected error: {str(e)}")
+    return {"status": False, "error": "Processing failed", "details": str(e)}
+
+def generate_llm_response(prompt: str) -> Dict[str, Any]:
     """
     Generate LLM response.
     
@@ -54,58 +103,118 @@ def generate_llm_response(prompt: str) -> str:
         prompt: Input prompt text
         
     Returns:
-        str: Generated response or error message
+        dict: {"status": True, "content": ...} or {"status": False, "error": ...}
     """
     if not client:
-        return '{"status":false, "error": "LLM client not initialized", "note": "Provide OPENAI_API_KEY or enable Ollama"}'
+        return dict(CLIENT_NOT_INITIALIZED)
     
+    messages = _extraction_messages(prompt)
+    cache = get_llm_cache()
+    cache_key = make_cache_key(_chat_model(), messages, EXTRACTION_TEMPERATURE)
+    if cache and (cached := cache.get(cache_key)) is not None:
+        return {"status":True, "content": cached}
+
     try:
-        response = client.chat.completions.create(
-            model=settings.ollama_model if settings.use_ollama else settings.chat_model,
-            messages=[
-                {"role": "system", "content": "You are a careful information extraction assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2,
-            stream=False
+        response = call_with_retry(
+            lambda: client.chat.completions.create(
+                model=_chat_model(),
+                messages=messages,
+                temperature=EXTRACTION_TEMPERATURE,
+                stream=False
+            ),
+            tokens=estimate_tokens(messages)
         )
-        return {"status":True, "content": response.choices[0].message.content}
-    except APIConnectionError as e:
-        logging.error(f"Connection error: {str(e)}")
-        return '{"status":false, "error": "Connection failed", "details": "Check your network or LLM service"}'
-        
-    except RateLimitError as e:
-        logging.warning(f"Rate limit exceeded: {str(e)}")
-        return '{"status":false, "error": "Rate limit exceeded", "solution": "Wait or check quota"}'
-        
-    except APIStatusError as e:
+        content = response.choices[0].message.content
+        if cache:
+            cache.set(cache_key, content)
+        return {"status":True, "content": content}
+    except Exception as e:
+        return _llm_error_response(e)
 
-        logging.error(f"API error (HTTP {e.status_code}): {e.message}")
-        if e.status_code == 401:
-            return '{"status":false, "error": "Authentication failed", "action": "Check API keys"}'
-        elif e.status_code == 404:
-            return '{"status":false, "error": "Model not found", "action": "Verify model name"}'
-        else:
-            return f'{{"status":false, "error": "API error {e.status_code}", "details": "{e.message}"}}'
-            
+async def agenerate_llm_response(prompt: str, completion_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Async counterpart of generate_llm_response.
+
+    Uses AsyncOpenAI so concurrent calls overlap on the event loop; the shared
+    limiter decides how many are in flight at once.
+    """
+    if not async_client:
+        return dict(CLIENT_NOT_INITIALIZED)
+
+    messages = _extraction_messages(prompt)
+    cache = get_llm_cache()
+    cache_key = make_cache_key(_chat_model(), messages, EXTRACTION_TEMPERATURE)
+    if cache and (cached := cache.get(cache_key)) is not None:
+        return {"status":True, "content": cached}
+
+    try:
+        response = await acall_with_retry(
+            lambda: async_client.chat.completions.create(
+                model=_chat_model(),
+                messages=messages,
+                temperature=EXTRACTION_TEMPERATURE,
+                stream=False
+            ),
+            tokens=estimate_tokens(messages, max_tokens=completion_tokens)
+        )
+        content = response.choices[0].message.content
+        if cache:
+            cache.set(cache_key, content)
+        return {"status":True, "content": content}
     except Exception as e:
-        logging.exception(f"Unexpected error: {str(e)}")
-        return f'{{"status":false, "error": "Processing failed", "details": "{str(e)}"}}'
-    
+        return _llm_error_response(e)
 
-def extract_structured_data_from_text(text: str, goal: Optional[str], doc_type: str) -> Dict[str, Any]:
-    prompt = build_prompt(text, goal, doc_type)
+async def astream_llm_response(prompt: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming counterpart of agenerate_llm_response.
 
-    contentResponse = generate_llm_response(prompt)
-    if(contentResponse['status'] or contentResponse['status']=='false'):
-        return {
-            "structured_data": contentResponse['content'],
-            "prompt_used": prompt,
-            "llm_used": settings.ollama_model if settings.use_ollama else settings.chat_model
-        }
-    else:
-        return contentResponse
-    
+    Yields {"type": "token", "content": ...} as the model produces text, then one
+    {"type": "done", "result": {"status": True, "content": <full text>}}, or
+    {"type": "error", "result": <error payload>} instead. Opening the stream is retried;
+    its limiter slot is held until the stream ends, and closing the generator early
+    aborts the upstream request and frees the slot.
+    """
+    if not async_client:
+        yield {"type": "error", "result": dict(CLIENT_NOT_INITIALIZED)}
+        return
+
+    messages = _extraction_messages(prompt)
+    cache = get_llm_cache()
+    cache_key = make_cache_key(_chat_model(), messages, EXTRACTION_TEMPERATURE)
+    if cache and (cached := cache.get(cache_key)) is not None:
+        yield {"type": "token", "content": cached}
+        yield {"type": "done", "result": {"status": True, "content": cached}}
+        return
+
+    events = astream_with_retry(
+        lambda: async_client.chat.completions.create(
+            model=_chat_model(),
+            messages=messages,
+            temperature=EXTRACTION_TEMPERATURE,
+            stream=True,
+            # Final event carries usage, so the limiter is charged what the answer cost
+            stream_options={"include_usage": True}
+        ),
+        tokens=estimate_tokens(messages)
+    )
+    parts: List[str] = []
+    try:
+        # aclosing runs on client disconnect too (GeneratorExit/CancelledError): the upstream
+        # stream is closed and the limiter slot released right away
+        async with aclosing(events):
+            async for event in events:
+                delta = event.choices[0].delta.content if event.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield {"type": "token", "content": delta}
+    except Exception as e:
+        yield {"type": "error", "result": _llm_error_response(e)}
+        return
+
+    content = "".join(parts)
+    if cache:
+        cache.set(cache_key, content)
+    yield {"type": "done", "result": {"status": True, "content": content}}
 
 def synthesize_answer(question: str, contexts: List[str]) -> str:
     ctx = "\n\n".join(contexts)[:6000]
@@ -118,10 +227,14 @@ Context:
 
 Question: {question}
 Answer:"""
-    r = client.chat.completions.create(
-        model=settings.ollama_model if settings.use_ollama else settings.chat_model,
-        messages=[{"role":"user","content": prompt}],
-        temperature=0.1
+    messages = [{"role":"user","content": prompt}]
+    r = call_with_retry(
+        lambda: client.chat.completions.create(
+            model=_chat_model(),
+            messages=messages,
+            temperature=0.1
+        ),
+        tokens=estimate_tokens(messages)
     )
     return r.choices[0].message.content.strip()
 
@@ -145,10 +258,10 @@ async def process_chunk_with_llm(chunk: Dict, doc_type: str) -> Dict:
     }}
     """
     
-    response = generate_llm_response(prompt)
+    response = await agenerate_llm_response(prompt)
     if not response.get("status"):
         logging.error(f"LLM processing failed for chunk {chunk['chunk_num']}")
-        return {"llm_error": response.get("error")}
+        return {**chunk, "processed": False, "llm_error": response.get("error")}
     
     try:
         return {
@@ -161,4 +274,112 @@ async def process_chunk_with_llm(chunk: Dict, doc_type: str) -> Dict:
             **chunk,
             "llm_analysis": {"error": "Invalid LLM response format"},
             "processed": False
-        }
\ No newline at end of file
+        }
+
+def _pack_chunks(chunks: List[Dict], token_budget: int, max_chunks: int) -> List[List[Dict]]:
+    """Greedily group consecutive chunks so each pack's content stays within token_budget."""
+    packs: List[List[Dict]] = []
+    current: List[Dict] = []
+    used = 0
+    for chunk in chunks:
+        tokens = chunk.get("token_estimate") or len(chunk["content"]) // 4
+        if current and (used + tokens > token_budget or len(current) >= max_chunks):
+            packs.append(current)
+            current, used = [], 0
+        current.append(chunk)
+        used += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+def parse_json_reply(content: str) -> Any:
+    """JSON from a model reply, with or without a ```json fence; raises ValueError if there is none."""
+    fenced = re.search(r"```(?:json)?([\s\S]*?)```", content)
+    return json.loads(fenced.group(1) if fenced else content)
+
+def _parse_packed_reply(content: str) -> Dict[int, Dict]:
+    """Map chunk_num -> analysis from a packed reply; raises ValueError if it is not a JSON array."""
+    data = parse_json_reply(content)
+    if isinstance(data, dict):
+        data = data.get("chunks", data.get("results"))
+    if not isinstance(data, list):
+        raise ValueError("Packed reply is not a JSON array")
+
+    analyses = {}
+    for item in data:
+        if isinstance(item, dict) and "chunk_num" in item:
+            try:
+                analyses[int(item.pop("chunk_num"))] = item
+            except (TypeError, ValueError):
+                continue
+    return analyses
+
+async def _process_pack(pack: List[Dict], doc_type: str) -> List[Dict]:
+    if len(pack) == 1:
+        return [await process_chunk_with_llm(pack[0], doc_type)]
+
+    sections = "\n\n".join(
+        f"<chunk chunk_num={chunk['chunk_num']}>\n{chunk['content']}\n</chunk>" for chunk in pack
+    )
+    prompt = f"""
+    Analyze each of the following {doc_type} document chunks separately and extract, per chunk:
+    1. Key entities (people, organizations, dates)
+    2. Main topics
+    3. Action items (if any)
+
+    Chunks:
+    {sections}
+
+    Return ONLY a JSON array with exactly one object per chunk, in this format:
+    [
+        {{
+            "chunk_num": <number from the chunk tag>,
+            "entities": ["list"],
+            "topics": ["list"],
+            "actions": ["list"],
+            "summary": "string"
+        }}
+    ]
+    """
+
+    response = await agenerate_llm_response(
+        prompt, completion_tokens=settings.llm_completion_token_reserve * len(pack)
+    )
+    analyses: Dict[int, Dict] = {}
+    if response.get("status"):
+        try:
+            analyses = _parse_packed_reply(response["content"])
+        except (ValueError, json.JSONDecodeError):
+            logging.error(f"Malformed packed reply for chunks {[c['chunk_num'] for c in pack]}")
+    else:
+        logging.error(f"Packed LLM request failed: {response.get('error')}")
+
+    # Anything the model skipped or mangled is retried on its own
+    missing = [chunk for chunk in pack if not isinstance(analyses.get(chunk["chunk_num"]), dict)]
+    retried = await asyncio.gather(*[process_chunk_with_llm(chunk, doc_type) for chunk in missing])
+    retried_by_num = {chunk["chunk_num"]: result for chunk, result in zip(missing, retried)}
+
+    return [
+        retried_by_num[chunk["chunk_num"]] if chunk["chunk_num"] in retried_by_num
+        else {**chunk, "llm_analysis": analyses[chunk["chunk_num"]], "processed": True}
+        for chunk in pack
+    ]
+
+async def process_chunks_packed(
+    chunks: List[Dict],
+    doc_type: str,
+    token_budget: Optional[int] = None,
+    max_chunks: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Analyze chunks several at a time: each request carries a pack of chunks up to
+    token_budget and the reply is split back onto the chunks by chunk_num.
+    Results are returned in the input order.
+    """
+    packs = _pack_chunks(
+        chunks,
+        token_budget or settings.llm_pack_token_budget,
+        max_chunks or settings.llm_pack_max_chunks,
+    )
+    results = await asyncio.gather(*[_process_pack(pack, doc_type) for pack in packs])
+    return [chunk for pack_result in results for chunk in pack_result]
\ No newline at end of file
@@ -0,0 +1,184 @@
+"""
+RAG over many documents at once.
+
+A question scoped to a list of documents (or to every document of a doc_type) is
+answered map-reduce style: each document is searched and asked on its own,
+concurrently and with its own small context budget, then the per-document findings
+are reduced into one answer. Reduction is hierarchical, so the number of documents
+never pushes a single prompt past the context budget.
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional
+
+from sqlmodel import Session, desc, select
+
+from app.core.config import get_settings
+from app.models import PDFDocument
+from app.services.context_builder import build_context, format_context
+from app.services.dedup import resolve_canonical
+from app.services.llm_extractor import agenerate_llm_response, parse_json_reply
+from app.services.vector_store import search_chunks
+from app.utils.tokens import count_tokens_batch
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def resolve_fanout_documents(
+    session: Session,
+    pdf_ids: Optional[List[str]] = None,
+    doc_type: Optional[str] = None,
+) -> List[Dict]:
+    """
+    The distinct canonical documents a multi-document question covers, newest first,
+    capped at RAG_FANOUT_MAX_DOCUMENTS.
+    """
+    query = select(PDFDocument).where(PDFDocument.status != "failed").order_by(desc(PDFDocument.upload_time))
+    if pdf_ids:
+        query = query.where(PDFDocument.id.in_(pdf_ids))
+    if doc_type:
+        query = query.where(PDFDocument.doc_type == doc_type)
+
+    documents: Dict[str, Dict] = {}
+    for pdf_doc in session.exec(query).all():
+        # Deduplicated uploads read the chunks of the document they link to
+        canonical = resolve_canonical(session, pdf_doc)
+        documents.setdefault(str(canonical.id), {
+            "pdf_id": str(canonical.id),
+            "filename": pdf_doc.filename,
+            "doc_type": canonical.doc_type,
+        })
+        if len(documents) >= settings.rag_fanout_max_documents:
+            break
+    return list(documents.values())
+
+
+def _map_prompt(question: str, document: Dict, passages: List[Dict]) -> str:
+    contexts = "\n".join(format_context(p) for p in passages)
+    return f"""
+Using only the context from the document "{document['filename']}", extract what is
+relevant to the question. Do not answer for other documents.
+Return JSON with: relevant (true/false), answer (concise, include exact figures), source (page), confidence (0 to 1).
+
+Context:
+{contexts}
+
+Question: {question}
+JSON:
+"""
+
+
+def _reduce_prompt(question: str, findings: List[str], final: bool) -> str:
+    # Intermediate levels must not drop figures the final level will need
+    combine = "" if final else "Combine them into one finding and keep every figure needed to answer, with its filename.\n"
+    return f"""
+Answer the question strictly using the per-document findings below. Aggregate across
+documents where the question asks for it (totals, comparisons, lists).
+{combine}Return JSON with: answer, sources (list of filenames), confidence (0 to 1).
+
+Findings:
+{chr(10).join(findings)}
+
+Question: {question}
+JSON:
+"""
+
+
+async def _map_document(question: str, document: Dict, limit: asyncio.Semaphore) -> Dict:
+    async with limit:
+        filters = [("pdf_id", document["pdf_id"])]
+        hits = await asyncio.to_thread(search_chunks, question, filters, settings.rag_candidate_hits)
+        passages = await asyncio.to_thread(
+            build_context, question, hits, settings.rag_fanout_doc_token_budget
+        )
+        result = {**document, "relevant": False, "finding": None, "retrieved_chunks": passages}
+        if not passages:
+            return result
+
+        response = await agenerate_llm_response(
+            _map_prompt(question, document, passages),
+            completion_tokens=settings.rag_fanout_map_completion_tokens,
+        )
+    if not response.get("status"):
+        logger.error(f"Map step failed for {document['pdf_id']}: {response.get('error')}")
+        return {**result, "error": response.get("error")}
+
+    try:
+        finding = parse_json_reply(response["content"])
+    except ValueError:
+        finding = {"relevant": True, "answer": response["content"]}
+    if not isinstance(finding, dict):
+        finding = {"relevant": True, "answer": finding}
+    return {**result, "relevant": finding.get("relevant") is not False, "finding": finding}
+
+
+def _group_by_budget(findings: List[str], token_budget: int) -> List[List[str]]:
+    """Consecutive findings grouped so each group stays within token_budget (at least two per group)."""
+    groups: List[List[str]] = []
+    current: List[str] = []
+    used = 0
+    for finding, tokens in zip(findings, count_tokens_batch(findings)):
+        if len(current) >= 2 and used + tokens > token_budget:
+            groups.append(current)
+            current, used = [], 0
+        current.append(finding)
+        used += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+async def _reduce(question: str, findings: List[str], limit: asyncio.Semaphore) -> Dict:
+    """Reduce findings level by level until one prompt holds them all."""
+    while True:
+        groups = _group_by_budget(findings, settings.rag_context_token_budget)
+        if len(groups) == 1:
+            return await agenerate_llm_response(_reduce_prompt(question, groups[0], final=True))
+
+        async def reduce_group(group: List[str]) -> str:
+            async with limit:
+                response = await agenerate_llm_response(_reduce_prompt(question, group, final=False))
+            if not response.get("status"):
+                raise RuntimeError(f"Reduce step failed: {response.get('error')}")
+            return f"[Combined findings] {response['content']}"
+
+        findings = await asyncio.gather(*[reduce_group(group) for group in groups])
+
+
+async def answer_across_documents(question: str, documents: List[Dict]) -> Dict:
+    """
+    Map the question over documents concurrently (RAG_FANOUT_CONCURRENCY at a time),
+    then reduce the relevant findings into one answer.
+    """
+    limit = asyncio.Semaphore(settings.rag_fanout_concurrency)
+    mapped = await asyncio.gather(*[_map_document(question, document, limit) for document in documents])
+
+    relevant = [m for m in mapped if m["relevant"]]
+    response = {
+        "documents": [
+            {
+                "pdf_id": m["pdf_id"],
+                "filename": m["filename"],
+                "relevant": m["relevant"],
+                "finding": m["finding"],
+                "chunk_nums": [n for p in m["retrieved_chunks"] for n in p.get("chunk_nums", [])],
+                **({"error": m["error"]} if "error" in m else {}),
+            }
+            for m in mapped
+        ],
+        "retrieved_chunks": [p for m in relevant for p in m["retrieved_chunks"]],
+    }
+    if not relevant:
+        return {**response, "result": None}
+
+    findings = [
+        f"[Document: {m['filename']}] {json.dumps(m['finding'], default=str)}" for m in relevant
+    ]
+    try:
+        result = await _reduce(question, findings, limit)
+    except RuntimeError as e:
+        logger.error(str(e))
+        result = {"status": False, "error": str(e)}
+    return {**response, "result": result}
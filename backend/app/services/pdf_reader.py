@@ -1,18 +1,164 @@
+import asyncio
+import itertools
+import multiprocessing
 import fitz
-from typing import List, Dict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, List, Dict, Optional, Tuple, Union
+from app.core.config import get_settings
 
-def extract_text_from_pdf(content: bytes) -> List[Dict]:
-    """Return list of {page_no, text} so we retain page info."""
+settings = get_settings()
+
+# Raw PDF bytes or a path to the PDF on disk
+PDFSource = Union[bytes, str, Path]
+
+def _open(source: PDFSource) -> fitz.Document:
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open("pdf", source)
+    return fitz.open(str(source))
+
+def _render_table(rows: List[List[Optional[str]]]) -> str:
+    """Table rows as "| a | b |" lines, one per row."""
+    def cell(value: Optional[str]) -> str:
+        return " ".join((value or "").split())
+    return "".join("| " + " | ".join(cell(v) for v in row) + " |\n" for row in rows)
+
+def _read_page(page: fitz.Page, page_no: int) -> Dict:
+    """
+    {page_no, text, tables} for one page.
+
+    On pages where PyMuPDF's layout analysis finds tables, the text is rebuilt from the
+    page's text blocks in reading order with each table rendered as "| cell |" rows,
+    and tables lists their {start, end, header_lines} character spans in that text.
+    """
+    text = page.get_text() or ""
+    if not settings.pdf_detect_tables:
+        return {"page_no": page_no, "text": text}
+    try:
+        tables = page.find_tables().tables
+    except Exception:
+        tables = []
+    if not tables:
+        return {"page_no": page_no, "text": text}
+
+    rects = [fitz.Rect(table.bbox) for table in tables]
+    items = []
+    for x0, y0, x1, y1, block_text, _, block_type in page.get_text("blocks", sort=True):
+        # Text inside a table comes from the table's cells instead
+        if block_type == 0 and not any(fitz.Rect(x0, y0, x1, y1).intersects(r) for r in rects):
+            items.append((y0, x0, block_text if block_text.endswith("\n") else block_text + "\n", False))
+    for table, rect in zip(tables, rects):
+        rows = table.extract()
+        if table.header.external:
+            rows = [table.header.names] + rows
+        items.append((rect.y0, rect.x0, _render_table(rows), True))
+    items.sort(key=lambda item: (item[0], item[1]))
+
+    parts: List[str] = []
+    spans: List[Dict] = []
+    offset = 0
+    for _, _, piece, is_table in items:
+        if is_table:
+            spans.append({"start": offset, "end": offset + len(piece), "header_lines": 1})
+        parts.append(piece)
+        offset += len(piece)
+    return {"page_no": page_no, "text": "".join(parts), "tables": spans}
+
+def extract_text_from_pdf(content: PDFSource) -> List[Dict]:
+    """Return list of {page_no, text, tables?} so we retain page info."""
     pages = []
-    with fitz.open("pdf", content) as doc:
+    with _open(content) as doc:
         for i, page in enumerate(doc):
-            pages.append({"page_no": i+1, "text": page.get_text() or ""})
+            pages.append(_read_page(page, i+1))
     return pages
 
-def extract_full_text(content: bytes) -> str:
+def extract_full_text(content: PDFSource) -> str:
     """Extract all text from PDF concatenated into a single string"""
     full_text = []
-    with fitz.open("pdf", content) as doc:
+    with _open(content) as doc:
         for page in doc:
             full_text.append(page.get_text() or "")
-    return "\n".join(full_text)
\ No newline at end of file
+    return "\n".join(full_text)
+
+# --- process pool engine ---
+
+def _page_count(source: PDFSource) -> int:
+    with _open(source) as doc:
+        return doc.page_count
+
+def _extract_page_range(source: PDFSource, start: int, stop: int) -> List[Dict]:
+    """Runs in a worker process: pages [start, stop) as {page_no, text, tables?}."""
+    with _open(source) as doc:
+        return [_read_page(doc[i], i+1) for i in range(start, stop)]
+
+def page_ranges(page_count: int, pages_per_task: int) -> List[Tuple[int, int]]:
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+_pool: ProcessPoolExecutor | None = None
+
+def get_extraction_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the API process has live threads (uvicorn, gRPC) that fork would copy mid-state
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.pdf_extract_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+def shutdown_extraction_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+async def aextract_text_from_pdf(content: PDFSource) -> List[Dict]:
+    """
+    extract_text_from_pdf without blocking the event loop.
+
+    Parsing runs in the process pool; documents longer than PDF_PAGES_PER_TASK pages
+    are split into page ranges parsed concurrently and merged back in page order.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool()
+    count = await loop.run_in_executor(pool, _page_count, content)
+    ranges = page_ranges(count, settings.pdf_pages_per_task)
+    results = await asyncio.gather(*[
+        loop.run_in_executor(pool, _extract_page_range, content, start, stop)
+        for start, stop in ranges
+    ])
+    return [page for pages in results for page in pages]
+
+async def aextract_full_text(content: PDFSource) -> str:
+    """extract_full_text on the process pool."""
+    pages = await aextract_text_from_pdf(content)
+    return "\n".join(page["text"] for page in pages)
+
+async def aiter_pdf_pages(content: PDFSource, lookahead: Optional[int] = None) -> AsyncIterator[Dict]:
+    """
+    Yield {page_no, text} in page order without materializing the whole document.
+
+    At most ``lookahead`` page ranges are parsed ahead of the consumer, so memory
+    stays bounded by the range size however many pages the PDF has.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool()
+    count = await loop.run_in_executor(pool, _page_count, content)
+    ranges = iter(page_ranges(count, settings.pdf_pages_per_task))
+
+    def submit(page_range: Tuple[int, int]):
+        return loop.run_in_executor(pool, _extract_page_range, content, *page_range)
+
+    pending = deque(submit(r) for r in itertools.islice(ranges, lookahead or settings.pipeline_lookahead_ranges))
+    try:
+        while pending:
+            pages = await pending.popleft()
+            next_range = next(ranges, None)
+            if next_range:
+                pending.append(submit(next_range))
+            for page in pages:
+                yield page
+    finally:
+        for future in pending:
+            future.cancel()
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+Streaming ingestion pipeline: pages -> chunks -> LLM analysis -> sinks.
+
+Each stage hands batches to the next through a bounded asyncio.Queue, so a slow
+LLM or database applies backpressure all the way back to the PDF parser and
+memory stays constant however many pages the document has.
+"""
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, List, Tuple
+
+from sqlalchemy import update
+
+from app.core.config import get_settings
+from app.models import PDFDocument
+from app.services.boilerplate import BoilerplateFilter, astrip_boilerplate
+from app.services.chunking import PageChunker, aiter_chunks
+from app.services.dedup import with_linked_duplicates
+from app.services.ingestion import get_db_session, get_ingest_checkpoint, process_batch_parallel, store_chunk_batch
+from app.services.pdf_reader import aiter_pdf_pages
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's output
+_DONE = None
+
+
+def document_pages(pdf_path: str, boilerplate: BoilerplateFilter) -> AsyncIterator[Dict]:
+    """The PDF's pages in order, without boilerplate when STRIP_BOILERPLATE is on."""
+    pages = aiter_pdf_pages(pdf_path)
+    return astrip_boilerplate(pages, boilerplate) if settings.strip_boilerplate else pages
+
+
+async def read_document_head(
+    pdf_path: str,
+    min_chunks: int,
+    min_chars: int,
+) -> Tuple[List[str], List[Dict], bool, List[Dict]]:
+    """
+    Parse only as many pages as needed for min_chunks chunks and min_chars of text.
+
+    Returns (page texts, chunks, complete, boilerplate) where complete means the whole
+    document was read and boilerplate lists the repeated lines stripped from the pages.
+    The chunks are exactly the first chunks run_ingestion_pipeline produces, so it can
+    skip them by number.
+    """
+    page_texts: List[str] = []
+    chunks: List[Dict] = []
+    chars = 0
+    chunker = PageChunker()
+    boilerplate = BoilerplateFilter()
+    pages = document_pages(pdf_path, boilerplate)
+    try:
+        async for page in pages:
+            page_texts.append(page["text"])
+            chars += len(page["text"])
+            chunks.extend(chunker.add_page(page))
+            if len(chunks) >= min_chunks and chars >= min_chars:
+                return page_texts, chunks, False, boilerplate.metadata()
+    finally:
+        await pages.aclose()
+    return page_texts, chunks + chunker.finish(), True, boilerplate.metadata()
+
+
+def _store_batch(pdf_id: str, filename: str, doc_type: str, batch: List[Dict]):
+    with get_db_session() as db:
+        store_chunk_batch(db, pdf_id, filename, doc_type, batch, checkpoint=True)
+
+
+def _load_checkpoint(pdf_id: str) -> int:
+    with get_db_session() as db:
+        return get_ingest_checkpoint(db, pdf_id)
+
+
+def _mark_complete(pdf_id: str, total_chunks: int, boilerplate: List[Dict]):
+    with get_db_session() as db:
+        pdf_doc = db.get(PDFDocument, pdf_id)
+        extracted_data = dict(pdf_doc.extracted_data or {}) if pdf_doc else {}
+        extracted_data["total_chunks"] = total_chunks
+        extracted_data["boilerplate"] = boilerplate
+        # Linked duplicates were created with the status of the time and follow the original
+        db.execute(
+            update(PDFDocument)
+            .where(with_linked_duplicates(pdf_id))
+            .values(status="processed", extracted_data=extracted_data)
+        )
+        db.commit()
+
+
+async def run_ingestion_pipeline(
+    pdf_id: str,
+    pdf_path: str,
+    filename: str,
+    doc_type: str,
+    skip_chunks: int = 0,
+):
+    """
+    Stream a stored PDF through chunking, LLM analysis and storage.
+
+    Chunks numbered <= skip_chunks were ingested by the upload request, and chunks up
+    to the document's checkpoint by an earlier attempt of this job; neither is sent to
+    the LLM again. Raises on failure so the job queue can redeliver.
+    """
+    checkpoint = await asyncio.to_thread(_load_checkpoint, pdf_id)
+    if checkpoint > skip_chunks:
+        logger.info(f"Resuming {pdf_id} after chunk {checkpoint}")
+        skip_chunks = checkpoint
+    batch_size = settings.queue_batch_size
+    to_analyze: asyncio.Queue = asyncio.Queue(maxsize=settings.pipeline_buffer_batches)
+    to_store: asyncio.Queue = asyncio.Queue(maxsize=settings.pipeline_buffer_batches)
+    total_chunks = 0
+    boilerplate = BoilerplateFilter()
+
+    async def produce():
+        nonlocal total_chunks
+        batch = []
+        async for chunk in aiter_chunks(document_pages(pdf_path, boilerplate)):
+            total_chunks = chunk["chunk_num"]
+            if chunk["chunk_num"] <= skip_chunks:
+                continue
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                await to_analyze.put(batch)
+                batch = []
+        if batch:
+            await to_analyze.put(batch)
+        await to_analyze.put(_DONE)
+
+    async def analyze():
+        while (batch := await to_analyze.get()) is not _DONE:
+            await to_store.put(await process_batch_parallel(batch, doc_type))
+        await to_store.put(_DONE)
+
+    async def sink():
+        while (batch := await to_store.get()) is not _DONE:
+            await asyncio.to_thread(_store_batch, pdf_id, filename, doc_type, batch)
+            logger.info(f"Stored chunks {batch[0]['chunk_num']}-{batch[-1]['chunk_num']} of {pdf_id}")
+
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(produce())
+        tg.create_task(analyze())
+        tg.create_task(sink())
+
+    await asyncio.to_thread(_mark_complete, pdf_id, total_chunks, boilerplate.metadata())
+    logger.info(f"Pipeline finished for {pdf_id}: {total_chunks} chunks")
@@ -0,0 +1,312 @@
+"""
+Durable job queue for document ingestion.
+
+The upload route enqueues the stored PDF, and workers (``python -m app.worker``)
+reserve the job under a lease, stream the document through the pipeline and ack. A job whose lease expires
+before it is acked (e.g. the worker died) is handed to the next worker.
+
+Every delivery carries its own lease token; ack, nack and extend_lease only act
+while that token still holds the lease, so a worker that lost its lease cannot
+settle or renew the redelivered job.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+import redis
+from pydantic import BaseModel, Field
+
+from app.core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+DOCUMENT = "document"  # stream a stored PDF through the ingestion pipeline
+
+
+class Job(BaseModel):
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    kind: str = DOCUMENT
+    payload: Dict[str, Any]
+    attempts: int = 0  # deliveries so far, including the current one
+    enqueued_at: float = Field(default_factory=time.time)
+    lease: Optional[str] = None  # token of the current delivery, set by reserve
+
+
+def _lease_token() -> str:
+    return uuid.uuid4().hex
+
+
+class JobQueue:
+    """Interface shared by the queue backends."""
+
+    def enqueue(self, job: Job) -> str:
+        raise NotImplementedError
+
+    def reserve(self, timeout: float = 0) -> Optional[Job]:
+        """Lease the next job, waiting up to ``timeout`` seconds. Returns None if idle."""
+        raise NotImplementedError
+
+    def ack(self, job: Job) -> bool:
+        """Remove a finished job. False if this delivery no longer holds the lease."""
+        raise NotImplementedError
+
+    def nack(self, job: Job, error: Optional[str] = None, retry: bool = True) -> bool:
+        """
+        Give a job back; it is dead-lettered once it used up its deliveries, or at once
+        without ``retry``. Returns True if the job was dead-lettered.
+        """
+        raise NotImplementedError
+
+    def extend_lease(self, job: Job) -> bool:
+        """Push the lease deadline out. False if this delivery no longer holds the lease."""
+        raise NotImplementedError
+
+
+class InMemoryJobQueue(JobQueue):
+    """Single-process queue with the same lease semantics as Redis. For tests and local dev."""
+
+    def __init__(self, lease_seconds: int, max_deliveries: int):
+        self.lease_seconds = lease_seconds
+        self.max_deliveries = max_deliveries
+        self._pending: deque = deque()
+        self._leased: Dict[str, Tuple[str, float]] = {}  # job id -> (lease token, deadline)
+        self._jobs: Dict[str, Job] = {}
+        self.dead: List[Job] = []
+        self._cond = threading.Condition()
+
+    def enqueue(self, job: Job) -> str:
+        with self._cond:
+            self._jobs[job.id] = job
+            self._pending.append(job.id)
+            self._cond.notify()
+        return job.id
+
+    def _requeue_expired(self):
+        now = time.time()
+        for job_id, (_, deadline) in list(self._leased.items()):
+            if deadline <= now:
+                del self._leased[job_id]
+                self._pending.append(job_id)
+
+    def reserve(self, timeout: float = 0) -> Optional[Job]:
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                self._requeue_expired()
+                if self._pending:
+                    job_id = self._pending.popleft()
+                    job = self._jobs[job_id]
+                    job.attempts += 1
+                    token = _lease_token()
+                    self._leased[job_id] = (token, time.time() + self.lease_seconds)
+                    return job.model_copy(update={"lease": token})
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(min(remaining, 0.5))
+
+    def _holds_lease(self, job: Job) -> bool:
+        lease = self._leased.get(job.id)
+        return lease is not None and lease[0] == job.lease
+
+    def ack(self, job: Job) -> bool:
+        with self._cond:
+            if not self._holds_lease(job):
+                return False
+            del self._leased[job.id]
+            del self._jobs[job.id]
+            return True
+
+    def nack(self, job: Job, error: Optional[str] = None, retry: bool = True) -> bool:
+        with self._cond:
+            if not self._holds_lease(job):
+                return False  # lease expired and the job went to another delivery
+            del self._leased[job.id]
+            stored = self._jobs[job.id]
+            if not retry or stored.attempts >= self.max_deliveries:
+                self.dead.append(self._jobs.pop(job.id))
+                logger.error(f"Job {job.id} dead-lettered after {stored.attempts} attempts: {error}")
+                return True
+            self._pending.append(job.id)
+            self._cond.notify()
+            return False
+
+    def extend_lease(self, job: Job) -> bool:
+        with self._cond:
+            if not self._holds_lease(job):
+                return False
+            self._leased[job.id] = (job.lease, time.time() + self.lease_seconds)
+            return True
+
+
+# Moves expired leases back to pending, then pops one job and leases it - atomically,
+# so a crash between the pop and the lease cannot lose a job.
+_RESERVE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('HDEL', KEYS[5], id)
+    redis.call('LPUSH', KEYS[1], id)
+end
+local id = redis.call('RPOP', KEYS[1])
+if not id then
+    return nil
+end
+local raw = redis.call('HGET', KEYS[3], id)
+if not raw then
+    return nil
+end
+redis.call('ZADD', KEYS[2], ARGV[2], id)
+redis.call('HSET', KEYS[5], id, ARGV[3])
+local attempts = redis.call('HINCRBY', KEYS[4], id, 1)
+return {raw, attempts}
+"""
+
+# The scripts below act only while ARGV[1] (job id) is leased under ARGV[2] (token).
+_ACK_SCRIPT = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[3], ARGV[1])
+redis.call('HDEL', KEYS[4], ARGV[1])
+return 1
+"""
+
+# Returns -1 for a stale token, 1 if the job was dead-lettered, 0 if it went back to pending.
+_NACK_SCRIPT = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return -1
+end
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+local attempts = tonumber(redis.call('HGET', KEYS[4], ARGV[1]) or '0')
+if ARGV[5] == '0' or attempts >= tonumber(ARGV[3]) then
+    redis.call('LPUSH', KEYS[6], ARGV[4])
+    redis.call('HDEL', KEYS[3], ARGV[1])
+    redis.call('HDEL', KEYS[4], ARGV[1])
+    return 1
+end
+redis.call('LPUSH', KEYS[5], ARGV[1])
+return 0
+"""
+
+_EXTEND_SCRIPT = """
+if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return 1
+"""
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Redis-backed queue.
+
+    Keys: ``<name>:pending`` (list of ids), ``<name>:leased`` (zset id -> lease deadline),
+    ``<name>:leases`` (hash id -> lease token), ``<name>:jobs`` (hash id -> job json),
+    ``<name>:attempts`` and ``<name>:dead``.
+    """
+
+    def __init__(self, client: redis.Redis, name: str, lease_seconds: int, max_deliveries: int):
+        self.redis = client
+        self.lease_seconds = lease_seconds
+        self.max_deliveries = max_deliveries
+        self.pending_key = f"{name}:pending"
+        self.leased_key = f"{name}:leased"
+        self.leases_key = f"{name}:leases"
+        self.jobs_key = f"{name}:jobs"
+        self.attempts_key = f"{name}:attempts"
+        self.dead_key = f"{name}:dead"
+        self._reserve = self.redis.register_script(_RESERVE_SCRIPT)
+        self._ack = self.redis.register_script(_ACK_SCRIPT)
+        self._nack = self.redis.register_script(_NACK_SCRIPT)
+        self._extend = self.redis.register_script(_EXTEND_SCRIPT)
+
+    def enqueue(self, job: Job) -> str:
+        pipe = self.redis.pipeline()
+        pipe.hset(self.jobs_key, job.id, job.model_dump_json())
+        pipe.lpush(self.pending_key, job.id)
+        pipe.execute()
+        return job.id
+
+    def reserve(self, timeout: float = 0) -> Optional[Job]:
+        deadline = time.time() + timeout
+        while True:
+            now = time.time()
+            token = _lease_token()
+            result = self._reserve(
+                keys=[self.pending_key, self.leased_key, self.jobs_key, self.attempts_key, self.leases_key],
+                args=[now, now + self.lease_seconds, token],
+            )
+            if result:
+                raw, attempts = result
+                job = Job.model_validate_json(raw)
+                job.attempts = int(attempts)
+                job.lease = token
+                return job
+            if now >= deadline:
+                return None
+            time.sleep(min(0.5, max(deadline - now, 0)))
+
+    def ack(self, job: Job) -> bool:
+        return bool(self._ack(
+            keys=[self.leased_key, self.leases_key, self.jobs_key, self.attempts_key],
+            args=[job.id, job.lease or ""],
+        ))
+
+    def nack(self, job: Job, error: Optional[str] = None, retry: bool = True) -> bool:
+        dead = json.dumps({"job": job.model_dump(exclude={"lease"}), "error": error})
+        result = self._nack(
+            keys=[self.leased_key, self.leases_key, self.jobs_key, self.attempts_key, self.pending_key, self.dead_key],
+            args=[job.id, job.lease or "", self.max_deliveries, dead, int(retry)],
+        )
+        if result == 1:
+            logger.error(f"Job {job.id} dead-lettered after {job.attempts} attempts: {error}")
+        return result == 1
+
+    def extend_lease(self, job: Job) -> bool:
+        return bool(self._extend(
+            keys=[self.leased_key, self.leases_key],
+            args=[job.id, job.lease or "", time.time() + self.lease_seconds],
+        ))
+
+
+@lru_cache
+def get_job_queue() -> JobQueue:
+    if settings.queue_backend == "memory":
+        return InMemoryJobQueue(settings.queue_lease_seconds, settings.queue_max_deliveries)
+    return RedisJobQueue(
+        redis.Redis.from_url(settings.redis_url, decode_responses=True),
+        settings.queue_name,
+        settings.queue_lease_seconds,
+        settings.queue_max_deliveries,
+    )
+
+
+def enqueue_document(
+    pdf_id: str,
+    storage_key: str,
+    filename: str,
+    doc_type: str,
+    skip_chunks: int = 0,
+) -> str:
+    """
+    Queue a whole stored PDF for the streaming pipeline, skipping chunks already ingested.
+    ``storage_key`` names the file under UPLOAD_DIR, which workers resolve on their side.
+    """
+    return get_job_queue().enqueue(Job(kind=DOCUMENT, payload={
+        "pdf_id": pdf_id,
+        "storage_key": storage_key,
+        "filename": filename,
+        "doc_type": doc_type,
+        "skip_chunks": skip_chunks,
+    }))
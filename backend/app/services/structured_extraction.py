@@ -0,0 +1,178 @@
+"""
+Whole-document structured extraction, map-reduce style.
+
+Map: the document's chunks are grouped into token-bounded parts and each part is
+extracted on its own, concurrently. The map prompt depends only on the text and the
+doc_type, never on the caller's goal, so the LLM response cache serves every later
+extraction of the same document whatever the goal.
+Reduce: partial results are merged field by field in document order (lists
+concatenated without duplicates, nested objects merged recursively, scalars keep the
+first value found) into one object per doc_type schema. A goal, if given, is then
+applied to that merged object with a single small LLM call.
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+from app.core.config import get_settings
+from app.services.chunking import smart_chunk_text
+from app.services.llm_extractor import EXTRACTION_INSTRUCTIONS, agenerate_llm_response, parse_json_reply
+from app.utils.tokens import count_tokens_batch
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Fields that hold one entry per item; a part that returns a single object is wrapped
+LIST_FIELDS = {
+    "medical": ["dates", "diagnoses", "treatments", "meds"],
+    "invoice": ["line_items"],
+    "resume": ["education", "experience", "skills"],
+}
+
+
+def _llm_used() -> str:
+    return settings.ollama_model if settings.use_ollama else settings.chat_model
+
+
+def group_parts(chunks: List[Dict], token_budget: int) -> List[str]:
+    """Consecutive chunk texts joined into parts of at most token_budget tokens."""
+    parts: List[str] = []
+    current: List[str] = []
+    used = 0
+    contents = [chunk["content"] for chunk in chunks]
+    for content, tokens in zip(contents, count_tokens_batch(contents)):
+        if current and used + tokens > token_budget:
+            parts.append("\n".join(current))
+            current, used = [], 0
+        current.append(content)
+        used += tokens
+    if current:
+        parts.append("\n".join(current))
+    return parts
+
+
+def _map_prompt(part: str, doc_type: str) -> str:
+    head = EXTRACTION_INSTRUCTIONS.get(doc_type or "default", EXTRACTION_INSTRUCTIONS["default"])
+    return f"""{head}
+The text is one excerpt of a longer document. Include only values that appear in this
+excerpt and omit fields that do not; lists hold only the items found here.
+Text:
+{part}
+
+Rules:
+- Return ONLY JSON (no prose).
+- Use snake_case keys.
+"""
+
+
+def _goal_prompt(data: Dict, goal: str, doc_type: str) -> str:
+    return f"""The JSON below was extracted from a whole {doc_type or "default"} document.
+Goal: {goal}
+Using only this data, return the JSON that meets the goal.
+Data:
+{json.dumps(data, default=str)}
+
+Rules:
+- Return ONLY JSON (no prose).
+- Use snake_case keys.
+"""
+
+
+def _normalize_part(data: Any, doc_type: str) -> Dict:
+    if not isinstance(data, dict):
+        return {"items": data if isinstance(data, list) else [data]}
+    for field in LIST_FIELDS.get(doc_type, []):
+        if field in data and not isinstance(data[field], list):
+            data[field] = [data[field]] if data[field] not in (None, "", {}) else []
+    return data
+
+
+def _empty(value: Any) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+
+def merge_values(left: Any, right: Any, path: str, conflicts: List[Dict]) -> Any:
+    """Merge right (later in the document) into left."""
+    if _empty(left):
+        return right
+    if _empty(right):
+        return left
+    if isinstance(left, dict) and isinstance(right, dict):
+        merged = dict(left)
+        for key, value in right.items():
+            merged[key] = merge_values(merged.get(key), value, f"{path}.{key}" if path else key, conflicts)
+        return merged
+    if isinstance(left, list) or isinstance(right, list):
+        items = (left if isinstance(left, list) else [left]) + (right if isinstance(right, list) else [right])
+        seen = set()
+        unique = []
+        for item in items:
+            key = json.dumps(item, sort_keys=True, default=str).lower()
+            if key not in seen:
+                seen.add(key)
+                unique.append(item)
+        return unique
+    if str(left).strip().lower() != str(right).strip().lower():
+        conflicts.append({"field": path, "kept": left, "ignored": right})
+    return left
+
+
+def merge_partials(partials: List[Dict]) -> Dict:
+    """Partial extractions (in document order) merged into one object, plus the scalar conflicts seen."""
+    conflicts: List[Dict] = []
+    merged: Dict = {}
+    for partial in partials:
+        merged = merge_values(merged, partial, "", conflicts)
+    return {"data": merged, "conflicts": conflicts}
+
+
+async def aextract_structured_data(chunks: List[Dict], goal: Optional[str], doc_type: str) -> Dict[str, Any]:
+    """Structured data for a whole document from its chunks (dicts with "content")."""
+    # Tokenizing and chunking a whole document is CPU work; keep it off the event loop
+    parts = await asyncio.to_thread(group_parts, chunks, settings.extraction_map_token_budget)
+    limit = asyncio.Semaphore(settings.extraction_map_concurrency)
+
+    async def extract_part(part: str) -> Dict:
+        async with limit:
+            return await agenerate_llm_response(_map_prompt(part, doc_type))
+
+    responses = await asyncio.gather(*[extract_part(part) for part in parts])
+
+    partials: List[Dict] = []
+    failed_parts: List[Dict] = []
+    for i, response in enumerate(responses):
+        if not response.get("status"):
+            failed_parts.append({"part": i, "error": response.get("error")})
+            continue
+        try:
+            partials.append(_normalize_part(parse_json_reply(response["content"]), doc_type))
+        except ValueError:
+            failed_parts.append({"part": i, "error": "Reply is not JSON"})
+    if failed_parts:
+        logger.error(f"Extraction failed for {len(failed_parts)} of {len(parts)} parts")
+
+    merged = merge_partials(partials)
+    result = {
+        "structured_data": merged["data"],
+        "conflicts": merged["conflicts"],
+        "parts": len(parts),
+        "failed_parts": failed_parts,
+        "goal": goal,
+        "llm_used": _llm_used(),
+    }
+    if goal and partials:
+        response = await agenerate_llm_response(_goal_prompt(merged["data"], goal, doc_type))
+        if response.get("status"):
+            try:
+                result["structured_data"] = parse_json_reply(response["content"])
+            except ValueError:
+                result["structured_data"] = response["content"]
+        else:
+            result["goal_error"] = response.get("error")
+    return result
+
+
+async def aextract_structured_data_from_text(text: str, goal: Optional[str], doc_type: str) -> Dict[str, Any]:
+    chunks = await asyncio.to_thread(smart_chunk_text, text)
+    return await aextract_structured_data(chunks, goal, doc_type)
@@ -0,0 +1,68 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Tuple
+
+from fastapi import UploadFile
+
+from app.core.config import get_settings
+
+settings = get_settings()
+
+
+class MissingUploadError(FileNotFoundError):
+    """A queued job names a stored upload this process cannot find."""
+
+
+def upload_root() -> Path:
+    root = Path(settings.upload_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+def storage_key(pdf_id) -> str:
+    """Name of a stored upload, relative to UPLOAD_DIR; jobs carry this, never a local path."""
+    return f"{pdf_id}.pdf"
+
+
+def resolve_storage_key(key: str) -> Path:
+    """Local path of a stored upload, raising MissingUploadError if it is not there."""
+    if not key or Path(key).name != key:
+        raise MissingUploadError(f"Invalid upload storage key: {key!r}")
+    path = upload_root() / key
+    if not path.is_file():
+        raise MissingUploadError(
+            f"Stored upload {key} not found in {path.parent.resolve()}; "
+            "the API and workers must share UPLOAD_DIR"
+        )
+    return path
+
+
+async def stream_upload_to_tempfile(file: UploadFile, upload_dir: Path) -> Tuple[Path, str]:
+    """
+    Copy an upload to a temp file in upload_dir in fixed-size blocks, hashing as it goes.
+
+    Only one block is held in memory at a time, whatever the PDF size.
+    Returns (temp_path, sha256 hex digest).
+    """
+    digest = hashlib.sha256()
+    fd, tmp_name = tempfile.mkstemp(suffix=".part", dir=upload_dir)
+    tmp_path = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while block := await file.read(settings.upload_block_size):
+                digest.update(block)
+                await asyncio.to_thread(out.write, block)
+            await asyncio.to_thread(os.fsync, out.fileno())
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return tmp_path, digest.hexdigest()
+
+
+def promote_upload(tmp_path: Path, dest: Path) -> Path:
+    """Atomically move a finished temp upload to its final name (same filesystem)."""
+    os.replace(tmp_path, dest)
+    return dest
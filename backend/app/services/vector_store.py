@@ -0,0 +1,440 @@
+"""
+Pluggable vector store for chunk search.
+
+``WeaviateVectorStore`` wraps app.services.weaviate_store. ``LocalVectorStore`` keeps
+float32 vectors in a memory-mapped file and scores them by brute force with NumPy,
+fused with a BM25 inverted index the way Weaviate's hybrid query does. It serves small
+deployments and CI without Weaviate, and, mirrored behind Weaviate, keeps /rag/query
+answering when Weaviate is down or overloaded. It can be rebuilt from the pdfchunk
+table at any time: ``python -m app.services.vector_store rebuild``.
+"""
+import fcntl
+import json
+import logging
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlmodel import Session, select
+
+from app.core.config import get_settings
+from app.db.session import engine
+from app.models import PDFChunk
+from app.services.embeddings import EmbeddingService, app_side_embeddings, get_embedding_service
+from app.services.fts import search_chunks_fts
+from app.services.weaviate_store import chunk_uuid, clone_pdf_in_weaviate, search_weaviate, store_pdf_in_weaviate
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+Filters = Optional[List[Tuple[str, str]]]
+
+
+class VectorStore:
+    """Where chunk vectors live and how they are searched."""
+
+    def upsert(self, pdf_id: str, filename: str, chunks: List[Dict], doc_type: str) -> None:
+        raise NotImplementedError
+
+    def search(self, query: str, filters: Filters = None, limit: int = 6) -> List[Dict]:
+        """Hits as {content, pdf_id, doc_type, filename, page_no, score}; raises if the store is unavailable."""
+        raise NotImplementedError
+
+    def clone(self, src_pdf_id: str, dst_pdf_id: str, filename: str) -> None:
+        raise NotImplementedError
+
+
+class WeaviateVectorStore(VectorStore):
+    def upsert(self, pdf_id: str, filename: str, chunks: List[Dict], doc_type: str) -> None:
+        store_pdf_in_weaviate(pdf_id, filename, chunks, doc_type)
+
+    def search(self, query: str, filters: Filters = None, limit: int = 6) -> List[Dict]:
+        return search_weaviate(query, filters=filters, limit=limit)
+
+    def clone(self, src_pdf_id: str, dst_pdf_id: str, filename: str) -> None:
+        clone_pdf_in_weaviate(src_pdf_id, dst_pdf_id, filename)
+
+
+def _tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+class BM25Index:
+    """In-memory inverted index with Okapi BM25 scoring."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.doc_terms: Dict[int, List[str]] = {}
+        self.lengths: Dict[int, int] = {}
+        self.total_length = 0
+
+    def add(self, doc_id: int, text: str):
+        self.remove(doc_id)
+        counts = Counter(_tokenize(text))
+        for term, tf in counts.items():
+            self.postings[term][doc_id] = tf
+        self.doc_terms[doc_id] = list(counts)
+        self.lengths[doc_id] = sum(counts.values())
+        self.total_length += self.lengths[doc_id]
+
+    def remove(self, doc_id: int):
+        for term in self.doc_terms.pop(doc_id, []):
+            self.postings[term].pop(doc_id, None)
+        self.total_length -= self.lengths.pop(doc_id, 0)
+
+    def scores(self, query: str, candidates: Optional[Set[int]] = None) -> Dict[int, float]:
+        n_docs = len(self.lengths)
+        if not n_docs:
+            return {}
+        avg_length = self.total_length / n_docs or 1.0
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(_tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                if candidates is not None and doc_id not in candidates:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    if not scores.size:
+        return scores
+    low, high = scores.min(), scores.max()
+    if high - low < 1e-12:
+        return np.ones_like(scores) if high > 0 else np.zeros_like(scores)
+    return (scores - low) / (high - low)
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Brute-force NumPy store over a memory-mapped float32 matrix plus BM25.
+
+    Files in ``path``: vectors.f32 (row-major, L2-normalized), meta.jsonl (one
+    record per write, later records for a row win) and index.json (dimensions and
+    embedder). Writers take an exclusive flock, so the API and worker processes can
+    share one directory; each process tails meta.jsonl to pick up the other's writes.
+    """
+
+    def __init__(self, path: str, embeddings: EmbeddingService, alpha: float = 0.75):
+        self.dir = Path(path)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.dir / "vectors.f32"
+        self.meta_path = self.dir / "meta.jsonl"
+        self.index_path = self.dir / "index.json"
+        self.lock_path = self.dir / ".lock"
+        self.embeddings = embeddings
+        self.alpha = alpha
+        self._lock = threading.RLock()
+        self._reset_memory()
+        with self._file_lock(fcntl.LOCK_SH):
+            self._load_index()
+            self._sync()
+
+    def _reset_memory(self):
+        self.rows: List[Dict] = []
+        self.row_by_uuid: Dict[str, int] = {}
+        self.bm25 = BM25Index()
+        self.dims: Optional[int] = None
+        self._meta_offset = 0
+        self._matrix: Optional[np.memmap] = None
+
+    @contextmanager
+    def _file_lock(self, mode: int):
+        with self._lock, open(self.lock_path, "a") as handle:
+            fcntl.flock(handle, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        if not self.index_path.exists():
+            return
+        index = json.loads(self.index_path.read_text())
+        if index.get("embedder") != self.embeddings.backend.name:
+            logger.warning(
+                f"Local vector store was built with {index.get('embedder')}, not "
+                f"{self.embeddings.backend.name}; starting empty until it is rebuilt"
+            )
+            self._clear_files()
+            return
+        self.dims = index["dims"]
+
+    def _clear_files(self):
+        for file in (self.vectors_path, self.meta_path, self.index_path):
+            file.unlink(missing_ok=True)
+
+    def _sync(self):
+        """Apply meta records appended since the last sync (by this or another process)."""
+        if not self.meta_path.exists():
+            if self._meta_offset:
+                # Rebuilt from scratch by another process
+                self._reset_memory()
+                self._load_index()
+            return
+        if self.meta_path.stat().st_size < self._meta_offset:
+            self._reset_memory()
+            self._load_index()
+        with open(self.meta_path, "rb") as meta:
+            meta.seek(self._meta_offset)
+            for line in meta:
+                if not line.endswith(b"\n"):
+                    break  # partially written record; picked up on the next sync
+                self._apply(json.loads(line))
+                self._meta_offset += len(line)
+
+    def _apply(self, record: Dict):
+        row = record.pop("row")
+        if row == len(self.rows):
+            self.rows.append(record)
+        else:
+            self.rows[row] = record
+        self.row_by_uuid[record["uuid"]] = row
+        self.bm25.add(row, record["content"])
+        self._matrix = None
+
+    def _vectors(self) -> np.memmap:
+        if self._matrix is None or self._matrix.shape[0] != len(self.rows):
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self.rows), self.dims))
+        return self._matrix
+
+    def _normalized(self, vectors: List[List[float]]) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def upsert(self, pdf_id: str, filename: str, chunks: List[Dict], doc_type: str) -> None:
+        if not chunks:
+            return
+        vectors = self._normalized(self.embeddings.embed_texts([chunk.get("embedding_text", chunk["content"]) for chunk in chunks]))
+        records = [{
+            "uuid": chunk_uuid(pdf_id, chunk["chunk_num"]),
+            "pdf_id": pdf_id,
+            "filename": filename,
+            "doc_type": doc_type,
+            "chunk_num": chunk["chunk_num"],
+            "page_no": chunk.get("approx_page"),
+            "end_page": chunk.get("end_page", chunk.get("approx_page")),
+            "content": chunk["content"],
+        } for chunk in chunks]
+        self._write(records, vectors)
+
+    def _write(self, records: List[Dict], vectors: np.ndarray):
+        with self._file_lock(fcntl.LOCK_EX):
+            self._sync()
+            if self.dims is None:
+                self.dims = int(vectors.shape[1])
+                self.index_path.write_text(json.dumps({"dims": self.dims, "embedder": self.embeddings.backend.name}))
+            elif vectors.shape[1] != self.dims:
+                raise ValueError(f"Vector size {vectors.shape[1]} does not match the local store ({self.dims})")
+
+            lines = []
+            new_rows: Dict[str, int] = {}
+            with open(self.vectors_path, "r+b" if self.vectors_path.exists() else "w+b") as out:
+                for record, vector in zip(records, vectors):
+                    row = self.row_by_uuid.get(record["uuid"], new_rows.get(record["uuid"]))
+                    if row is None:
+                        row = new_rows[record["uuid"]] = len(self.rows) + len(new_rows)
+                    out.seek(row * self.dims * 4)
+                    out.write(vector.tobytes())
+                    lines.append(json.dumps({**record, "row": row}) + "\n")
+            # Vectors first, then the records that make them visible to readers
+            with open(self.meta_path, "a") as meta:
+                meta.writelines(lines)
+            self._sync()
+
+    def search(self, query: str, filters: Filters = None, limit: int = 6) -> List[Dict]:
+        # Embedding can wait on the API; do it before taking the lock writers need
+        query_vector = self._normalized([self.embeddings.embed_query(query)])[0]
+        with self._file_lock(fcntl.LOCK_SH):
+            self._sync()
+            if not self.rows:
+                return []
+            candidates = np.arange(len(self.rows))
+            for key, value in filters or []:
+                candidates = candidates[[self.rows[i].get(key) == value for i in candidates]]
+            if not candidates.size:
+                return []
+
+            vector_scores = np.asarray(self._vectors()[candidates] @ query_vector, dtype=np.float32)
+            keyword = self.bm25.scores(query, set(candidates.tolist()))
+            keyword_scores = np.array([keyword.get(i, 0.0) for i in candidates], dtype=np.float32)
+            fused = self.alpha * _min_max(vector_scores) + (1 - self.alpha) * _min_max(keyword_scores)
+
+            top = np.argsort(-fused, kind="stable")[:limit]
+            return [{
+                "content": self.rows[candidates[i]]["content"],
+                "pdf_id": self.rows[candidates[i]]["pdf_id"],
+                "doc_type": self.rows[candidates[i]]["doc_type"],
+                "filename": self.rows[candidates[i]]["filename"],
+                "page_no": self.rows[candidates[i]]["page_no"],
+                "end_page": self.rows[candidates[i]].get("end_page"),
+                "chunk_num": self.rows[candidates[i]]["chunk_num"],
+                "score": float(fused[i])
+            } for i in top]
+
+    def clone(self, src_pdf_id: str, dst_pdf_id: str, filename: str) -> None:
+        with self._file_lock(fcntl.LOCK_SH):
+            self._sync()
+            rows = [i for i, record in enumerate(self.rows) if record["pdf_id"] == src_pdf_id]
+            if not rows:
+                return
+            vectors = np.array(self._vectors()[rows])
+            records = [{
+                **self.rows[i],
+                "uuid": chunk_uuid(dst_pdf_id, self.rows[i]["chunk_num"]),
+                "pdf_id": dst_pdf_id,
+                "filename": filename,
+            } for i in rows]
+        self._write(records, vectors)
+
+    def reset(self):
+        with self._file_lock(fcntl.LOCK_EX):
+            self._clear_files()
+            self._reset_memory()
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class FallbackVectorStore(VectorStore):
+    """Writes to both stores; searches the primary and falls back to the secondary when it fails."""
+
+    def __init__(self, primary: VectorStore, secondary: VectorStore):
+        self.primary = primary
+        self.secondary = secondary
+
+    def _mirror(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            # The mirror can always be rebuilt from pdfchunk; never fail ingestion on it
+            logger.warning(f"Fallback vector store write failed: {e}")
+
+    def upsert(self, pdf_id: str, filename: str, chunks: List[Dict], doc_type: str) -> None:
+        self.primary.upsert(pdf_id, filename, chunks, doc_type)
+        self._mirror(self.secondary.upsert, pdf_id, filename, chunks, doc_type)
+
+    def search(self, query: str, filters: Filters = None, limit: int = 6) -> List[Dict]:
+        try:
+            return self.primary.search(query, filters=filters, limit=limit)
+        except Exception as e:
+            logger.warning(f"Primary vector store failed, serving from fallback: {e}")
+            return self.secondary.search(query, filters=filters, limit=limit)
+
+    def clone(self, src_pdf_id: str, dst_pdf_id: str, filename: str) -> None:
+        self.primary.clone(src_pdf_id, dst_pdf_id, filename)
+        self._mirror(self.secondary.clone, src_pdf_id, dst_pdf_id, filename)
+
+
+@lru_cache
+def get_local_vector_store() -> LocalVectorStore:
+    return LocalVectorStore(settings.local_vector_store_path, get_embedding_service())
+
+
+@lru_cache
+def get_vector_store() -> VectorStore:
+    if settings.vector_store_backend == "local":
+        return get_local_vector_store()
+    if settings.vector_store_fallback:
+        if app_side_embeddings():
+            return FallbackVectorStore(WeaviateVectorStore(), get_local_vector_store())
+        # The mirror would embed every chunk through the API a second time
+        logger.info("Local fallback mirror disabled: Weaviate vectorizes chunks (EMBEDDING_BACKEND=weaviate)")
+    return WeaviateVectorStore()
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict]], k: int = 60, limit: int = 6) -> List[Dict]:
+    """Merge ranked hit lists by sum(1 / (k + rank)); a chunk is identified by (pdf_id, chunk_num)."""
+    fused: Dict[Tuple, Dict] = {}
+    scores: Dict[Tuple, float] = defaultdict(float)
+    for hits in result_lists:
+        for rank, hit in enumerate(hits, start=1):
+            key = (hit.get("pdf_id"), hit.get("chunk_num")) if hit.get("chunk_num") is not None else (hit.get("content"),)
+            scores[key] += 1.0 / (k + rank)
+            fused[key] = {**hit, **fused.get(key, {})}
+    ranked = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [{**fused[key], "score": scores[key]} for key in ranked]
+
+
+def search_chunks(query: str, filters: Filters = None, limit: int = 6, lexical: Optional[bool] = None) -> List[Dict]:
+    """
+    Search the configured store; [] only when every backend failed.
+
+    With lexical (default SEARCH_RRF_FTS), Postgres full-text hits are merged in by
+    reciprocal rank fusion, which also keeps keyword matches coming if the store is down.
+    """
+    lexical = settings.search_rrf_fts if lexical is None else lexical
+    try:
+        hits = get_vector_store().search(query, filters=filters, limit=limit)
+    except Exception as e:
+        logging.error(f"Search failed: {e}")
+        hits = []
+    if not lexical:
+        return hits
+
+    try:
+        with Session(engine) as session:
+            keyword_hits = search_chunks_fts(session, query, filters=filters, limit=limit)
+    except Exception as e:
+        logging.error(f"Full-text search failed: {e}")
+        keyword_hits = []
+    return reciprocal_rank_fusion([hits, keyword_hits], k=settings.search_rrf_k, limit=limit)
+
+
+def rebuild_local_vector_store(db: Session, batch_size: int = 500) -> int:
+    """Recreate the local store from the pdfchunk table. Returns the number of chunks indexed."""
+    store = get_local_vector_store()
+    store.reset()
+    rows = db.exec(
+        select(PDFChunk)
+        .order_by(PDFChunk.pdf_id, PDFChunk.chunk_num)
+        .execution_options(yield_per=batch_size)
+    )
+    batch: List[PDFChunk] = []
+    total = 0
+
+    def flush():
+        nonlocal total
+        first = batch[0]
+        store.upsert(str(first.pdf_id), first.filename, [{
+            "chunk_num": row.chunk_num,
+            "approx_page": row.approx_page,
+            "end_page": (row.chunk_meta or {}).get("end_page", row.approx_page),
+            "content": row.content,
+        } for row in batch], first.doc_type)
+        total += len(batch)
+
+    for row in rows:
+        if batch and (row.pdf_id != batch[0].pdf_id or len(batch) >= batch_size):
+            flush()
+            batch = []
+        batch.append(row)
+    if batch:
+        flush()
+    logger.info(f"Rebuilt local vector store with {total} chunks")
+    return total
+
+
+if __name__ == "__main__":
+    import sys
+    from app.services.ingestion import get_db_session
+
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m app.services.vector_store rebuild")
+    with get_db_session() as db:
+        print(f"Indexed {rebuild_local_vector_store(db)} chunks")
@@ -1,10 +1,14 @@
+import asyncio
+import threading
 from typing import List, Dict, Optional
 import weaviate
 from weaviate.classes.config import Configure, Property, DataType, VectorDistances
 from weaviate.classes.init import Auth
 from weaviate.exceptions import WeaviateBaseError, WeaviateStartUpError
+from weaviate.util import generate_uuid5
 
 from app.core.config import get_settings
+from app.services.embeddings import VECTOR_NAME, app_side_embeddings, get_embedding_service
 import math
 import time
 import logging
@@ -13,29 +17,112 @@ settings = get_settings()
 CLASS_NAME = "PDFChunks"
 logger = logging.getLogger(__name__)
 
-def get_weaviate_client(max_retries: int = 3) -> weaviate.WeaviateClient:
+def _headers() -> Dict[str, str]:
+    return {
+        "X-OpenAI-Api-Key":settings.openai_api_key
+    }
+
+def connect_weaviate(max_retries: int = 3) -> weaviate.WeaviateClient:
+    """Open a new sync client. Most code wants the shared get_weaviate_client() instead."""
     for attempt in range(max_retries):
         try:
-            
-            headers = {
-                "X-OpenAI-Api-Key":settings.openai_api_key
-            }
             client = weaviate.connect_to_local(
                 #auth_credentials=Auth.api_key(settings.weaviate_api_key),
-                host="weaviate", 
-                grpc_port=50051, 
-                port=8080, 
-                headers= headers
+                host=settings.weaviate_host, 
+                grpc_port=settings.weaviate_grpc_port, 
+                port=settings.weaviate_port, 
+                headers=_headers()
                 ) 
 
             if client.is_ready():
                 logger.info("Successfully connected to Weaviate")
                 return client
+            client.close()
         except WeaviateStartUpError as e:
             logger.warning(f"Connection attempt {attempt + 1} failed: {e}")
             if attempt == max_retries - 1:
                 raise
             time.sleep(2 ** attempt)  # Exponential backoff
+    raise WeaviateStartUpError("Weaviate is not ready")
+
+# --- shared client ---
+# One long-lived client per process, opened by the FastAPI lifespan hook or lazily
+# by workers. Callers must not close it.
+
+_client: Optional[weaviate.WeaviateClient] = None
+_client_checked_at = 0.0
+_client_lock = threading.Lock()
+
+def _health_check_due(checked_at: float) -> bool:
+    return time.monotonic() - checked_at >= settings.weaviate_health_check_seconds
+
+def get_weaviate_client() -> weaviate.WeaviateClient:
+    """The shared sync client, reconnected if a periodic health check fails."""
+    global _client, _client_checked_at
+    with _client_lock:
+        if _client is not None and _health_check_due(_client_checked_at):
+            try:
+                healthy = _client.is_ready()
+            except Exception:
+                healthy = False
+            if not healthy:
+                logger.warning("Weaviate client unhealthy, reconnecting")
+                _close_quietly(_client)
+                _client = None
+            _client_checked_at = time.monotonic()
+        if _client is None:
+            _client = connect_weaviate()
+            _client_checked_at = time.monotonic()
+        return _client
+
+def _close_quietly(client: weaviate.WeaviateClient):
+    try:
+        client.close()
+    except Exception as e:
+        logger.warning(f"Closing Weaviate client failed: {e}")
+
+def close_weaviate_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _close_quietly(_client)
+            _client = None
+
+async def aclose_weaviate_client():
+    """Graceful shutdown from async code: close the shared client off the event loop."""
+    await asyncio.to_thread(close_weaviate_client)
+
+_schema_ready = False
+
+def ensure_schema():
+    """init_schema once per process; later calls are free."""
+    global _schema_ready
+    if not _schema_ready:
+        init_schema()
+        _schema_ready = True
+
+def _vector_config():
+    hnsw = Configure.VectorIndex.hnsw(distance_metric=VectorDistances.COSINE)
+    if app_side_embeddings():
+        # Vectors come from app.services.embeddings
+        return Configure.Vectors.self_provided(name=VECTOR_NAME, vector_index_config=hnsw)
+    if settings.use_ollama:
+        return Configure.Vectors.text2vec_ollama(
+            name=VECTOR_NAME,
+            source_properties=["content"],
+            api_endpoint=settings.ollama_host,
+            model=settings.ollama_model,
+            vector_index_config=hnsw
+        )
+    return Configure.Vectors.text2vec_openai(
+        name=VECTOR_NAME,
+        source_properties=["content"],
+        model=settings.embedding_model,
+        dimensions=1536,
+        base_url="https://api.openai.com/v1",
+        vectorize_collection_name=True,
+        vector_index_config=hnsw
+    )
 
 def init_schema():
     client = get_weaviate_client()
@@ -44,89 +131,91 @@ def init_schema():
     #    client.collections.delete(CLASS_NAME)
     try:
         if not client.collections.exists("PDFChunks"):
-            if settings.use_ollama:
-                client.collections.create(
-                    name=CLASS_NAME,
-                    vector_config=Configure.Vectors.text2vec_ollama(
-                        name="chunk_vector",
-                        source_properties=["content"],
-                        api_endpoint=settings.ollama_host,
-                        model=settings.ollama_model,
-                        vector_index_config=Configure.VectorIndex.hnsw(
-                            distance_metric=VectorDistances.COSINE
-                        )
-                    ),
-                    properties=[
-                        Property(name="pdf_id", data_type=DataType.TEXT),
-                        Property(name="filename", data_type=DataType.TEXT),
-                        Property(name="doc_type", data_type=DataType.TEXT),
-                        Property(name="chunk_num", data_type=DataType.INT),
-                        Property(name="page_no", data_type=DataType.INT),
-                        Property(name="content", data_type=DataType.TEXT),
-                        Property(
-                            name="chunk_meta",
-                            data_type=DataType.OBJECT,
-                            nested_properties=[
-                                Property(name="char_count", data_type=DataType.INT),
-                                Property(name="word_count", data_type=DataType.INT),
-                                Property(name="has_tables", data_type=DataType.BOOL),
-                                Property(name="has_figures", data_type=DataType.BOOL),
-                                Property(name="llm_analysis", data_type=DataType.TEXT),
-                                Property(name="processed", data_type=DataType.BOOL),
-                            ],
-                        ),
-                    ],
-                )
-            else:
-                client.collections.create(
-                    name=CLASS_NAME,
-                    vector_config=Configure.Vectors.text2vec_openai(
-                        name="chunk_vector",
-                        source_properties=["content"],
-                        model=settings.embedding_model,
-                        dimensions=1536,
-                        base_url="https://api.openai.com/v1",
-                        vectorize_collection_name=True,
-                        vector_index_config=Configure.VectorIndex.hnsw(
-                            distance_metric=VectorDistances.COSINE
-                        )
+            client.collections.create(
+                name=CLASS_NAME,
+                vector_config=_vector_config(),
+                properties=[
+                    Property(name="pdf_id", data_type=DataType.TEXT),
+                    Property(name="filename", data_type=DataType.TEXT),
+                    Property(name="doc_type", data_type=DataType.TEXT),
+                    Property(name="chunk_num", data_type=DataType.INT),
+                    Property(name="page_no", data_type=DataType.INT),
+                    Property(name="content", data_type=DataType.TEXT),
+                    Property(
+                        name="chunk_meta",
+                        data_type=DataType.OBJECT,
+                        nested_properties=[
+                            Property(name="char_count", data_type=DataType.INT),
+                            Property(name="word_count", data_type=DataType.INT),
+                            Property(name="has_tables", data_type=DataType.BOOL),
+                            Property(name="has_figures", data_type=DataType.BOOL),
+                            Property(name="llm_analysis", data_type=DataType.TEXT),
+                            Property(name="processed", data_type=DataType.BOOL),
+                        ],
                     ),
-                    properties=[
-                        Property(name="pdf_id", data_type=DataType.TEXT),
-                        Property(name="filename", data_type=DataType.TEXT),
-                        Property(name="doc_type", data_type=DataType.TEXT),
-                        Property(name="chunk_num", data_type=DataType.INT),
-                        Property(name="page_no", data_type=DataType.INT),
-                        Property(name="content", data_type=DataType.TEXT),
-                        Property(
-                            name="chunk_meta",
-                            data_type=DataType.OBJECT,
-                            nested_properties=[
-                                Property(name="char_count", data_type=DataType.INT),
-                                Property(name="word_count", data_type=DataType.INT),
-                                Property(name="has_tables", data_type=DataType.BOOL),
-                                Property(name="has_figures", data_type=DataType.BOOL),
-                                Property(name="llm_analysis", data_type=DataType.TEXT),
-                                Property(name="processed", data_type=DataType.BOOL),
-                            ],
-                        ),
-                    ],
-                )
+                ],
+            )
     except WeaviateBaseError as e:
         print(f"Schema creation failed: {e.message}")
         raise
-    finally:
-        client.close()
 
-def store_pdf_in_weaviate(pdf_id: str, filename: str, chunks: List[Dict], doc_type: str):
-    client = get_weaviate_client()
-    if client is None:
-        return
-    coll = client.collections.get(CLASS_NAME)
-    
-    batch = []
-    for chunk in chunks:
-        batch.append({
+def chunk_uuid(pdf_id: str, chunk_num: int) -> str:
+    """Deterministic object id, so re-importing a chunk overwrites it instead of duplicating it."""
+    return generate_uuid5(f"{pdf_id}:{chunk_num}")
+
+def _batch_context(coll):
+    mode = settings.weaviate_batch_mode
+    if mode == "fixed":
+        return coll.batch.fixed_size(
+            batch_size=settings.weaviate_batch_size,
+            concurrent_requests=settings.weaviate_batch_concurrency
+        )
+    if mode == "rate":
+        # Stay under the vectorizer's quota instead of tripping its 429s
+        return coll.batch.rate_limit(requests_per_minute=settings.weaviate_batch_rpm)
+    return coll.batch.dynamic()
+
+def import_objects(objects: List[Dict]) -> Dict:
+    """
+    Upsert {uuid, properties, vector?} objects through Weaviate's batcher.
+
+    Objects that fail are re-sent on their own, up to WEAVIATE_BATCH_RETRIES times;
+    raises if any are still failing after that. Returns throughput stats.
+    """
+    coll = get_weaviate_client().collections.get(CLASS_NAME)
+    started = time.perf_counter()
+    pending = objects
+    for attempt in range(settings.weaviate_batch_retries + 1):
+        if attempt:
+            logger.warning(f"Retrying {len(pending)} failed Weaviate objects (attempt {attempt})")
+            time.sleep(min(2 ** (attempt - 1), 10))
+        with _batch_context(coll) as batch:
+            for obj in pending:
+                batch.add_object(properties=obj["properties"], uuid=obj["uuid"], vector=obj.get("vector"))
+        failed = coll.batch.failed_objects
+        if not failed:
+            pending = []
+            break
+        failed_ids = {str(err.object_.uuid) for err in failed}
+        pending = [obj for obj in pending if str(obj["uuid"]) in failed_ids]
+        last_error = failed[0].message
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "objects": len(objects) - len(pending),
+        "failed": len(pending),
+        "seconds": round(elapsed, 3),
+        "objects_per_second": round((len(objects) - len(pending)) / elapsed, 1) if elapsed else 0.0
+    }
+    logger.info(f"Weaviate import: {stats['objects']} objects in {stats['seconds']}s ({stats['objects_per_second']} obj/s)")
+    if pending:
+        raise RuntimeError(f"{len(pending)} objects failed to import into Weaviate: {last_error}")
+    return stats
+
+def store_pdf_in_weaviate(pdf_id: str, filename: str, chunks: List[Dict], doc_type: str) -> Dict:
+    objects = [{
+        "uuid": chunk_uuid(pdf_id, chunk["chunk_num"]),
+        "properties": {
             "pdf_id": pdf_id,
             "filename": filename,
             "doc_type": doc_type,
@@ -141,26 +230,41 @@ def store_pdf_in_weaviate(pdf_id: str, filename: str, chunks: List[Dict], doc_ty
                 "llm_analysis": chunk.get("llm_analysis", {}),
                 "processed": chunk.get("processed", False)
             }
-        })
-        
-        # Insert in batches of 50
-        if len(batch) >= 50:
-            try:
-                coll.data.insert_many(batch)
-                batch = []
-            except Exception as e:
-                logging.error(f"Batch insert failed: {e}")
-                batch = []  # Reset batch
-    
-    if batch:
-        try:
-            coll.data.insert_many(batch)
-        except Exception as e:
-            logging.error(f"Final batch insert failed: {e}")   
-    client.close()
+        }
+    } for chunk in chunks]
+    if app_side_embeddings():
+        vectors = get_embedding_service().embed_texts([chunk.get("embedding_text", chunk["content"]) for chunk in chunks])
+        for obj, vector in zip(objects, vectors):
+            obj["vector"] = {VECTOR_NAME: vector}
+    return import_objects(objects)
     
-def search_chunks(query: str, filters: list[tuple[str, str]] = None, limit: int = 6):
-    import weaviate
+def clone_pdf_in_weaviate(src_pdf_id: str, dst_pdf_id: str, filename: str, page_size: int = 500):
+    """Copy a document's objects under a new pdf_id, vectors included, so nothing is re-vectorized."""
+    from weaviate.classes.query import Filter
+
+    coll = get_weaviate_client().collections.get(CLASS_NAME)
+    offset = 0
+    while True:
+        res = coll.query.fetch_objects(
+            filters=Filter.by_property("pdf_id").equal(src_pdf_id),
+            include_vector=True,
+            limit=page_size,
+            offset=offset
+        )
+        if not res.objects:
+            break
+        import_objects([
+            {
+                "uuid": chunk_uuid(dst_pdf_id, o.properties.get("chunk_num")),
+                "properties": {**o.properties, "pdf_id": dst_pdf_id, "filename": filename},
+                "vector": o.vector
+            }
+            for o in res.objects
+        ])
+        offset += len(res.objects)
+
+def search_weaviate(query: str, filters: list[tuple[str, str]] = None, limit: int = 6):
+    """Hybrid search, falling back to BM25. Raises if Weaviate can't answer at all."""
     from weaviate.classes.query import Filter
     from weaviate.exceptions import WeaviateQueryError
     import logging
@@ -191,8 +295,12 @@ def search_chunks(query: str, filters: list[tuple[str, str]] = None, limit: int
         # res = coll.query.near_text(query=query, limit=limit, filters=where_filter)
         
         # Alternative: Use hybrid search which might be more stable
+        # The query is embedded with the same cached embedder as the chunks
+        query_vector = get_embedding_service().embed_query(query) if app_side_embeddings() else None
         res = coll.query.hybrid(
             query=query,
+            vector=query_vector,
+            target_vector=VECTOR_NAME,
             limit=limit,
             filters=where_filter,
             alpha=0.75  # Balance between keyword and vector search
@@ -205,6 +313,7 @@ def search_chunks(query: str, filters: list[tuple[str, str]] = None, limit: int
                 "doc_type": o.properties.get("doc_type"),
                 "filename": o.properties.get("filename"),
                 "page_no": o.properties.get("page_no"),
+                "chunk_num": o.properties.get("chunk_num"),
                 "score": o.metadata.score if hasattr(o, 'metadata') else None
             }
             for o in res.objects
@@ -227,6 +336,7 @@ def search_chunks(query: str, filters: list[tuple[str, str]] = None, limit: int
                     "doc_type": o.properties.get("doc_type"),
                     "filename": o.properties.get("filename"),
                     "page_no": o.properties.get("page_no"),
+                    "chunk_num": o.properties.get("chunk_num"),
                     "score": o.metadata.score if hasattr(o, 'metadata') else None
                 }
                 for o in res.objects
@@ -234,14 +344,4 @@ def search_chunks(query: str, filters: list[tuple[str, str]] = None, limit: int
             return hits
         except Exception as fallback_error:
             logging.error(f"Fallback search also failed: {fallback_error}")
-            return []
-    except Exception as e:
-        logging.error(f"Unexpected error in search: {e}")
-        return []
-    finally:
-        try:
-            client.close()
-        except:
-            pass
-
-
+            raise
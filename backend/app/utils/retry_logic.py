@@ -0,0 +1,289 @@
+"""
+Shared rate limiting and retries for LLM calls.
+
+Every LLM caller (chunk extraction, doc-type detection, /prompt/engineer, /rag/query)
+goes through ``llm_limiter`` so a process stays inside the provider's requests-per-minute
+and tokens-per-minute quota instead of turning 429s into failed chunks. The limits are
+per process: with several workers, give each one its share of the quota.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+from tenacity import (
+    AsyncRetrying,
+    Retrying,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from app.core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class TokenBucket:
+    """Continuously refilling bucket holding at most one minute of quota."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` is available (0 if it is available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class AdaptiveRateLimiter:
+    """
+    RPM/TPM token buckets plus an AIMD concurrency window.
+
+    A 429 halves the window and pauses every caller for the retry-after period;
+    fast successful calls grow it again by one slot per full window, up to ``max_concurrency``.
+    Calls slower than ``target_latency`` shrink it by one so we back off before the provider does.
+    """
+
+    def __init__(
+        self,
+        rpm: int,
+        tpm: int,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        target_latency: float = 20.0,
+    ):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._successes = 0
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = max(
+                self.paused_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(tokens, now),
+            )
+            if wait <= 0 and self.in_flight >= self.concurrency:
+                wait = 0.05
+            if wait > 0:
+                return wait
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            return 0.0
+
+    def acquire(self, tokens: int):
+        while (wait := self._try_acquire(tokens)) > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int):
+        while (wait := self._try_acquire(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+    def release(
+        self,
+        latency: float,
+        rate_limited: bool = False,
+        retry_after: Optional[float] = None,
+        unused_tokens: int = 0,
+    ):
+        with self._lock:
+            self.in_flight = max(self.in_flight - 1, 0)
+            if unused_tokens >= 0:
+                self.tokens.give_back(unused_tokens)
+            else:
+                self.tokens.take(-unused_tokens)  # the call used more than we reserved
+
+            if rate_limited:
+                self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                self._successes = 0
+                pause = retry_after if retry_after is not None else 1.0
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+                logger.warning(f"LLM rate limited; concurrency -> {self.concurrency}, pausing {pause:.1f}s")
+                return
+
+            if latency > self.target_latency:
+                self.concurrency = max(self.min_concurrency, self.concurrency - 1)
+                self._successes = 0
+                return
+
+            self._successes += 1
+            if self._successes >= self.concurrency and self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self._successes = 0
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: Optional[int] = None) -> int:
+    """Rough prompt size plus the completion we reserve for; corrected after the call."""
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4 + 4 * len(messages)
+    return prompt_tokens + (max_tokens or settings.llm_completion_token_reserve)
+
+
+def _retry_after(e: Exception) -> Optional[float]:
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(e: BaseException) -> bool:
+    if isinstance(e, RateLimitError):
+        # An exhausted billing quota will not recover by waiting
+        return getattr(e, "code", None) != "insufficient_quota"
+    if isinstance(e, (APIConnectionError, APITimeoutError)):
+        return True
+    if isinstance(e, APIStatusError):
+        return e.status_code >= 500
+    return False
+
+
+def _retry_policy() -> Dict[str, Any]:
+    return dict(
+        retry=retry_if_exception(is_retryable),
+        wait=wait_random_exponential(multiplier=1, max=settings.llm_retry_max_wait_seconds),
+        stop=stop_after_attempt(settings.llm_retry_attempts),
+        reraise=True,
+    )
+
+
+def _used_tokens(result: Any) -> Optional[int]:
+    usage = getattr(result, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage else None
+
+
+def call_with_retry(fn: Callable[[], T], tokens: int, limiter: Optional[AdaptiveRateLimiter] = None) -> T:
+    """Run a blocking LLM call under the limiter, retrying 429s/5xx with jittered backoff."""
+    limiter = limiter or llm_limiter
+    for attempt in Retrying(**_retry_policy()):
+        with attempt:
+            limiter.acquire(tokens)
+            start = time.monotonic()
+            try:
+                result = fn()
+            except BaseException as e:
+                # Cancellation too, or the slot would stay in flight for good
+                limiter.release(
+                    time.monotonic() - start,
+                    rate_limited=isinstance(e, RateLimitError),
+                    retry_after=_retry_after(e),
+                    unused_tokens=tokens,
+                )
+                raise
+            used = _used_tokens(result)
+            limiter.release(time.monotonic() - start, unused_tokens=tokens - used if used else 0)
+            return result
+
+
+async def acall_with_retry(
+    fn: Callable[[], Awaitable[T]], tokens: int, limiter: Optional[AdaptiveRateLimiter] = None
+) -> T:
+    """Async counterpart of call_with_retry; ``fn`` is called again for each attempt."""
+    limiter = limiter or llm_limiter
+    async for attempt in AsyncRetrying(**_retry_policy()):
+        with attempt:
+            await limiter.aacquire(tokens)
+            start = time.monotonic()
+            try:
+                result = await fn()
+            except BaseException as e:
+                # Cancellation too, or the slot would stay in flight for good
+                limiter.release(
+                    time.monotonic() - start,
+                    rate_limited=isinstance(e, RateLimitError),
+                    retry_after=_retry_after(e),
+                    unused_tokens=tokens,
+                )
+                raise
+            used = _used_tokens(result)
+            limiter.release(time.monotonic() - start, unused_tokens=tokens - used if used else 0)
+            return result
+
+
+async def astream_with_retry(
+    fn: Callable[[], Awaitable[Any]], tokens: int, limiter: Optional[AdaptiveRateLimiter] = None
+) -> AsyncIterator[Any]:
+    """
+    Open a streamed LLM call under the limiter and yield its events.
+
+    Only opening the stream is retried. The slot is held until the stream ends or this
+    generator is closed, then released with the usage the stream reported (the reservation
+    if it reported none); latency is time to the first event. Close it with aclosing().
+    """
+    limiter = limiter or llm_limiter
+    async for attempt in AsyncRetrying(**_retry_policy()):
+        with attempt:
+            await limiter.aacquire(tokens)
+            start = time.monotonic()
+            try:
+                stream = await fn()
+            except BaseException as e:
+                limiter.release(
+                    time.monotonic() - start,
+                    rate_limited=isinstance(e, RateLimitError),
+                    retry_after=_retry_after(e),
+                    unused_tokens=tokens,
+                )
+                raise
+
+    first_event: Optional[float] = None
+    used: Optional[int] = None
+    error: Optional[BaseException] = None
+    try:
+        async for event in stream:
+            first_event = first_event or time.monotonic()
+            used = _used_tokens(event) or used
+            yield event
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        try:
+            await stream.close()
+        finally:
+            limiter.release(
+                (first_event or time.monotonic()) - start,
+                rate_limited=isinstance(error, RateLimitError),
+                retry_after=_retry_after(error),
+                unused_tokens=tokens - used if used else 0,
+            )
+
+
+llm_limiter = AdaptiveRateLimiter(
+    rpm=settings.llm_rpm_limit,
+    tpm=settings.llm_tpm_limit,
+    max_concurrency=settings.llm_max_concurrency,
+    target_latency=settings.llm_target_latency_seconds,
+)
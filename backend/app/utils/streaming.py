@@ -0,0 +1,41 @@
+"""Server-Sent Events / NDJSON framing for streaming endpoints."""
+import json
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict
+
+from fastapi.responses import StreamingResponse
+
+STREAM_FORMATS = ("sse", "ndjson")
+
+MEDIA_TYPES = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def encode_event(event: Dict[str, Any], fmt: str) -> str:
+    """One event as an SSE frame (``event:`` is the event's type) or one NDJSON line."""
+    data = json.dumps(event, default=str)
+    if fmt == "sse":
+        return f"event: {event.get('type', 'message')}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+def stream_events(events: AsyncIterator[Dict[str, Any]], fmt: str = "sse") -> StreamingResponse:
+    """
+    Stream events as they are produced.
+
+    When the client disconnects Starlette cancels the response, which closes ``events``
+    and everything it is iterating (e.g. the upstream LLM stream).
+    """
+    async def body():
+        async with aclosing(events):
+            async for event in events:
+                yield encode_event(event, fmt)
+
+    return StreamingResponse(
+        body(),
+        media_type=MEDIA_TYPES[fmt],
+        # Keep proxies (nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,64 @@
+"""
+Token counting with tiktoken.
+
+Encoders are loaded once per model and cached. If an encoding cannot be loaded (an
+unknown Ollama model, or no network to fetch the BPE file), counts fall back to the
+repo's usual len(text) // 4 estimate instead of failing the request.
+"""
+import logging
+from functools import lru_cache
+from typing import List, Optional
+
+import tiktoken
+
+from app.core.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+FALLBACK_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=8)
+def get_encoder(model: Optional[str] = None) -> Optional[tiktoken.Encoding]:
+    model = model or settings.chat_model
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception as e:
+        logger.warning(f"tiktoken encoder for {model} unavailable, estimating tokens: {e}")
+        return None
+    try:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+    except Exception as e:
+        logger.warning(f"tiktoken encoder {FALLBACK_ENCODING} unavailable, estimating tokens: {e}")
+        return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    encoder = get_encoder(model)
+    if encoder is None:
+        return (len(text) + 3) // 4
+    return len(encoder.encode_ordinary(text))
+
+
+def count_tokens_batch(texts: List[str], model: Optional[str] = None) -> List[int]:
+    """Token counts for many texts; tiktoken encodes the batch on its own thread pool."""
+    encoder = get_encoder(model)
+    if encoder is None:
+        return [(len(text) + 3) // 4 for text in texts]
+    return [len(tokens) for tokens in encoder.encode_ordinary_batch(texts)]
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> str:
+    """The longest prefix of text that fits in max_tokens."""
+    if max_tokens <= 0:
+        return ""
+    encoder = get_encoder(model)
+    if encoder is None:
+        return text[:max_tokens * 4]
+    tokens = encoder.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoder.decode(tokens[:max_tokens])
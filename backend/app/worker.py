@@ -0,0 +1,84 @@
+# app/worker.py
+"""
+Ingestion worker: consumes the document jobs queued by /pdfs/upload.
+
+Run one or more with ``python -m app.worker``; they scale independently of the API.
+"""
+import asyncio
+import logging
+import signal
+
+from app.core.config import get_settings
+from app.services.ingestion import mark_document_failed
+from app.services.pipeline import run_ingestion_pipeline
+from app.services.weaviate_store import aclose_weaviate_client
+from app.services.queue_producer import DOCUMENT, Job, JobQueue, get_job_queue
+from app.services.upload_storage import MissingUploadError, resolve_storage_key
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+async def handle_job(job: Job):
+    if job.kind == DOCUMENT:
+        payload = dict(job.payload)
+        pdf_path = resolve_storage_key(payload.pop("storage_key"))
+        await run_ingestion_pipeline(pdf_path=str(pdf_path), **payload)
+    else:
+        raise ValueError(f"Unknown job kind: {job.kind}")
+
+
+async def _keep_lease(queue: JobQueue, job: Job):
+    # Renew well before expiry so long LLM batches are not redelivered mid-flight
+    interval = max(settings.queue_lease_seconds / 3, 1)
+    while True:
+        await asyncio.sleep(interval)
+        if not await asyncio.to_thread(queue.extend_lease, job):
+            logger.warning(f"Job {job.id} lost its lease; it may be redelivered to another worker")
+            return
+
+
+async def run_worker(stop: asyncio.Event | None = None, poll_timeout: float = 5.0):
+    queue = get_job_queue()
+    stop = stop or asyncio.Event()
+    logger.info(f"Worker started ({settings.queue_backend} queue)")
+
+    while not stop.is_set():
+        job = await asyncio.to_thread(queue.reserve, poll_timeout)
+        if job is None:
+            continue
+
+        keepalive = asyncio.create_task(_keep_lease(queue, job))
+        try:
+            await handle_job(job)
+            if not await asyncio.to_thread(queue.ack, job):
+                logger.warning(f"Job {job.id} finished after its lease was lost; ack ignored")
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed (attempt {job.attempts}): {e}")
+            # Another delivery will not find a missing upload either
+            retry = not isinstance(e, MissingUploadError)
+            dead = await asyncio.to_thread(queue.nack, job, str(e), retry)
+            if dead and "pdf_id" in job.payload:
+                await asyncio.to_thread(mark_document_failed, job.payload["pdf_id"])
+        finally:
+            keepalive.cancel()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    stop = asyncio.Event()
+
+    async def _run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            await run_worker(stop)
+        finally:
+            await aclose_weaviate_client()
+
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
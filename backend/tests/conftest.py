@@ -0,0 +1,22 @@
+import os
+
+# Settings without defaults; the tests below never reach the database or an LLM
+for name, value in {
+    "USE_OLLAMA": "false",
+    "OLLAMA_MODEL": "mistral",
+    "OLLAMA_HOST": "http://localhost:11434",
+    "OLLAMA_API_ENDPOINT": "http://localhost:11434/api/generate",
+    "LLM_DB_HOST": "localhost",
+    "LLM_DB_PORT": "5432",
+    "LLM_DB_USER": "test",
+    "LLM_DB_PASS": "test",
+    "LLM_DB_NAME": "test",
+    "JWT_SECRET": "test",
+    "OPENAI_API_KEY": "sk-test",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+    "MAX_CHUNK_CHARS": "1000",
+    "MAX_OVERLAPS": "100",
+    "MAX_TEXT_CHARS_UPLOAD": "10000",
+    "DOC_TYPE_DETECT_MAX_CHARS": "2000",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,70 @@
+import pytest
+
+from app.services import answer_cache
+from app.services.answer_cache import AnswerCache, normalize_question
+from app.services.embeddings import EmbeddingService, HashEmbedder
+from app.services.llm_cache import MemoryLRUCache
+
+ANSWER = {"answer": "USD 1,200", "sources": [{"page_no": 2}]}
+
+
+@pytest.fixture(autouse=True)
+def hash_embeddings(monkeypatch):
+    service = EmbeddingService(HashEmbedder(dimensions=256), cache=None, batch_size=16)
+    monkeypatch.setattr(answer_cache, "get_embedding_service", lambda: service)
+
+
+def test_normalize_question_ignores_case_punctuation_and_spacing():
+    assert normalize_question("  What is the TOTAL due?! ") == normalize_question("what is the total due")
+
+
+def test_hit_requires_same_question_document_and_version():
+    cache = AnswerCache(MemoryLRUCache())
+    cache.set("What is the total due?", "doc-a", 3, ANSWER)
+
+    assert cache.get("what is the total due", "doc-a", 3) == ANSWER
+    assert cache.get("What is the total due?", "doc-b", 3) is None
+    # Re-ingested chunks bump the version, so older answers are never served
+    assert cache.get("What is the total due?", "doc-a", 4) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_semantic_lookup_matches_a_close_question_of_the_same_version():
+    cache = AnswerCache(MemoryLRUCache(), semantic=True, threshold=0.8)
+    cache.set("what is the total amount due on this invoice", "doc-a", 1, ANSWER)
+
+    assert cache.get("what is the total amount due on the invoice", "doc-a", 1) == ANSWER
+    assert cache.semantic_hits == 1
+    assert cache.get("who signed the lease agreement", "doc-a", 1) is None
+    assert cache.get("what is the total amount due on the invoice", "doc-a", 2) is None
+
+
+def test_new_version_drops_older_questions_of_the_document():
+    cache = AnswerCache(MemoryLRUCache(), semantic=True)
+    cache.set("first question", "doc-a", 1, ANSWER)
+    cache.set("second question", "doc-a", 2, ANSWER)
+    assert list(cache._questions) == [("doc-a", 2)]
+
+
+def test_questions_kept_per_document_are_bounded():
+    cache = AnswerCache(MemoryLRUCache(), semantic=True, max_questions_per_doc=2, max_docs=2)
+    for i in range(3):
+        cache.set(f"question {i}", "doc-a", 1, ANSWER)
+    assert len(cache._questions[("doc-a", 1)]) == 2
+
+    cache.set("question", "doc-b", 1, ANSWER)
+    cache.set("question", "doc-c", 1, ANSWER)
+    assert list(cache._questions) == [("doc-b", 1), ("doc-c", 1)]
+
+
+def test_backend_failures_are_misses():
+    class Broken(MemoryLRUCache):
+        def get(self, key):
+            raise OSError("down")
+
+        def set(self, key, value, ttl=None):
+            raise OSError("down")
+
+    cache = AnswerCache(Broken(), semantic=True)
+    cache.set("question", "doc-a", 1, ANSWER)
+    assert cache.get("question", "doc-a", 1) is None
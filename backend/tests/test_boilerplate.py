@@ -0,0 +1,96 @@
+import asyncio
+
+from app.services.boilerplate import BoilerplateFilter, astrip_boilerplate
+from app.services.chunking import TABLE_PATTERN
+
+HEADER = "ACME Bank - Account Statement"
+WORDS = ["", "alpha", "bravo", "charlie", "delta", "echo", "foxtrot"]
+DISCLAIMER = "This statement is provided for information only and is not a tax document."
+
+
+def _pages(n, body):
+    return [
+        {"page_no": i, "text": f"{HEADER}\n{body(i)}\nPage {i} of {n}\n"}
+        for i in range(1, n + 1)
+    ]
+
+
+def _learned(pages):
+    boilerplate = BoilerplateFilter(sample_pages=len(pages), min_page_ratio=0.5, edge_lines=2)
+    boilerplate.learn(pages)
+    return boilerplate
+
+
+def test_strips_running_header_and_page_numbers():
+    pages = _pages(6, lambda i: f"{WORDS[i]} summary\nOpening balance for period {i}\n{WORDS[i]} notes")
+    boilerplate = _learned(pages)
+
+    for page in pages:
+        text = boilerplate.strip(page)["text"]
+        assert HEADER not in text
+        assert "of 6" not in text
+        assert f"Opening balance for period {page['page_no']}" in text
+    assert {entry["text"] for entry in boilerplate.metadata()} >= {HEADER, "Page 1 of 6"}
+
+
+def test_long_line_anywhere_is_stripped_only_on_exact_match():
+    pages = _pages(6, lambda i: (
+        f"{WORDS[i]} intro\n"
+        f"{DISCLAIMER}\n"
+        f"0{i}/05/2024  Monthly account maintenance fee  ...  {i}.00\n"
+        f"{WORDS[i]} closing"
+    ))
+    boilerplate = _learned(pages)
+
+    for page in pages:
+        text = boilerplate.strip(page)["text"]
+        assert DISCLAIMER not in text
+        # Same words with a different date and amount on every page is content, not boilerplate
+        assert f"0{page['page_no']}/05/2024  Monthly account maintenance fee  ...  {page['page_no']}.00" in text
+
+
+def test_ascii_table_lines_are_kept():
+    # Wide enough that every line would qualify as free-position boilerplate
+    table = (
+        "+--------------------------------+----------+\n"
+        "| Item                           | Amount   |\n"
+        "+--------------------------------+----------+\n"
+        "| Monthly account maintenance    | 10.00    |\n"
+        "+--------------------------------+----------+"
+    )
+    pages = _pages(6, lambda i: f"Transactions {i}\n{table}\nNotes {i}")
+    boilerplate = _learned(pages)
+
+    for page in pages:
+        text = boilerplate.strip(page)["text"]
+        assert table in text
+        assert TABLE_PATTERN.search(text).group(0) == table
+
+
+def test_layout_table_spans_shift_with_removed_lines():
+    body = "| Date | Amount |\n| 01/05 | 1.00 |"
+    pages = []
+    for page in _pages(4, lambda i: body):
+        start = page["text"].index(body)
+        pages.append({**page, "tables": [{"start": start, "end": start + len(body), "header_lines": 1}]})
+    boilerplate = _learned(pages)
+
+    stripped = boilerplate.strip(pages[0])
+    span = stripped["tables"][0]
+    assert stripped["text"][span["start"]:span["end"]] == body
+
+
+def test_astrip_boilerplate_streams_every_page_in_order():
+    pages = _pages(5, lambda i: f"Body {i}")
+
+    async def source():
+        for page in pages:
+            yield page
+
+    async def collect():
+        boilerplate = BoilerplateFilter(sample_pages=3, min_page_ratio=0.5, edge_lines=2)
+        return [page async for page in astrip_boilerplate(source(), boilerplate)]
+
+    stripped = asyncio.run(collect())
+    assert [page["page_no"] for page in stripped] == [1, 2, 3, 4, 5]
+    assert all(HEADER not in page["text"] for page in stripped)
@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from app.services.chunk_dedup import MinHashLSH, content_hash
+
+WORDS = "alpha beta gamma delta epsilon zeta theta kappa lambda sigma omega rho".split()
+
+
+def _text(seed, n=120):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) + str(rng.randint(0, 50)) for _ in range(n))
+
+
+def _lsh(max_entries=100):
+    return MinHashLSH(num_perm=64, bands=16, max_entries=max_entries)
+
+
+def test_content_hash_ignores_whitespace_only():
+    assert content_hash("Total  due:\n 1,200") == content_hash("Total due: 1,200")
+    assert content_hash("Total due: 1,200") != content_hash("Total due: 1,300")
+
+
+def test_bands_must_divide_permutations():
+    with pytest.raises(ValueError):
+        MinHashLSH(num_perm=64, bands=10, max_entries=10)
+
+
+def test_near_duplicate_is_found_and_unrelated_text_is_not():
+    lsh = _lsh()
+    original = _text(1)
+    lsh.add("invoice", "a", lsh.signature(original))
+
+    words = original.split()
+    words[60] = "changed"
+    matches = lsh.query("invoice", lsh.signature(" ".join(words)), threshold=0.8)
+    assert [key for key, _ in matches] == ["a"]
+    assert 0.8 <= matches[0][1] < 1.0
+
+    assert lsh.query("invoice", lsh.signature(_text(2)), threshold=0.5) == []
+
+
+def test_identical_text_scores_one_and_matches_are_ranked():
+    lsh = _lsh()
+    original = _text(1)
+    words = original.split()
+    lsh.add("invoice", "same", lsh.signature(original))
+    lsh.add("invoice", "close", lsh.signature(" ".join(words[:-8] + ["changed"] * 8)))
+
+    matches = lsh.query("invoice", lsh.signature(original), threshold=0.5)
+    assert [key for key, _ in matches] == ["same", "close"]
+    assert matches[0][1] == 1.0
+
+
+def test_lookups_stay_within_a_doc_type():
+    lsh = _lsh()
+    text = _text(1)
+    lsh.add("invoice", "a", lsh.signature(text))
+    assert lsh.query("resume", lsh.signature(text), threshold=0.5) == []
+
+
+def test_oldest_entries_are_evicted_from_every_bucket():
+    lsh = _lsh(max_entries=2)
+    texts = [_text(seed) for seed in range(3)]
+    for key, text in zip("abc", texts):
+        lsh.add("invoice", key, lsh.signature(text))
+
+    assert lsh.query("invoice", lsh.signature(texts[0]), threshold=0.5) == []
+    assert all("a" not in bucket for bucket in lsh._buckets.values())
+    assert [key for key, _ in lsh.query("invoice", lsh.signature(texts[2]), threshold=0.5)] == ["c"]
+
+
+def test_re_adding_an_entry_refreshes_it():
+    lsh = _lsh(max_entries=2)
+    texts = [_text(seed) for seed in range(3)]
+    lsh.add("invoice", "a", lsh.signature(texts[0]))
+    lsh.add("invoice", "b", lsh.signature(texts[1]))
+    lsh.add("invoice", "a", lsh.signature(texts[0]))
+    lsh.add("invoice", "c", lsh.signature(texts[2]))
+
+    assert [key for key, _ in lsh.query("invoice", lsh.signature(texts[0]), threshold=0.5)] == ["a"]
+    assert lsh.query("invoice", lsh.signature(texts[1]), threshold=0.5) == []
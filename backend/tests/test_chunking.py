@@ -0,0 +1,135 @@
+import bisect
+import random
+
+import pytest
+
+from app.services.chunking import PageChunker, smart_chunk_text, table_blocks
+
+WORDS = "alpha beta gamma delta epsilon zeta theta kappa lambda sigma".split()
+
+
+def _paragraph(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+@pytest.fixture
+def pages():
+    rng = random.Random(7)
+    return [
+        {
+            "page_no": page_no,
+            "text": "\n\n".join(_paragraph(rng, rng.randint(20, 120)) for _ in range(rng.randint(1, 5))),
+        }
+        for page_no in range(1, 9)
+    ]
+
+
+def _chunk(pages, **kwargs):
+    chunker = PageChunker(**kwargs)
+    chunks = []
+    for page in pages:
+        chunks.extend(chunker.add_page(page))
+    return chunks, chunker.finish()
+
+
+def _document(pages):
+    """The document text chunk offsets refer to, and the offset each page starts at."""
+    starts, text = [], ""
+    for page in pages:
+        starts.append(len(text))
+        text += page["text"] + "\n"
+    return text, starts
+
+
+def test_offsets_and_pages_locate_each_chunk(pages):
+    head, tail = _chunk(pages, chunk_size=300, overlap=50)
+    chunks = head + tail
+    document, starts = _document(pages)
+
+    for chunk in chunks:
+        assert document[chunk["char_start"]:chunk["char_end"]] == chunk["content"]
+        assert chunk["char_count"] == len(chunk["content"]) <= 300
+        assert chunk["start_page"] == bisect.bisect_right(starts, chunk["char_start"])
+        assert chunk["end_page"] == bisect.bisect_right(starts, chunk["char_end"] - 1)
+        assert chunk["approx_page"] == chunk["start_page"]
+    assert [chunk["chunk_num"] for chunk in chunks] == list(range(1, len(chunks) + 1))
+    # Text is carried over page breaks rather than cut at them
+    assert any(chunk["start_page"] != chunk["end_page"] for chunk in chunks)
+
+
+def test_every_word_is_covered(pages):
+    head, tail = _chunk(pages, chunk_size=300, overlap=50)
+    document, _ = _document(pages)
+    covered = bytearray(len(document))
+    for chunk in head + tail:
+        covered[chunk["char_start"]:chunk["char_end"]] = b"\1" * (chunk["char_end"] - chunk["char_start"])
+    assert all(covered[i] or c.isspace() for i, c in enumerate(document))
+
+
+def test_head_is_a_prefix_of_the_whole_document(pages):
+    head, tail = _chunk(pages, chunk_size=300, overlap=50)
+    chunks = head + tail
+    for k in range(1, len(pages) + 1):
+        partial, _ = _chunk(pages[:k], chunk_size=300, overlap=50)
+        assert partial == chunks[:len(partial)]
+
+
+def test_start_num_continues_numbering(pages):
+    head, tail = _chunk(pages, start_num=10, chunk_size=300, overlap=50)
+    assert (head + tail)[0]["chunk_num"] == 10
+
+
+def test_smart_chunk_text_splits_pages_on_form_feeds():
+    chunks = smart_chunk_text("first page\fsecond page", page_start=3)
+    assert [(chunk["start_page"], chunk["end_page"]) for chunk in chunks] == [(3, 4)]
+    assert chunks[0]["content"] == "first page\nsecond page"
+
+
+ASCII_HEADER = "+----+--------+\n| id | value  |\n+----+--------+\n"
+ASCII_ROWS = ["| {0:<2} | v{0:<5} |".format(i) for i in range(60)]
+ASCII_TABLE = ASCII_HEADER + "\n".join(ASCII_ROWS) + "\n+----+--------+"
+
+
+def test_table_blocks_repeat_the_header_and_keep_every_row_once():
+    blocks = table_blocks(ASCII_TABLE, header_lines=3, max_tokens=60)
+    header = ASCII_HEADER.rstrip("\n").split("\n")
+
+    assert len(blocks) > 1
+    rows = []
+    for content, start, end, count in blocks:
+        lines = content.split("\n")
+        assert lines[:3] == header
+        assert len(lines) - 3 == count
+        rows.extend(lines[3:])
+    # Borders between rows are dropped; data rows stay in order, none repeated
+    assert rows == ASCII_ROWS
+
+
+def test_table_blocks_offsets_cover_their_rows():
+    blocks = table_blocks(ASCII_TABLE, header_lines=3, max_tokens=60)
+
+    # The first block's span starts at the header, later ones at their first row
+    assert blocks[0][1] == 0
+    for content, start, end, _ in blocks:
+        covered = ASCII_TABLE[start:end]
+        last_row = content.split("\n")[-1]
+        assert covered.endswith(last_row)
+        assert content.split("\n")[3] in covered
+    assert [start for _, start, _, _ in blocks[1:]] == [end + 1 for _, _, end, _ in blocks[:-1]]
+
+
+def test_table_blocks_fit_in_one_block_when_small():
+    blocks = table_blocks(ASCII_TABLE, header_lines=3, max_tokens=100000)
+    assert len(blocks) == 1
+    assert blocks[0][3] == len(ASCII_ROWS)
+
+
+def test_tables_are_chunked_apart_from_text():
+    text = "Intro paragraph.\n" + ASCII_TABLE + "\nClosing paragraph."
+    chunks = smart_chunk_text(text)
+
+    tables = [chunk for chunk in chunks if chunk["has_tables"]]
+    assert tables and all(chunk["content"].startswith(ASCII_HEADER.rstrip("\n")) for chunk in tables)
+    assert sum(chunk["table_rows"] for chunk in tables) == len(ASCII_ROWS)
+    assert chunks[0]["content"].startswith("Intro paragraph.")
+    assert chunks[-1]["content"].endswith("Closing paragraph.")
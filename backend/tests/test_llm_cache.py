@@ -0,0 +1,110 @@
+import fakeredis
+import pytest
+
+from app.services import llm_cache
+from app.services.llm_cache import (
+    DiskCache,
+    LLMResponseCache,
+    MemoryLRUCache,
+    RedisCache,
+    TieredCache,
+    make_cache_key,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_cache, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "disk"])
+def make_backend(request, tmp_path):
+    def make(max_entries=100, ttl=None):
+        if request.param == "memory":
+            return MemoryLRUCache(max_entries=max_entries, ttl=ttl)
+        return DiskCache(str(tmp_path / "cache.db"), max_entries=max_entries, ttl=ttl)
+    return make
+
+
+def test_key_depends_on_model_messages_and_temperature():
+    messages = [{"role": "user", "content": "hi"}]
+    key = make_cache_key("gpt", messages, 0.0)
+    assert key == make_cache_key("gpt", [dict(m) for m in messages], 0.0)
+    assert key != make_cache_key("other", messages, 0.0)
+    assert key != make_cache_key("gpt", messages, 0.5)
+    assert key != make_cache_key("gpt", [{"role": "user", "content": "hello"}], 0.0)
+
+
+def test_get_set_delete(make_backend):
+    backend = make_backend()
+    assert backend.get("a") is None
+    backend.set("a", "1")
+    assert backend.get("a") == "1"
+    backend.delete("a")
+    assert backend.get("a") is None
+
+
+def test_entries_expire_after_ttl(make_backend, clock):
+    backend = make_backend(ttl=60)
+    backend.set("default", "1")
+    backend.set("own", "2", ttl=600)
+
+    clock.now += 61
+    assert backend.get("default") is None
+    assert backend.get("own") == "2"
+
+
+def test_least_recently_used_entry_is_evicted(make_backend, clock):
+    backend = make_backend(max_entries=2)
+    backend.set("a", "1")
+    clock.now += 1
+    backend.set("b", "2")
+    clock.now += 1
+    assert backend.get("a") == "1"  # a is now more recent than b
+    clock.now += 1
+    backend.set("c", "3")
+
+    assert backend.get("b") is None
+    assert backend.get("a") == "1"
+    assert backend.get("c") == "3"
+
+
+def test_disk_cache_persists_across_instances(tmp_path):
+    path = str(tmp_path / "cache.db")
+    DiskCache(path).set("a", "1")
+    assert DiskCache(path).get("a") == "1"
+
+
+def test_tiered_cache_fills_front_from_back():
+    front, back = MemoryLRUCache(), RedisCache(fakeredis.FakeRedis(decode_responses=True), prefix="llm:")
+    back.set("a", "1")
+    cache = TieredCache(front, back)
+
+    assert cache.get("a") == "1"
+    assert front.get("a") == "1"
+    cache.delete("a")
+    assert back.get("a") is None
+
+
+def test_broken_backend_counts_errors_instead_of_raising():
+    class Broken(MemoryLRUCache):
+        def get(self, key):
+            raise OSError("disk gone")
+
+        def set(self, key, value, ttl=None):
+            raise OSError("disk gone")
+
+    cache = LLMResponseCache(Broken())
+    assert cache.get("a") is None
+    cache.set("a", "1")
+    assert (cache.errors, cache.misses, cache.hits) == (2, 1, 0)
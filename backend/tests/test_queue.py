@@ -0,0 +1,99 @@
+import json
+
+import fakeredis
+import pytest
+
+from app.services.queue_producer import InMemoryJobQueue, Job, RedisJobQueue
+
+MAX_DELIVERIES = 3
+
+
+@pytest.fixture(params=["memory", "redis"])
+def make_queue(request):
+    def make(lease_seconds=60):
+        if request.param == "memory":
+            return InMemoryJobQueue(lease_seconds, MAX_DELIVERIES)
+        client = fakeredis.FakeRedis(decode_responses=True)
+        return RedisJobQueue(client, "test-jobs", lease_seconds, MAX_DELIVERIES)
+    return make
+
+
+def _dead(queue):
+    if isinstance(queue, InMemoryJobQueue):
+        return [job.id for job in queue.dead]
+    return [json.loads(raw)["job"]["id"] for raw in queue.redis.lrange(queue.dead_key, 0, -1)]
+
+
+def test_reserve_then_ack(make_queue):
+    queue = make_queue()
+    job_id = queue.enqueue(Job(payload={"n": 1}))
+
+    job = queue.reserve()
+    assert job.id == job_id and job.payload == {"n": 1}
+    assert job.attempts == 1 and job.lease
+    assert queue.reserve() is None
+
+    assert queue.ack(job)
+    assert queue.reserve() is None
+    assert not queue.ack(job)
+
+
+def test_expired_lease_is_redelivered(make_queue):
+    queue = make_queue(lease_seconds=0)
+    job_id = queue.enqueue(Job(payload={}))
+
+    first = queue.reserve()
+    second = queue.reserve()
+    assert second.id == job_id
+    assert second.attempts == 2
+    assert second.lease != first.lease
+
+
+def test_stale_delivery_cannot_settle_or_renew_the_redelivered_job(make_queue):
+    queue = make_queue(lease_seconds=0)
+    queue.enqueue(Job(payload={}))
+    stale = queue.reserve()
+    live = queue.reserve()
+
+    assert not queue.ack(stale)
+    assert not queue.nack(stale, "stale")
+    assert not queue.extend_lease(stale)
+    assert _dead(queue) == []
+
+    assert queue.extend_lease(live)
+    assert queue.ack(live)
+
+
+def test_extended_lease_is_not_redelivered(make_queue):
+    queue = make_queue(lease_seconds=60)
+    queue.enqueue(Job(payload={}))
+    job = queue.reserve()
+
+    assert queue.extend_lease(job)
+    assert queue.reserve() is None
+
+
+def test_nack_requeues_until_max_deliveries_then_dead_letters(make_queue):
+    queue = make_queue()
+    job_id = queue.enqueue(Job(payload={}))
+
+    for attempt in range(1, MAX_DELIVERIES):
+        job = queue.reserve()
+        assert job.attempts == attempt
+        assert not queue.nack(job, "boom")
+
+    job = queue.reserve()
+    assert job.attempts == MAX_DELIVERIES
+    assert queue.nack(job, "boom")
+    assert _dead(queue) == [job_id]
+    assert queue.reserve() is None
+
+
+def test_nack_without_retry_dead_letters_at_once(make_queue):
+    queue = make_queue()
+    job_id = queue.enqueue(Job(payload={}))
+
+    job = queue.reserve()
+    assert queue.nack(job, "upload missing", retry=False)
+    assert _dead(queue) == [job_id]
+    assert queue.reserve() is None
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from contextlib import aclosing
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils.retry_logic import AdaptiveRateLimiter, acall_with_retry, astream_with_retry, call_with_retry
+
+
+def _limiter(**kwargs):
+    return AdaptiveRateLimiter(**{"rpm": 1000, "tpm": 100000, "max_concurrency": 4, **kwargs})
+
+
+def test_window_caps_calls_in_flight():
+    limiter = _limiter(max_concurrency=2)
+    assert limiter._try_acquire(10) == 0
+    assert limiter._try_acquire(10) == 0
+    assert limiter._try_acquire(10) > 0
+    assert limiter.in_flight == 2
+
+    limiter.release(0.1)
+    assert limiter._try_acquire(10) == 0
+
+
+def test_rate_limit_halves_window_and_pauses_callers():
+    limiter = _limiter(max_concurrency=8)
+    limiter.acquire(10)
+    limiter.release(0.1, rate_limited=True, retry_after=30)
+
+    assert limiter.concurrency == 4
+    assert limiter.in_flight == 0
+    assert limiter._try_acquire(10) > 25
+
+
+def test_window_grows_back_after_a_full_window_of_fast_calls():
+    limiter = _limiter(max_concurrency=8)
+    limiter.concurrency = 2
+    for _ in range(2):
+        limiter.acquire(10)
+        limiter.release(0.1)
+    assert limiter.concurrency == 3
+
+
+def test_slow_calls_shrink_window():
+    limiter = _limiter(target_latency=1.0)
+    limiter.acquire(10)
+    limiter.release(5.0)
+    assert limiter.concurrency == 3
+
+
+def test_token_bucket_waits_for_quota_and_takes_back_unused_tokens():
+    limiter = _limiter(tpm=600)
+    limiter.acquire(500)
+    assert limiter._try_acquire(500) > 0
+
+    limiter.release(0.1, unused_tokens=400)
+    assert limiter._try_acquire(500) == 0
+
+
+def test_call_with_retry_charges_actual_usage():
+    class Usage:
+        total_tokens = 100
+
+    class Result:
+        usage = Usage()
+
+    limiter = _limiter(tpm=1000)
+    call_with_retry(lambda: Result(), tokens=600, limiter=limiter)
+    assert limiter.in_flight == 0
+    assert limiter.tokens.level == pytest.approx(900, abs=1)
+
+
+def test_cancelled_async_call_releases_its_slot():
+    limiter = _limiter(max_concurrency=1)
+
+    async def hang():
+        await asyncio.sleep(60)
+
+    async def run():
+        task = asyncio.create_task(acall_with_retry(hang, tokens=10, limiter=limiter))
+        await asyncio.sleep(0.01)
+        assert limiter.in_flight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = time.monotonic()
+    asyncio.run(run())
+    assert time.monotonic() - start < 5
+    assert limiter.in_flight == 0
+
+
+class FakeStream:
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for event in self.events:
+            yield event
+
+    async def close(self):
+        self.closed = True
+
+
+def _stream(total_tokens=None):
+    events = [SimpleNamespace(usage=None, content=text) for text in ("a", "b")]
+    if total_tokens:
+        events.append(SimpleNamespace(usage=SimpleNamespace(total_tokens=total_tokens), content=None))
+    return FakeStream(events)
+
+
+def test_stream_holds_its_slot_until_consumed_and_charges_reported_usage():
+    limiter = _limiter(tpm=1000)
+    stream = _stream(total_tokens=100)
+
+    async def opener():
+        return stream
+
+    async def run():
+        seen = []
+        async for event in astream_with_retry(opener, tokens=600, limiter=limiter):
+            seen.append(limiter.in_flight)
+        return seen
+
+    assert asyncio.run(run()) == [1, 1, 1]
+    assert stream.closed
+    assert limiter.in_flight == 0
+    assert limiter.tokens.level == pytest.approx(900, abs=1)
+
+
+def test_closing_a_stream_early_releases_its_slot():
+    limiter = _limiter(tpm=1000)
+    stream = _stream()
+
+    async def opener():
+        return stream
+
+    async def run():
+        async with aclosing(astream_with_retry(opener, tokens=600, limiter=limiter)) as events:
+            async for _ in events:
+                assert limiter.in_flight == 1
+                break
+
+    asyncio.run(run())
+    assert stream.closed
+    assert limiter.in_flight == 0
+    # Nothing reported, so the whole reservation stays charged
+    assert limiter.tokens.level == pytest.approx(400, abs=1)
@@ -0,0 +1,27 @@
+import pytest
+
+from app.services import upload_storage
+from app.services.upload_storage import MissingUploadError, resolve_storage_key, storage_key
+
+
+@pytest.fixture(autouse=True)
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_storage.settings, "upload_dir", str(tmp_path))
+    return tmp_path
+
+
+def test_storage_key_resolves_under_upload_dir(upload_dir):
+    key = storage_key("1234")
+    (upload_dir / key).write_bytes(b"%PDF-1.7")
+    assert resolve_storage_key(key) == upload_dir / key
+
+
+def test_missing_upload_fails_with_a_clear_error():
+    with pytest.raises(MissingUploadError, match="must share UPLOAD_DIR"):
+        resolve_storage_key(storage_key("1234"))
+
+
+@pytest.mark.parametrize("key", ["", "../1234.pdf", "/etc/passwd"])
+def test_keys_outside_upload_dir_are_rejected(key):
+    with pytest.raises(MissingUploadError, match="Invalid"):
+        resolve_storage_key(key)
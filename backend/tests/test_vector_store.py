@@ -0,0 +1,92 @@
+import pytest
+
+from app.services.embeddings import EmbeddingService, HashEmbedder
+from app.services.vector_store import FallbackVectorStore, LocalVectorStore, VectorStore
+
+CHUNKS = [
+    {"chunk_num": 1, "approx_page": 1, "content": "Invoice total due within thirty days of delivery"},
+    {"chunk_num": 2, "approx_page": 1, "content": "The tenant shall pay rent on the first day of each month"},
+    {"chunk_num": 3, "approx_page": 2, "content": "Shipping address and delivery instructions for the warehouse"},
+]
+
+
+def _embeddings():
+    return EmbeddingService(HashEmbedder(dimensions=64), cache=None, batch_size=16)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalVectorStore(str(tmp_path / "vectors"), _embeddings())
+    store.upsert("doc-a", "a.pdf", CHUNKS, "invoice")
+    return store
+
+
+def test_search_ranks_the_matching_chunk_first(store):
+    hits = store.search("rent tenant month", limit=2)
+    assert hits[0]["chunk_num"] == 2
+    assert hits[0]["pdf_id"] == "doc-a" and hits[0]["filename"] == "a.pdf"
+    assert len(hits) == 2
+
+
+def test_filters_restrict_candidates(store):
+    store.upsert("doc-b", "b.pdf", CHUNKS[:1], "lease")
+    hits = store.search("invoice total", filters=[("doc_type", "lease")])
+    assert [(hit["pdf_id"], hit["chunk_num"]) for hit in hits] == [("doc-b", 1)]
+    assert store.search("invoice", filters=[("pdf_id", "missing")]) == []
+
+
+def test_upsert_replaces_a_chunk_in_place(store):
+    store.upsert("doc-a", "a.pdf", [{**CHUNKS[0], "content": "Replaced paragraph about penalties"}], "invoice")
+    assert len(store) == len(CHUNKS)
+    contents = {hit["content"] for hit in store.search("invoice penalties", limit=10)}
+    assert "Replaced paragraph about penalties" in contents
+    assert CHUNKS[0]["content"] not in contents
+
+
+def test_another_instance_sees_writes_in_the_same_directory(store, tmp_path):
+    other = LocalVectorStore(str(tmp_path / "vectors"), _embeddings())
+    assert len(other) == len(CHUNKS)
+    other.upsert("doc-b", "b.pdf", CHUNKS[:1], "invoice")
+    assert {hit["pdf_id"] for hit in store.search("invoice total", limit=10)} == {"doc-a", "doc-b"}
+
+
+def test_clone_copies_a_documents_rows(store):
+    store.clone("doc-a", "doc-c", "c.pdf")
+    hits = store.search("warehouse delivery", filters=[("pdf_id", "doc-c")])
+    assert {hit["chunk_num"] for hit in hits} == {1, 2, 3}
+    assert {hit["filename"] for hit in hits} == {"c.pdf"}
+
+
+def test_another_embedder_starts_empty(store, tmp_path):
+    other = LocalVectorStore(str(tmp_path / "vectors"), EmbeddingService(HashEmbedder(dimensions=32), cache=None, batch_size=16))
+    assert len(other) == 0
+    other.upsert("doc-b", "b.pdf", CHUNKS[:1], "invoice")
+    assert [hit["pdf_id"] for hit in other.search("invoice")] == ["doc-b"]
+
+
+class Broken(VectorStore):
+    def upsert(self, pdf_id, filename, chunks, doc_type):
+        raise ConnectionError("down")
+
+    def search(self, query, filters=None, limit=6):
+        raise ConnectionError("down")
+
+    def clone(self, src_pdf_id, dst_pdf_id, filename):
+        raise ConnectionError("down")
+
+
+def test_fallback_serves_searches_from_the_mirror(store):
+    fallback = FallbackVectorStore(Broken(), store)
+    assert fallback.search("rent tenant month", limit=1)[0]["chunk_num"] == 2
+
+
+def test_mirror_failures_do_not_fail_writes(store):
+    fallback = FallbackVectorStore(store, Broken())
+    fallback.upsert("doc-b", "b.pdf", CHUNKS[:1], "invoice")
+    fallback.clone("doc-b", "doc-c", "c.pdf")
+    assert len(store) == len(CHUNKS) + 2
+
+
+def test_primary_write_failures_propagate(store):
+    with pytest.raises(ConnectionError):
+        FallbackVectorStore(Broken(), store).upsert("doc-b", "b.pdf", CHUNKS[:1], "invoice")